@@ -0,0 +1,431 @@
+import heapq
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import metrics
+from detection_scale import DetectionScales
+
+DETECTORS = ("hog", "cnn", "mediapipe")
+
+
+def default_workers():
+    """All cores but one, which stays with capture, matching and display."""
+    return max((os.cpu_count() or 2) - 1, 1)
+
+
+_preload = ["analysis_pool", "face_recognition"]
+
+
+def worker_context(detector=None):
+    """
+    The multiprocessing context for processes that run the models.
+
+    Callers have threads running (capture, gallery watcher), so they are not forked;
+    a fork server imports the models once and forks the workers from there, which
+    shares the loaded models between them. The fork server is started once per process
+    with the preload list of that moment, so every user asks for what it needs here and
+    the list only grows: face_recognition always, mediapipe for the MediaPipe detector.
+    """
+    if "forkserver" not in mp.get_all_start_methods():
+        return mp.get_context("spawn")
+    if detector == "mediapipe" and "mediapipe" not in _preload:
+        _preload.append("mediapipe")
+    context = mp.get_context("forkserver")
+    context.set_forkserver_preload(list(_preload))
+    return context
+
+
+def mediapipe_locations(results, shape):
+    """Convert MediaPipe detections to face_recognition (top, right, bottom, left) boxes."""
+    locations = []
+    if not results.detections:
+        return locations
+    ih, iw = shape[:2]
+    for detection in results.detections:
+        # Mediapipe returns normalized box coordinates
+        bboxC = detection.location_data.relative_bounding_box
+        x_min = int(bboxC.xmin * iw)
+        y_min = int(bboxC.ymin * ih)
+        width = int(bboxC.width * iw)
+        height = int(bboxC.height * ih)
+        locations.append((y_min, x_min + width, y_min + height, x_min))
+    return locations
+
+
+def mediapipe_keypoints(results, shape):
+    """The six keypoints (eyes, nose tip, mouth, ears) of each MediaPipe detection, in pixels."""
+    if not results.detections:
+        return []
+    ih, iw = shape[:2]
+    return [[(point.x * iw, point.y * ih) for point in detection.location_data.relative_keypoints]
+            for detection in results.detections]
+
+
+def make_detector(detector, keypoints=False):
+    """
+    Return detect(rgb_frame) -> [(top, right, bottom, left), ...] for a DETECTORS name.
+
+    With keypoints=True, detect() returns (locations, keypoints) instead; keypoints is
+    None for the face_recognition detectors, which do not produce any.
+    """
+    import face_recognition
+    if detector == "mediapipe":
+        import mediapipe
+        face_detection = mediapipe.solutions.face_detection.FaceDetection(
+            model_selection=0, min_detection_confidence=0.5)
+        if keypoints:
+            def detect(rgb):
+                results = face_detection.process(rgb)
+                return mediapipe_locations(results, rgb.shape), mediapipe_keypoints(results, rgb.shape)
+            return detect
+        return lambda rgb: mediapipe_locations(face_detection.process(rgb), rgb.shape)
+    if keypoints:
+        return lambda rgb: (face_recognition.face_locations(rgb, model=detector), None)
+    return lambda rgb: face_recognition.face_locations(rgb, model=detector)
+
+
+def _attach(name):
+    try:
+        # Python 3.13+: do not let this process's resource tracker unlink the block
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker(tasks, results, detector, scales, quality, encoder):
+    import face_recognition
+    # The frames' block is named in each task: workers launched ahead of the first frame
+    # attach it then
+    memory = attached = None
+    detect = make_detector(detector, keypoints=True)
+    face_encodings = face_recognition.face_encodings
+    if encoder is not None:
+        from encoding_service import EncodingClient
+        face_encodings = EncodingClient(encoder).face_encodings
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, memory_name, slot_bytes, shape, hints = task
+            if memory_name != attached:
+                if memory is not None:
+                    memory.close()
+                memory, attached = _attach(memory_name), memory_name
+            timings = {}
+            passes = 0
+            cpu_started = time.process_time()
+            try:
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf, offset=slot * slot_bytes)
+                face_locations, keypoints, passes = scales.locate(frame, detect, timings)
+
+                # Encoded from the full-resolution frame, whatever scale the faces were found at,
+                # and only for the faces the tracker will ask for
+                started = time.perf_counter()
+                checked = list(range(len(face_locations))) if hints is None else hints.select(face_locations)
+                encodings, rejected = [None] * len(face_locations), [None] * len(face_locations)
+                if checked:
+                    locations = [face_locations[i] for i in checked]
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    if quality is None:
+                        found = [np.asarray(e, dtype=np.float32) for e in face_encodings(rgb_frame, locations)]
+                        reasons = [None] * len(checked)
+                    else:
+                        points = None if keypoints is None else [keypoints[i] for i in checked]
+                        found, reasons = quality.encode_faces(rgb_frame, locations, points, face_encodings)
+                    for i, encoding, reason in zip(checked, found, reasons):
+                        encodings[i], rejected[i] = encoding, reason
+                del frame
+                timings["encode"] = time.perf_counter() - started
+                results.put((seq, slot, face_locations, encodings, rejected, timings,
+                             {"passes": passes, "checked": checked, "cpu_seconds": time.process_time() - cpu_started},
+                             None))
+            except Exception as e:
+                frame = None
+                results.put((seq, slot, [], [], [], timings,
+                             {"passes": passes, "checked": [], "cpu_seconds": time.process_time() - cpu_started},
+                             repr(e)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if memory is not None:
+            memory.close()
+
+
+class AnalysisResult:
+    def __init__(self, seq, frame_index, face_locations, face_encodings, rejected, timings, cpu_seconds, error):
+        self.seq = seq
+        self.frame_index = frame_index
+        self.face_locations = face_locations
+        # None for the faces the quality gate or the tracker hints kept from being encoded
+        self.face_encodings = face_encodings
+        # Per face, why the quality gate rejected it (None if it passed or was not checked)
+        self.rejected = rejected
+        # Per stage wall seconds, and the CPU seconds the worker spent on the frame
+        self.timings = timings
+        self.cpu_seconds = cpu_seconds
+        self.error = error
+
+    def encodings_for(self, locations):
+        """
+        Encodings for a subset of face_locations, as FaceTracker.identify() asks for them
+        (None for faces rejected by the quality gate or skipped on the tracker's hints).
+        """
+        by_location = dict(zip(map(tuple, self.face_locations), self.face_encodings))
+        return [by_location[tuple(location)] for location in locations]
+
+
+class AnalysisPool:
+    """
+    Detection and 128-d encoding on a pool of worker processes.
+
+    Frames go to the workers through a ring of slots in one shared memory block: submit()
+    copies the frame into a free slot and only its place and shape are sent, so images are
+    never pickled. Results come back tagged with their sequence number and results()
+    hands them out in submission order. When every slot is busy, submit() drops the frame
+    (the camera is ahead of the workers) instead of queueing it.
+
+    Faces are detected on the frame resized by scale, a factor or a coarse-to-fine list of
+    them, or at the scale min_face_size calls for (see detection_scale.DetectionScales),
+    and encoded from the full-resolution frame. Face locations are in frame coordinates.
+
+    With hints from tracker.FaceTracker.encoding_hints(), the workers only encode the faces
+    of new tracks and of tracks due for a retry or re-verification (faces_tracked counts
+    the others). With a face_quality.QualityGate as quality, they only encode the faces
+    that pass it; stats() then reports how many encodings were saved and why.
+
+    With an encoding_service.EncodingService (or its endpoint) as encoder, the workers
+    send the faces' chips there to be encoded in batches with other frames and cameras.
+
+    context replaces worker_context(): a process that imported the models before starting
+    any thread can pass the fork context and launch() the workers from itself.
+    """
+
+    def __init__(self, workers=None, detector="hog", scale=0.5, min_face_size=None, slots=None, quality=None,
+                 encoder=None, context=None):
+        if detector not in DETECTORS:
+            raise ValueError(f"Unknown detector {detector!r}; use one of {DETECTORS}")
+        self.workers = workers or default_workers()
+        self.detector = detector
+        self.scales = DetectionScales(scale, min_face_size, detector)
+        self.quality = quality
+        self.encoder = getattr(encoder, "endpoint", encoder)
+        # One frame being analyzed and one waiting per worker
+        self.slots = slots or self.workers * 2
+        self.context = context or worker_context(detector)
+
+        self.memory = None
+        self.slot_bytes = 0
+        self.processes = []
+        self.ready = threading.Event()
+        self.ready_seconds = None  # from start() until the workers were up
+        self._starter = None
+        self.tasks = None
+        self.results_queue = None
+        self.free_slots = []
+        self.frame_indices = {}
+        self.pending = []  # heap of results that arrived ahead of their turn
+        self.next_seq = 0  # next sequence number to hand out
+        self.submitted = 0
+
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_warming = 0
+        self.errors = 0
+        self.faces_encoded = 0
+        self.faces_tracked = 0
+        self.frames_analyzed = 0
+        self.detect_passes = 0
+        self.stage_seconds = {}
+
+    def start(self, frame_shape):
+        """
+        Allocate slots for frames of frame_shape (h, w, 3) and start the workers.
+
+        Returns at once: the first start of the fork server imports the models, which
+        takes seconds, so the workers are started from a background thread. Until they
+        are up (see ready and wait_ready()) submit() turns frames away.
+        """
+        self.slot_bytes = int(np.prod(frame_shape))
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slot_bytes * self.slots)
+        self.free_slots = list(range(self.slots))
+        if self.tasks is None:
+            self.tasks = self.context.Queue()
+            self.results_queue = self.context.Queue()
+            self._starter = threading.Thread(target=self._start_workers, name="AnalysisPoolStart", daemon=True)
+            self._starter.start()
+
+    def launch(self):
+        """
+        Start the workers now, from the calling thread, ahead of the first frame.
+
+        With the fork context the workers share the models this process has imported;
+        it must not have started any thread yet.
+        """
+        if self.tasks is None:
+            self.tasks = self.context.Queue()
+            self.results_queue = self.context.Queue()
+            self._start_workers()
+
+    def _start_workers(self):
+        started = time.perf_counter()
+        processes = []
+        for i in range(self.workers):
+            process = self.context.Process(
+                target=_worker, name=f"analysis-{i}",
+                args=(self.tasks, self.results_queue, self.detector, self.scales, self.quality, self.encoder),
+                daemon=True)
+            process.start()
+            processes.append(process)
+        self.processes = processes
+        self.ready_seconds = time.perf_counter() - started
+        self.ready.set()
+        levels = ", ".join(f"{level:g}" for level in self.scales.levels)
+        print(f"Started {self.workers} analysis workers ({self.detector} at scale {levels}) "
+              f"in {self.ready_seconds:.2f}s")
+
+    def wait_ready(self, timeout=None):
+        """Block until the workers are up; returns False on timeout or before start()/launch()."""
+        return self.tasks is not None and self.ready.wait(timeout)
+
+    def in_flight(self):
+        return self.submitted - self.next_seq
+
+    def submit(self, frame, frame_index, hints=None):
+        """
+        Queue frame for analysis; returns False when no slot is free (counted as a drop)
+        or while the workers are still starting (counted as warming).
+
+        hints (tracker.EncodingHints) limits the encodings to the faces the tracker needs.
+        """
+        if self.memory is None:
+            self.start(frame.shape)
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame {frame.shape} {frame.dtype} does not fit the {self.slot_bytes}-byte slots")
+        if not self.ready.is_set():
+            self.frames_warming += 1
+            return False
+        self._collect()
+        if not self.free_slots:
+            if not all(process.is_alive() for process in self.processes):
+                # Its frame would never come back and the results would stall behind it
+                raise RuntimeError("An analysis worker died")
+            self.frames_dropped += 1
+            return False
+        slot = self.free_slots.pop()
+        target = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.memory.buf, offset=slot * self.slot_bytes)
+        np.copyto(target, frame)
+        del target
+        seq = self.submitted
+        self.submitted += 1
+        self.frame_indices[seq] = frame_index
+        self.tasks.put((seq, slot, self.memory.name, self.slot_bytes, frame.shape, hints))
+        self.frames_submitted += 1
+        return True
+
+    def _collect(self, timeout=None):
+        while True:
+            try:
+                if timeout is None:
+                    item = self.results_queue.get_nowait()
+                else:
+                    item = self.results_queue.get(timeout=timeout)
+                    timeout = None
+            except queue.Empty:
+                return
+            seq, slot, face_locations, face_encodings, rejected, timings, info, error = item
+            self.free_slots.append(slot)
+            self.frames_analyzed += 1
+            self.detect_passes += info["passes"]
+            self.faces_encoded += sum(encoding is not None for encoding in face_encodings)
+            self.faces_tracked += len(face_locations) - len(info["checked"])
+            if self.quality is not None:
+                self.quality.count([rejected[i] for i in info["checked"]])
+            if error:
+                self.errors += 1
+                print(f"Analysis of frame {self.frame_indices.get(seq)} failed: {error}")
+            for name, seconds in timings.items():
+                metrics.observe(name, seconds)
+                previous = self.stage_seconds.get(name)
+                self.stage_seconds[name] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+            heapq.heappush(self.pending, (seq, face_locations, face_encodings, rejected, timings,
+                                          info["cpu_seconds"], error))
+
+    def results(self, timeout=None):
+        """
+        Return the finished results that are next in submission order (possibly none).
+        With a timeout, waits up to that long for the first one.
+        """
+        if self.memory is None:
+            return []
+        if not self.ready.is_set():
+            if timeout:
+                self.ready.wait(timeout)
+            return []
+        self._collect()
+        if timeout and self.in_flight() and not (self.pending and self.pending[0][0] == self.next_seq):
+            deadline = time.perf_counter() + timeout
+            while not (self.pending and self.pending[0][0] == self.next_seq):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._collect(timeout=remaining)
+        ready = []
+        while self.pending and self.pending[0][0] == self.next_seq:
+            seq, face_locations, face_encodings, rejected, timings, cpu_seconds, error = heapq.heappop(self.pending)
+            ready.append(AnalysisResult(seq, self.frame_indices.pop(seq), face_locations,
+                                        face_encodings, rejected, timings, cpu_seconds, error))
+            self.next_seq += 1
+        return ready
+
+    def drain(self, timeout=5.0):
+        """Wait for every submitted frame and return the remaining results in order."""
+        ready = []
+        deadline = time.perf_counter() + timeout
+        while self.in_flight() and time.perf_counter() < deadline:
+            ready.extend(self.results(timeout=deadline - time.perf_counter()))
+        return ready
+
+    def stats(self):
+        stats = {
+            "frames_submitted": self.frames_submitted,
+            "frames_dropped": self.frames_dropped,
+            "frames_warming": self.frames_warming,
+            "ready": self.ready.is_set(),
+            "in_flight": self.in_flight(),
+            "errors": self.errors,
+            "faces_encoded": self.faces_encoded,
+            "faces_tracked": self.faces_tracked,
+            "detection_scales": self.scales.levels,
+            "stage_ms": {name: seconds * 1e3 for name, seconds in self.stage_seconds.items()},
+        }
+        if self.quality is not None:
+            quality = self.quality.stats()
+            stats["encodings_saved"] = quality["encodings_saved"]
+            stats["quality_rejected"] = quality["rejected"]
+        if len(self.scales.levels) > 1:
+            stats["detect_passes_per_frame"] = self.detect_passes / max(self.frames_analyzed, 1)
+        return stats
+
+    def close(self):
+        if self._starter is not None:
+            self._starter.join()
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
@@ -0,0 +1,99 @@
+import time
+
+import cv2
+
+import metrics
+
+MODES = ("pixelate", "blur", "fill")
+
+
+def clip_box(box, shape, padding=0.0):
+    """
+    Grow a (top, right, bottom, left) box by padding (a fraction of its size) and clip it
+    to a frame of shape; returns None when nothing of it is inside the frame.
+    """
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * padding)
+    pad_x = int((right - left) * padding)
+    height, width = shape[:2]
+    top, bottom = max(int(top) - pad_y, 0), min(int(bottom) + pad_y, height)
+    left, right = max(int(left) - pad_x, 0), min(int(right) + pad_x, width)
+    if bottom <= top or right <= left:
+        return None
+    return top, right, bottom, left
+
+
+class Anonymizer:
+    """
+    Hides faces in a frame, in place.
+
+    Modes, all far cheaper than a 99x99 Gaussian blur of the full-resolution crop:
+      pixelate  shrink the face to about `strength` blocks across and scale it back up
+      blur      box blur the face at 1/8 resolution and scale it back up
+      fill      paint the box with a solid color
+    Boxes are full-frame (top, right, bottom, left), grown by padding and clipped to the
+    frame. apply() handles every face of a frame in one call; call it before drawing
+    boxes and labels so those stay sharp. The time spent per frame is kept for stats()
+    and the "anonymize" metrics stage.
+    """
+
+    def __init__(self, mode="pixelate", strength=10, padding=0.1, color=(0, 0, 0)):
+        if mode not in MODES:
+            raise ValueError(f"Unknown anonymization mode {mode!r}; use one of {MODES}")
+        self.mode = mode
+        self.strength = strength
+        self.padding = padding
+        self.color = color
+        self.frames = 0
+        self.faces = 0
+        self.seconds = 0.0
+        self.last_ms = 0.0
+
+    def _pixelate(self, region):
+        height, width = region.shape[:2]
+        blocks = max(self.strength, 1)
+        small = cv2.resize(region, (min(blocks, width), min(max(blocks * height // max(width, 1), 1), height)),
+                           interpolation=cv2.INTER_AREA)
+        region[:] = cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+    def _blur(self, region):
+        height, width = region.shape[:2]
+        small = cv2.resize(region, (max(width // 8, 1), max(height // 8, 1)), interpolation=cv2.INTER_AREA)
+        kernel = max(min(small.shape[:2]) // 2, 1)
+        small = cv2.blur(small, (kernel, kernel))
+        region[:] = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    def apply(self, frame, boxes):
+        """Anonymize every box of frame; returns the number of faces hidden."""
+        started = time.perf_counter()
+        hidden = 0
+        for box in boxes:
+            box = clip_box(box, frame.shape, self.padding)
+            if box is None:
+                continue
+            top, right, bottom, left = box
+            region = frame[top:bottom, left:right]
+            if self.mode == "fill":
+                # Drawn by OpenCV: numpy broadcasting a per-channel color is ~50x slower
+                cv2.rectangle(frame, (left, top), (right - 1, bottom - 1), self.color, cv2.FILLED)
+            elif self.mode == "blur":
+                self._blur(region)
+            else:
+                self._pixelate(region)
+            hidden += 1
+        seconds = time.perf_counter() - started
+        self.frames += 1
+        self.faces += hidden
+        self.seconds += seconds
+        self.last_ms = seconds * 1e3
+        metrics.observe("anonymize", seconds)
+        return hidden
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "frames": self.frames,
+            "faces": self.faces,
+            "ms_per_frame": self.seconds / self.frames * 1e3 if self.frames else 0.0,
+            "last_ms": self.last_ms,
+        }
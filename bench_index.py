@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import face_index
+from matcher import pairwise_distances, top_k_smallest
+
+# Synthetic encodings roughly on the scale of dlib's: different people sit ~1.4 apart,
+# probes of an enrolled person ~0.3 from their gallery encoding (well under 0.6).
+GALLERY_SPREAD = 0.09
+PROBE_NOISE = 0.025
+
+
+def synthetic_gallery(size, seed=0, chunk=100000):
+    rng = np.random.default_rng(seed)
+    gallery = np.empty((size, 128), dtype=np.float32)
+    for start in range(0, size, chunk):
+        n = min(chunk, size - start)
+        gallery[start:start + n] = rng.normal(0.0, GALLERY_SPREAD, (n, 128))
+    return gallery
+
+
+def synthetic_probes(gallery, count, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), size=count, replace=len(gallery) < count)
+    probes = gallery[rows] + rng.normal(0.0, PROBE_NOISE, (count, 128)).astype(np.float32)
+    return probes
+
+
+def exact_neighbours(gallery, probes, chunk=16):
+    sq_norms = np.einsum('ij,ij->i', gallery, gallery)
+    truth = np.empty(len(probes), dtype=np.int64)
+    for start in range(0, len(probes), chunk):
+        columns, _ = top_k_smallest(pairwise_distances(probes[start:start + chunk], gallery, sq_norms), 1)
+        truth[start:start + chunk] = columns[:, 0]
+    return truth
+
+
+def measure(index, probes, truth):
+    # One face per search call, as in a live frame with a single person
+    latencies = np.empty(len(probes))
+    found = np.empty(len(probes), dtype=np.int64)
+    for i, probe in enumerate(probes):
+        started = time.perf_counter()
+        rows, _ = index.search(probe[None, :], 1)
+        latencies[i] = time.perf_counter() - started
+        found[i] = rows[0, 0]
+    return {
+        "recall_at_1": float(np.mean(found == truth)),
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p95_ms": float(np.percentile(latencies, 95) * 1e3),
+        "memory_mb": index.memory_bytes() / 2**20,
+    }
+
+
+def run(sizes, probes_per_size, nprobes, kinds, rerank=32):
+    results = []
+    tmp_dir = tempfile.TemporaryDirectory()
+    for size in sizes:
+        print(f"\nGallery size {size:,}")
+        gallery = synthetic_gallery(size)
+        probes = synthetic_probes(gallery, probes_per_size)
+        truth = exact_neighbours(gallery, probes)
+        # Indexes are built over a memory-mapped matrix, like the gallery store's
+        path = os.path.join(tmp_dir.name, "gallery_encodings.npy")
+        np.save(path, gallery)
+        del gallery
+        gallery = np.load(path, mmap_mode='r')
+
+        configs = []
+        for kind in kinds:
+            if kind == "ivf":
+                configs.extend(("ivf", {"nprobe": nprobe}) for nprobe in nprobes)
+            elif kind in ("int8", "float16"):
+                configs.append((kind, {"rerank": rerank}))
+            else:
+                configs.append((kind, {}))
+
+        ivf = None
+        for kind, params in configs:
+            started = time.perf_counter()
+            if kind == "ivf" and ivf is not None:
+                # Reuse the trained lists, only the number of probed lists changes
+                ivf.nprobe = params["nprobe"]
+                index = ivf
+            else:
+                try:
+                    index = face_index.create_index(kind, **params).build(gallery)
+                except ImportError as e:
+                    print(f"  skipping {kind}: {e}")
+                    continue
+                if kind == "ivf":
+                    ivf = index
+            build_seconds = time.perf_counter() - started
+
+            row = {"size": size, "index": kind, **params, "build_s": round(build_seconds, 3)}
+            row.update(measure(index, probes, truth))
+            results.append(row)
+            label = kind + "".join(f" {name}={value}" for name, value in params.items())
+            print(f"  {label:<16} recall@1 {row['recall_at_1']:.3f}  "
+                  f"p50 {row['p50_ms']:.3f} ms  p95 {row['p95_ms']:.3f} ms  "
+                  f"memory {row['memory_mb']:.1f} MB  build {build_seconds:.2f}s")
+            del index
+        ivf = None
+        del gallery
+    tmp_dir.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recall (agreement with exact search), latency and memory of the face index "
+                    "backends on synthetic 128-d encodings.")
+    parser.add_argument("--sizes", default="1000,100000,1000000",
+                        help="comma-separated gallery sizes (default: 1k, 100k, 1M)")
+    parser.add_argument("--probes", type=int, default=200, help="query faces per gallery size")
+    parser.add_argument("--nprobe", default="1,4,8,16,32", help="IVF lists probed per query")
+    parser.add_argument("--index", default="brute,tree,ivf,int8,float16", help="backends to compare")
+    parser.add_argument("--rerank", type=int, default=32,
+                        help="candidates re-scored in float32 by the int8/float16 indexes")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        probes_per_size=args.probes,
+        nprobes=[int(n) for n in args.nprobe.split(",")],
+        kinds=args.index.split(","),
+        rerank=args.rerank,
+    )
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
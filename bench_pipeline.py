@@ -0,0 +1,412 @@
+import argparse
+import json
+import os
+import platform
+import queue
+import sys
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import face_index
+import gallery
+from analysis_pool import AnalysisPool, make_detector
+from anonymize import Anonymizer
+from encoding_service import EncodingService
+from bench_index import synthetic_gallery
+from detection_scale import DetectionScales
+from face_quality import QualityGate
+from matcher import FaceMatcher
+from tracker import FaceTracker
+
+# What each script does per analyzed frame
+PIPELINES = {
+    "main": {"detector": "hog", "index": None, "unknown_confidence": 1.0, "anonymize": "pixelate", "log": True},
+    "mediapipe": {"detector": "mediapipe", "index": None, "unknown_confidence": 1.0, "anonymize": None, "log": False},
+    "mediapipe_faster": {"detector": "mediapipe", "index": "ivf", "unknown_confidence": 100.0,
+                         "anonymize": None, "log": False},
+}
+STAGES = ("resize", "detect", "encode", "match", "render", "log")
+FRAME_SIZE = 720
+SCALE = 0.5
+MIN_CONFIDENCE = 75.0
+
+
+def synthetic_frames(known_faces_dir, count, faces_per_frame, size=FRAME_SIZE, seed=0):
+    """
+    Frames with faces_per_frame enrolled photos pasted on a grey background, drifting a few
+    pixels per frame so the trackers see motion.
+    """
+    paths = sorted(
+        os.path.join(known_faces_dir, name) for name in os.listdir(known_faces_dir)
+        if name.lower().endswith(gallery.IMAGE_EXTENSIONS))
+    photos = [photo for photo in (cv2.imread(path) for path in paths) if photo is not None]
+    if not photos:
+        raise ValueError(f"No images in {known_faces_dir} to build frames from")
+    columns = int(np.ceil(np.sqrt(max(faces_per_frame, 1))))
+    tile = size // columns
+    rng = np.random.default_rng(seed)
+    offsets = rng.integers(0, max(tile // 8, 1), (faces_per_frame, 2))
+    frames = []
+    for i in range(count):
+        frame = np.full((size, size, 3), 128, dtype=np.uint8)
+        for face in range(faces_per_frame):
+            photo = photos[face % len(photos)]
+            scale = tile * 0.8 / max(photo.shape[:2])
+            resized = cv2.resize(photo, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            drift = int(tile * 0.1 * np.sin(i / 10.0 + face))
+            y = (face // columns) * tile + offsets[face, 0]
+            x = (face % columns) * tile + offsets[face, 1] + drift
+            y, x = max(min(y, size - resized.shape[0]), 0), max(min(x, size - resized.shape[1]), 0)
+            frame[y:y + resized.shape[0], x:x + resized.shape[1]] = resized[:size - y, :size - x]
+        frames.append(frame)
+    return frames
+
+
+def video_frames(path, count):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    if not frames:
+        raise ValueError(f"Could not read frames from {path}")
+    return frames
+
+
+def benchmark_gallery(known_faces_dir, size):
+    """
+    The enrolled gallery, padded with synthetic people up to size rows.
+
+    The store in known_faces_dir is loaded as it is, without a sync: benchmarking never
+    writes there and does not pay for a directory scan. Enroll first (enroll.py or one of
+    the scripts) to benchmark against the real people.
+    """
+    store = gallery.load_gallery(known_faces_dir, sync=False)
+    encodings = np.array(store.encodings, dtype=np.float32).reshape(-1, 128)
+    names = list(store.names)
+    if not names:
+        print(f"No gallery store in {known_faces_dir}; benchmarking with synthetic people only")
+    if size and size > len(names):
+        extra = size - len(names)
+        encodings = np.concatenate([encodings, synthetic_gallery(extra, seed=42)])
+        names += [f"synthetic_{i}" for i in range(extra)]
+    return encodings, names
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        summary = {}
+        for name, samples in self.samples.items():
+            ms = np.asarray(samples) * 1e3
+            summary[name] = {
+                "count": len(ms),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            }
+        return summary
+
+
+class TimedMatcher:
+    """Wraps a FaceMatcher so the matching done inside FaceTracker.identify() is timed."""
+
+    def __init__(self, matcher, timer):
+        self.matcher = matcher
+        self.timer = timer
+
+    def best_matches(self, face_encodings, unknown_confidence=1.0):
+        with self.timer.stage("match"):
+            return self.matcher.best_matches(face_encodings, unknown_confidence=unknown_confidence)
+
+
+def render(frame, face_locations, face_names, anonymizer):
+    if anonymizer is not None:
+        anonymizer.apply(frame, [box for box, (name, confidence) in zip(face_locations, face_names)
+                                 if name == "Unknown" or confidence <= MIN_CONFIDENCE])
+    for (top, right, bottom, left), (name, confidence) in zip(face_locations, face_names):
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+        cv2.putText(frame, f"{name} ({confidence:.0f}%)", (left, top - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
+
+
+def log_events(sink, face_names):
+    # Stands in for db_utils.insert_evento, which only enqueues for the writer thread
+    for name, confidence in face_names:
+        if name != "Unknown" and confidence > MIN_CONFIDENCE:
+            try:
+                sink.put_nowait((name, "entrada", time.time(), float(confidence), "bench"))
+            except queue.Full:
+                pass
+
+
+def _cpu_seconds(children=False):
+    seconds = time.process_time()
+    if children:
+        try:
+            import resource
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            seconds += usage.ru_utime + usage.ru_stime
+        except ImportError:
+            pass
+    return seconds
+
+
+def run_pipeline(name, frames, matcher, workers=0, quality=True, encoder=None, scale=SCALE, min_face_size=None):
+    """
+    Feed frames through one pipeline and return its stage percentiles, FPS and CPU use.
+
+    With workers=0 every stage runs inline, one frame after the other, so each stage's
+    latency is measured on its own. With workers>0 resize/detect/encode run on an
+    AnalysisPool as in the scripts, and FPS is the end-to-end throughput. quality runs
+    the scripts' QualityGate before encoding; encoder has the workers encode through
+    that EncodingService. scale and min_face_size set the detection scales as in
+    AnalysisPool; faces are encoded from the full-resolution frame either way.
+    """
+    import face_recognition
+    config = PIPELINES[name]
+    timer = StageTimer()
+    tracker = FaceTracker()
+    timed_matcher = TimedMatcher(matcher, timer)
+    gate = QualityGate() if quality else None
+    anonymizer = Anonymizer(config["anonymize"]) if config["anonymize"] else None
+    sink = queue.Queue(maxsize=10000)
+    faces = 0
+
+    def finish(frame, frame_index, face_locations, encodings_for):
+        face_names = tracker.identify(face_locations, frame_index, encodings_for, timed_matcher,
+                                      unknown_confidence=config["unknown_confidence"])
+        with timer.stage("render"):
+            render(frame, face_locations, face_names, anonymizer)
+        if config["log"]:
+            with timer.stage("log"):
+                log_events(sink, face_names)
+        return len(face_names)
+
+    cpu_started = _cpu_seconds(children=workers > 0)
+    started = time.perf_counter()
+    if workers:
+        analysis = AnalysisPool(workers=workers, detector=config["detector"], scale=scale,
+                                min_face_size=min_face_size, quality=gate, encoder=encoder)
+        analysis.start(frames[0].shape)
+        # Warm-up: the workers load their models before the clock starts
+        analysis.wait_ready()
+        analysis.submit(frames[0].copy(), -1)
+        analysis.drain(timeout=120.0)
+        if gate is not None:
+            gate.reset()
+        if encoder is not None:
+            encoder.reset()
+        cpu_started = _cpu_seconds(children=True)
+        started = time.perf_counter()
+        submitted = {}
+        submitted_at = {}
+
+        def handle(results):
+            count = 0
+            for result in results:
+                for stage, seconds in result.timings.items():
+                    timer.add(stage, seconds)
+                frame = submitted.pop(result.frame_index)
+                count += finish(frame, result.frame_index, result.face_locations, result.encodings_for)
+                timer.add("total", time.perf_counter() - submitted_at.pop(result.frame_index))
+            return count
+
+        for i, frame in enumerate(frames):
+            frame = frame.copy()
+            submitted[i] = frame
+            submitted_at[i] = time.perf_counter()
+            hints = tracker.encoding_hints(i)
+            while not analysis.submit(frame, i, hints=hints):
+                faces += handle(analysis.results(timeout=0.05))
+            faces += handle(analysis.results())
+        faces += handle(analysis.drain(timeout=600.0))
+        elapsed = time.perf_counter() - started
+        analysis.close()
+    else:
+        detect = make_detector(config["detector"], keypoints=True)
+        scales = DetectionScales(scale, min_face_size, config["detector"])
+        for i, frame in enumerate(frames):
+            frame = frame.copy()
+            frame_started = time.perf_counter()
+            timings = {}
+            face_locations, keypoints, _ = scales.locate(frame, detect, timings)
+            for stage, seconds in timings.items():
+                timer.add(stage, seconds)
+
+            def encode(locations):
+                with timer.stage("encode"):
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    if gate is None:
+                        return face_recognition.face_encodings(rgb_frame, locations)
+                    by_location = dict(zip(map(tuple, face_locations), keypoints or [None] * len(face_locations)))
+                    encodings, rejected = gate.encode_faces(
+                        rgb_frame, locations, [by_location[tuple(location)] for location in locations],
+                        face_recognition.face_encodings)
+                    gate.count(rejected)
+                    return encodings
+            faces += finish(frame, i, face_locations, encode)
+            timer.add("total", time.perf_counter() - frame_started)
+        elapsed = time.perf_counter() - started
+    cpu = _cpu_seconds(children=workers > 0) - cpu_started
+
+    result = {
+        "frames": len(frames),
+        "faces": faces,
+        "fps": round(len(frames) / elapsed, 2),
+        "cpu_cores": round(cpu / elapsed, 2),
+        "stages": timer.summary(),
+    }
+    if gate is not None:
+        result["quality"] = gate.stats()
+    if encoder is not None:
+        result["encoding_service"] = encoder.stats()
+    return result
+
+
+def compare(results, baseline, tolerance, min_ms=0.5):
+    """Return a list of regressions of results against a saved baseline."""
+    regressions = []
+    for name, current in results["pipelines"].items():
+        previous = baseline.get("pipelines", {}).get(name)
+        if not previous:
+            continue
+        if current["fps"] < previous["fps"] * (1 - tolerance):
+            regressions.append(f"{name}: fps {previous['fps']} -> {current['fps']}")
+        for stage, stats in current["stages"].items():
+            old = previous["stages"].get(stage)
+            if not old:
+                continue
+            for key in ("p50_ms", "p95_ms"):
+                if stats[key] > old[key] * (1 + tolerance) and stats[key] - old[key] > min_ms:
+                    regressions.append(f"{name}: {stage} {key} {old[key]} -> {stats[key]}")
+    return regressions
+
+
+def print_results(results):
+    for name, result in results["pipelines"].items():
+        print(f"\n{name}: {result['fps']} fps, {result['cpu_cores']} cores, "
+              f"{result['faces']} faces in {result['frames']} frames")
+        if "encoding_service" in result:
+            service = result["encoding_service"]
+            print(f"  encoding service: {service['faces_per_batch']:.1f} faces per batch, "
+                  f"{service['encode_ms_per_face']:.2f} ms per face, {service['wait_ms']:.2f} ms waiting")
+        if "quality" in result:
+            quality = result["quality"]
+            print(f"  quality gate: {quality['encodings_saved']} of {quality['faces_checked']} encodings saved "
+                  f"{quality['rejected']}")
+        for stage in STAGES + ("total",):
+            stats = result["stages"].get(stage)
+            if stats:
+                print(f"  {stage:<7} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                      f"p99 {stats['p99_ms']:8.2f} ms  (n={stats['count']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the recognition pipelines end to end on fixed frames, without camera or display.")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="comma-separated pipelines to run")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--video", help="take the frames from this recording instead of synthesizing them")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--faces-per-frame", type=int, default=1)
+    parser.add_argument("--gallery-size", type=int, default=0,
+                        help="pad the gallery with synthetic people up to this many encodings")
+    parser.add_argument("-j", "--workers", type=int, default=0,
+                        help="analysis processes (0 = run every stage inline and time it separately)")
+    parser.add_argument("--no-quality-gate", action="store_true",
+                        help="encode every face, as before the quality gate")
+    parser.add_argument("--scale", type=float, nargs="+", default=[SCALE],
+                        help="frame scale for detection; several are a coarse-to-fine pyramid (lossy: "
+                             "finer scales only run on frames where the coarser ones found no face)")
+    parser.add_argument("--min-face-size", type=int,
+                        help="smallest face to find, in frame pixels (picks the finest detection scale)")
+    parser.add_argument("--encoding-service", action="store_true",
+                        help="with -j, encode the faces of all workers in micro-batches on an EncodingService")
+    parser.add_argument("--save", help="write the results to this JSON file (a baseline)")
+    parser.add_argument("--compare", help="compare against this baseline; exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown tolerated by --compare")
+    args = parser.parse_args(argv)
+
+    if args.video:
+        frames = video_frames(args.video, args.frames)
+    else:
+        frames = synthetic_frames(args.known_faces, args.frames, args.faces_per_frame)
+    encodings, names = benchmark_gallery(args.known_faces, args.gallery_size)
+
+    results = {
+        "config": {
+            "frames": len(frames), "frame_shape": list(frames[0].shape),
+            "faces_per_frame": None if args.video else args.faces_per_frame,
+            "video": args.video, "gallery_size": len(names), "workers": args.workers,
+            "quality_gate": not args.no_quality_gate, "encoding_service": args.encoding_service,
+            "detection_scale": args.scale, "min_face_size": args.min_face_size,
+            "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+        },
+        "pipelines": {},
+    }
+    if args.encoding_service and not args.workers:
+        parser.error("--encoding-service needs worker processes (-j)")
+    encoder = EncodingService().start() if args.encoding_service else None
+    for name in args.pipelines.split(","):
+        if name not in PIPELINES:
+            parser.error(f"unknown pipeline {name!r}; choose from {', '.join(PIPELINES)}")
+        index = None
+        if PIPELINES[name]["index"]:
+            index = face_index.create_index(PIPELINES[name]["index"]).build(encodings)
+        matcher = FaceMatcher(encodings, names, index=index)
+        print(f"Running {name}...")
+        try:
+            results["pipelines"][name] = run_pipeline(name, frames, matcher, workers=args.workers,
+                                                       quality=not args.no_quality_gate, encoder=encoder,
+                                                       scale=args.scale, min_face_size=args.min_face_size)
+        except ImportError as e:
+            print(f"  skipping {name}: {e}")
+    if encoder is not None:
+        encoder.close()
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ("frames", "frame_shape", "faces_per_frame", "video", "gallery_size", "workers", "quality_gate",
+                    "encoding_service", "detection_scale", "min_face_size"):
+            if baseline.get("config", {}).get(key) != results["config"][key]:
+                print(f"Warning: {key} differs from the baseline "
+                      f"({baseline.get('config', {}).get(key)} vs {results['config'][key]})")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against " + args.compare + ":")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
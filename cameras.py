@@ -0,0 +1,364 @@
+import argparse
+import importlib
+import json
+import multiprocessing as mp
+import sys
+import time
+from datetime import datetime, timedelta
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import db_utils
+import gallery
+import metrics
+from matcher import FaceMatcher, DEFAULT_THRESHOLD
+from tracker import FaceTracker
+from video_capture import VideoCaptureThread
+from frame_scheduler import FrameScheduler
+from analysis_pool import AnalysisPool, default_workers
+from anonymize import Anonymizer
+from detection_scale import DetectionScales
+from face_quality import QualityGate
+from encoding_service import EncodingService
+from startup import StartupTimer
+
+DEFAULT_CONFIG = "cameras.json"
+
+# Seconds between two summaries of the shared encoding service
+ENCODING_SUMMARY_INTERVAL = 60.0
+
+# Restart backoff for workers that die; a worker that ran this long resets it
+RESTART_BASE_DELAY = 1.0
+RESTART_MAX_DELAY = 60.0
+STABLE_SECONDS = 60.0
+
+CAMERA_DEFAULTS = {
+    "src": 0,
+    "width": 720,
+    "height": 720,
+    "target_fps": 15.0,
+    "min_confidence": 75.0,
+    "log_interval": 60,  # seconds between two events for the same person
+    "show": False,
+    "analysis_workers": None,  # detection/encoding processes; None shares the cores between cameras
+    "anonymize": "pixelate",  # how unknown faces are hidden in the preview: pixelate, blur or fill
+    "quality": {},  # QualityGate thresholds (e.g. {"min_size": 60}); null encodes every face
+    # Frame scale for detection. A list such as [0.25, 0.5] is a coarse-to-fine pyramid, which is lossy:
+    # the finer levels only run when the coarser ones found nobody, so far faces next to a near one are missed
+    "detection_scale": 0.5,
+    "min_face_size": None,  # smallest face to find, in frame pixels; picks the finest detection scale
+}
+
+
+def load_config(path):
+    """
+    Read the camera list from a JSON file:
+
+        {"known_faces": "known_faces",
+         "cameras": [{"id": "entrada", "src": 0, "tipo_evento": "entrada"},
+                     {"id": "saida", "src": 1, "tipo_evento": "saida"}]}
+
+    Per-camera keys missing from an entry fall back to the top-level value, then CAMERA_DEFAULTS.
+    A top-level "encoding_service": {"max_batch": 32, "max_wait_ms": 5} has the faces of
+    every camera encoded together in micro-batches (see encoding_service.py).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    cameras = config.get("cameras") or []
+    if not cameras:
+        raise ValueError(f"{path} lists no cameras")
+    ids = [camera.get("id") for camera in cameras]
+    if None in ids or len(set(ids)) != len(ids):
+        raise ValueError(f"{path}: every camera needs a unique id")
+    metrics_port = config.get("metrics_port", metrics.DEFAULT_PORT)
+    for i, camera in enumerate(cameras):
+        # One metrics endpoint per camera worker; 0 turns them off
+        camera.setdefault("metrics_port", metrics_port + i if metrics_port else 0)
+        for key, default in CAMERA_DEFAULTS.items():
+            camera.setdefault(key, config.get(key, default))
+        camera.setdefault("tipo_evento", camera["id"])
+        if not camera["analysis_workers"]:
+            camera["analysis_workers"] = max(default_workers() // len(cameras), 1)
+        if camera["tipo_evento"] not in ("entrada", "saida"):
+            raise ValueError(f"Camera {camera['id']}: tipo_evento must be 'entrada' or 'saida'")
+        try:
+            DetectionScales(camera["detection_scale"], camera["min_face_size"])
+        except ValueError as e:
+            raise ValueError(f"Camera {camera['id']}: {e}")
+    config.setdefault("known_faces", "known_faces")
+    return config
+
+
+class SharedGallery:
+    """
+    The gallery encodings, grouped by person, in one shared memory block.
+
+    Workers map the block instead of loading their own copy, and FaceMatcher uses the
+    grouped rows in place, so the gallery costs the same RAM for one camera or ten.
+    """
+
+    def __init__(self, encodings, names):
+        names = np.asarray(names, dtype=object)
+        order = np.argsort(names, kind="stable") if len(names) else np.empty(0, dtype=np.int64)
+        self.names = [str(name) for name in names[order]]
+        self.shape = (len(order), gallery.ENCODING_SIZE)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(self.shape)) * 4, 1))
+        matrix = np.ndarray(self.shape, dtype=np.float32, buffer=self.memory.buf)
+        matrix[:] = np.asarray(encodings, dtype=np.float32).reshape(self.shape)[order]
+        del matrix
+
+    def handle(self):
+        """Picklable (name, shape, names) for attach()."""
+        return self.memory.name, self.shape, self.names
+
+    @staticmethod
+    def attach(handle):
+        """Map a block created by another process; returns (memory, encodings, names)."""
+        name, shape, names = handle
+        try:
+            # Python 3.13+: do not let this process's resource tracker unlink the block
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=name)
+        return memory, np.ndarray(shape, dtype=np.float32, buffer=memory.buf), names
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def render(frame, face_locations, face_names, min_confidence, anonymizer):
+    """Draw the faces found on the frame; unknown or uncertain faces are anonymized."""
+    known = [name != "Unknown" and confidence > min_confidence for name, confidence in face_names]
+    anonymizer.apply(frame, [box for box, is_known in zip(face_locations, known) if not is_known])
+    for (top, right, bottom, left), (name, confidence), is_known in zip(face_locations, face_names, known):
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+        label = f"{name} ({confidence:.0f}%)" if is_known else "Unknown"
+        cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
+
+
+def run_camera(camera, matcher, stop_event, encoder=None, fork_analysis=False):
+    """
+    Analyze one camera until stop_event is set or the camera stops delivering frames.
+
+    With fork_analysis, the models are already imported in this process, which has no
+    thread yet: the analysis workers are forked from it and share them.
+    """
+    startup_timer = StartupTimer(camera["id"], started=time.perf_counter())
+    camera_id = camera["id"]
+    tipo_evento = camera["tipo_evento"]
+    show = camera["show"]
+    min_confidence = camera["min_confidence"]
+    log_interval = timedelta(seconds=camera["log_interval"])
+
+    quality = QualityGate(**camera["quality"]) if camera["quality"] is not None else None
+    analysis = AnalysisPool(workers=camera["analysis_workers"], detector="hog", scale=camera["detection_scale"],
+                            min_face_size=camera["min_face_size"], quality=quality, encoder=encoder,
+                            context=mp.get_context("fork") if fork_analysis else None)
+    if fork_analysis:
+        # Forking is only safe before the capture thread starts; it takes milliseconds
+        with startup_timer.phase("analysis"):
+            analysis.launch()
+
+    with startup_timer.phase("camera"):
+        print(f"[{camera_id}] Initializing Camera...")
+        video_capture = VideoCaptureThread(src=camera["src"], width=camera["width"], height=camera["height"])
+        video_capture.start()
+
+    scheduler = FrameScheduler(target_fps=camera["target_fps"], workers=analysis.workers)
+    tracker = FaceTracker(min_confidence=min_confidence)
+    anonymizer = Anonymizer(camera["anonymize"])
+    frame_count = 0
+    face_locations = []
+    face_names = []
+    last_logged_time = {}
+    # Tables are checked in the background; events wait in the writer's queue meanwhile
+    db_utils.connect_and_init(background=True)
+
+    metrics.configure(port=camera["metrics_port"], camera=camera_id)
+    metrics.register("capture", video_capture.stats)
+    metrics.register("scheduler", scheduler.metrics)
+    metrics.register("analysis", analysis.stats)
+    metrics.register("anonymizer", anonymizer.stats)
+    metrics.register("db_writer", db_utils.writer_stats)
+    metrics.register("startup", startup_timer.stats)
+
+    try:
+        while not stop_event.is_set():
+            if not video_capture.more():
+                if video_capture.stopped:
+                    raise RuntimeError(f"[{camera_id}] Camera stopped delivering frames")
+                continue
+            frame = video_capture.read()
+            if frame is None:
+                continue
+            frame_count += 1
+            startup_timer.mark("first_frame")
+
+            if scheduler.should_process(frame, active_tracks=len(tracker.tracks)):
+                with scheduler.stage("submit"):
+                    analysis.submit(frame, frame_count, hints=tracker.encoding_hints(frame_count))
+
+            for result in analysis.results():
+                scheduler.record_analysis(result.timings, result.cpu_seconds)
+                with scheduler.stage("identify"):
+                    face_locations = result.face_locations
+                    face_names = tracker.identify(face_locations, result.frame_index, result.encodings_for, matcher)
+                startup_timer.mark("first_analysis")
+
+                # Log recognized people at most once per log_interval
+                now = datetime.now()
+                for name, confidence in face_names:
+                    if name != "Unknown" and confidence > min_confidence:
+                        startup_timer.mark("first_recognition")
+                        last_time = last_logged_time.get(name)
+                        if not last_time or (now - last_time) > log_interval:
+                            db_utils.insert_evento(name, confidence, tipo_evento, camera_id)
+                            last_logged_time[name] = now
+
+            if show:
+                with metrics.stage("render"):
+                    render(frame, face_locations, face_names, min_confidence, anonymizer)
+                cv2.imshow(f"Video {camera_id}", frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    stop_event.set()
+    finally:
+        video_capture.stop()
+        video_capture.join()
+        analysis.close()
+        if show:
+            cv2.destroyWindow(f"Video {camera_id}")
+        db_utils.close_connection()
+
+
+def _worker(camera, gallery_handle, threshold, stop_event, db_pool_size, encoder, fork_analysis):
+    memory, encodings, names = SharedGallery.attach(gallery_handle)
+    # Each worker keeps its own small pool: its writer thread plus the odd report query
+    db_utils.DB_POOL_SIZE = db_pool_size
+    try:
+        run_camera(camera, FaceMatcher(encodings, names, threshold=threshold), stop_event, encoder, fork_analysis)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        memory.close()
+
+
+class CameraSupervisor:
+    """
+    Runs one worker process per configured camera and restarts workers that die.
+
+    The gallery is synced and loaded once here and shared with all workers through a
+    SharedGallery, so adding a camera adds neither a directory scan nor a gallery copy.
+    The EncodingService, when configured, also lives here and outlives camera restarts.
+
+    Where processes can be forked, the face_recognition models are imported here once
+    and every camera worker forks its analysis workers from its copy of this process:
+    one set of model pages is shared by all cameras instead of one fork server (and
+    one model load) per camera.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.cameras = config["cameras"]
+        methods = mp.get_all_start_methods()
+        self.context = mp.get_context("fork" if "fork" in methods else "spawn")
+        self.stop_event = self.context.Event()
+        self.processes = {}
+        self.started_at = {}
+        self.restart_delay = {}
+        self.restart_at = {}
+        self.restarts = {camera["id"]: 0 for camera in self.cameras}
+        self.shared = None
+        self.encoding_service = None
+
+    def _start(self, camera):
+        process = self.context.Process(
+            target=_worker, name=f"camera-{camera['id']}",
+            args=(camera, self.shared.handle(), self.config.get("threshold", DEFAULT_THRESHOLD),
+                  self.stop_event, self.config.get("db_pool_size", 2),
+                  self.encoding_service.endpoint if self.encoding_service else None,
+                  self.context.get_start_method() == "fork"))
+        process.start()
+        self.processes[camera["id"]] = process
+        self.started_at[camera["id"]] = time.monotonic()
+        print(f"Started worker for camera {camera['id']} (pid {process.pid})")
+
+    def _check(self, camera):
+        camera_id = camera["id"]
+        process = self.processes.get(camera_id)
+        now = time.monotonic()
+        if process is not None:
+            if process.is_alive():
+                return
+            process.join()
+            ran = now - self.started_at[camera_id]
+            if ran >= STABLE_SECONDS:
+                self.restart_delay[camera_id] = RESTART_BASE_DELAY
+            delay = self.restart_delay.get(camera_id, RESTART_BASE_DELAY)
+            self.restart_delay[camera_id] = min(delay * 2, RESTART_MAX_DELAY)
+            self.restart_at[camera_id] = now + delay
+            self.processes[camera_id] = None
+            print(f"Worker for camera {camera_id} exited with code {process.exitcode} after {ran:.0f}s; "
+                  f"restarting in {delay:.1f}s")
+        elif now >= self.restart_at.get(camera_id, 0.0):
+            self.restarts[camera_id] += 1
+            self._start(camera)
+
+    def run(self, poll_interval=1.0):
+        if self.context.get_start_method() == "fork":
+            importlib.import_module("face_recognition")
+        known_faces = gallery.load_gallery(self.config["known_faces"])
+        self.shared = SharedGallery(known_faces.encodings, known_faces.names)
+        del known_faces
+        service_config = self.config.get("encoding_service")
+        if service_config is not None:
+            self.encoding_service = EncodingService(
+                max_batch=service_config.get("max_batch", 32),
+                max_wait=service_config.get("max_wait_ms", 5) / 1e3).start()
+        next_summary = time.monotonic() + ENCODING_SUMMARY_INTERVAL
+        try:
+            for camera in self.cameras:
+                self._start(camera)
+            while not self.stop_event.is_set():
+                for camera in self.cameras:
+                    self._check(camera)
+                if self.encoding_service and time.monotonic() >= next_summary:
+                    stats = self.encoding_service.stats()
+                    print(f"Encoding service: {stats['faces']} faces in {stats['batches']} batches "
+                          f"({stats['faces_per_batch']:.1f} per batch, {stats['encode_ms_per_face']:.1f} ms per face, "
+                          f"{stats['wait_ms']:.1f} ms waiting)")
+                    next_summary = time.monotonic() + ENCODING_SUMMARY_INTERVAL
+                self.stop_event.wait(poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping cameras...")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10.0):
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            if process is not None:
+                process.join(max(deadline - time.monotonic(), 0.1))
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        if self.encoding_service is not None:
+            self.encoding_service.close()
+            self.encoding_service = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run every configured camera under one supervisor.")
+    parser.add_argument("config", nargs="?", default=DEFAULT_CONFIG, help="camera list (JSON)")
+    args = parser.parse_args(argv)
+    CameraSupervisor(load_config(args.config)).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Arquivo SQLite usado pelos backends 'sqlite' e 'spool' de db_utils
+SQLITE_PATH = os.getenv('DB_SQLITE_PATH', 'eventos.db')
+
+# Datas gravadas como texto ISO ("2024-05-01 08:00:00.123456"): a ordem do texto é a ordem no tempo
+sqlite3.register_adapter(datetime, lambda valor: valor.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda valor: datetime.fromisoformat(valor.decode()))
+sqlite3.register_converter("DATETIME", lambda valor: datetime.fromisoformat(valor.decode()))
+
+# MIN()/MAX()/strftime() perdem o tipo da coluna e voltam como texto
+_DATA_HORA = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?$")
+
+# SQLite aceita no máximo 999 parâmetros por comando nas versões antigas
+_MAX_PARAMS = 900
+
+_local = threading.local()
+# Conexões de todas as threads, para fechar() fechar todas; a geração muda a cada fechar(),
+# e a thread que ainda guardar uma conexão de antes abre outra
+_conexoes = []
+_conexoes_lock = threading.Lock()
+_geracao = 0
+_inicializado = False
+_init_lock = threading.Lock()
+
+
+def conectar():
+    """Conexão desta thread com SQLITE_PATH, em modo WAL (leitores não bloqueiam o gravador)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.geracao != _geracao:
+        # check_same_thread=False só para fechar() poder fechá-la de outra thread
+        conn = sqlite3.connect(SQLITE_PATH, timeout=30.0, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Cada commit (um por lote) vai para o disco: um evento confirmado sobrevive a uma queda de energia
+        conn.execute("PRAGMA synchronous=FULL")
+        with _conexoes_lock:
+            _conexoes.append(conn)
+            _local.conn, _local.geracao = conn, _geracao
+    return conn
+
+
+class _Cursor:
+    """Cursor que aceita o SQL de db_utils (parâmetros %s) e devolve datas como datetime."""
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    @property
+    def rowcount(self):
+        return self.cur.rowcount
+
+    def execute(self, sql, params=()):
+        self.cur.execute(sql.replace('%s', '?'), tuple(params))
+
+    def executemany(self, sql, linhas):
+        self.cur.executemany(sql.replace('%s', '?'), linhas)
+
+    @staticmethod
+    def _converter(linha):
+        if linha is None:
+            return None
+        return tuple(datetime.fromisoformat(valor) if isinstance(valor, str) and _DATA_HORA.match(valor) else valor
+                     for valor in linha)
+
+    def fetchone(self):
+        return self._converter(self.cur.fetchone())
+
+    def fetchall(self):
+        return [self._converter(linha) for linha in self.cur.fetchall()]
+
+    def close(self):
+        self.cur.close()
+
+
+@contextmanager
+def cursor(commit=False):
+    """Como db_utils.cursor, sobre a conexão SQLite da thread."""
+    conn = conectar()
+    cur = _Cursor(conn.cursor())
+    try:
+        yield cur
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def inicializar():
+    """
+    Cria as tabelas (mesmas colunas do MySQL, mais uid e encaminhado para o spool).
+    Retorna True se a tabela de sessões acabou de ser criada.
+    """
+    global _inicializado
+    with _init_lock:
+        if _inicializado:
+            return False
+        conn = conectar()
+        sessoes_novas = conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'sessoes_permanencia'"
+        ).fetchone()[0] == 0
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                uid TEXT UNIQUE,
+                nome TEXT,
+                tipo_evento TEXT CHECK (tipo_evento IN ('entrada', 'saida')),
+                data_hora TIMESTAMP,
+                confianca REAL,
+                camera_id TEXT,
+                encaminhado INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_eventos_nome_tipo_data ON eventos (nome, tipo_evento, data_hora);
+            CREATE INDEX IF NOT EXISTS idx_eventos_data ON eventos (data_hora);
+            CREATE INDEX IF NOT EXISTS idx_eventos_pendentes ON eventos (id) WHERE encaminhado = 0;
+
+            CREATE TABLE IF NOT EXISTS sessoes_permanencia (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome TEXT NOT NULL,
+                hora_entrada DATETIME NOT NULL,
+                hora_saida DATETIME NULL,
+                tempo_minutos INTEGER NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessoes_abertas ON sessoes_permanencia (nome, hora_saida, hora_entrada);
+            CREATE INDEX IF NOT EXISTS idx_sessoes_nome_entrada ON sessoes_permanencia (nome, hora_entrada);
+            CREATE INDEX IF NOT EXISTS idx_sessoes_entrada ON sessoes_permanencia (hora_entrada);
+        ''')
+        _inicializado = True
+        return sessoes_novas
+
+
+def enfileirar(eventos):
+    """
+    Grava eventos (nome, tipo_evento, data_hora, confianca, camera_id) no spool, num commit.
+
+    Cada um ganha um uid: é por ele que o reenvio ao MySQL reconhece o que já foi gravado lá.
+    """
+    inicializar()
+    conn = conectar()
+    with conn:
+        conn.executemany(
+            "INSERT INTO eventos (uid, nome, tipo_evento, data_hora, confianca, camera_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [(uuid.uuid4().hex, *evento) for evento in eventos])
+
+
+def pendentes(limite):
+    """Os limite eventos mais antigos ainda não encaminhados: (id, uid, nome, tipo_evento, data_hora, confianca, camera_id)."""
+    inicializar()
+    return conectar().execute(
+        "SELECT id, uid, nome, tipo_evento, data_hora, confianca, camera_id FROM eventos "
+        "WHERE encaminhado = 0 ORDER BY id LIMIT ?", (limite,)).fetchall()
+
+
+def contar_pendentes():
+    inicializar()
+    return conectar().execute("SELECT COUNT(*) FROM eventos WHERE encaminhado = 0").fetchone()[0]
+
+
+def marcar_encaminhados(ids):
+    conn = conectar()
+    with conn:
+        for inicio in range(0, len(ids), _MAX_PARAMS):
+            parte = ids[inicio:inicio + _MAX_PARAMS]
+            conn.execute(f"UPDATE eventos SET encaminhado = 1 WHERE id IN ({', '.join('?' * len(parte))})", parte)
+
+
+def limpar_encaminhados(antes_de):
+    """Apaga do spool os eventos já encaminhados anteriores a antes_de; retorna quantos."""
+    conn = conectar()
+    with conn:
+        return conn.execute("DELETE FROM eventos WHERE encaminhado = 1 AND data_hora < ?", (antes_de,)).rowcount
+
+
+def fechar():
+    """Fecha as conexões de todas as threads (no encerramento)."""
+    global _inicializado, _geracao
+    with _conexoes_lock:
+        for conn in _conexoes:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _conexoes.clear()
+        _geracao += 1
+    _local.__dict__.clear()
+    _inicializado = False
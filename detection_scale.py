@@ -0,0 +1,86 @@
+import math
+import time
+
+import cv2
+
+# Smallest face, in pixels of the image it runs on, that each detector finds reliably:
+# dlib's 80 px window with face_recognition's one upsampling, MediaPipe's short-range model
+DETECTOR_MIN_FACE = {"hog": 40, "cnn": 40, "mediapipe": 20}
+
+
+def scale_for_min_face(min_face_size, detector):
+    """The smallest scale at which faces of min_face_size frame pixels are still detected."""
+    return min(DETECTOR_MIN_FACE[detector] / float(min_face_size), 1.0)
+
+
+def to_frame(location, scale_x, scale_y, shape):
+    """
+    Map a (top, right, bottom, left) box found on a resized image back to the frame of shape.
+
+    scale_x and scale_y are frame pixels per resized pixel. Edges are rounded outwards, so
+    the box never loses part of the face, and clipped to the frame (MediaPipe boxes can
+    reach past it).
+    """
+    height, width = shape[:2]
+    top, right, bottom, left = location
+    return (min(max(int(math.floor(top * scale_y)), 0), height),
+            min(max(int(math.ceil(right * scale_x)), 0), width),
+            min(max(int(math.ceil(bottom * scale_y)), 0), height),
+            min(max(int(math.floor(left * scale_x)), 0), width))
+
+
+class DetectionScales:
+    """
+    The scales a frame is detected at; the faces found are encoded from the full frame.
+
+    scale is one factor (0.5 detects on the half-size frame) or a list of them for a
+    coarse-to-fine pyramid: the coarsest level runs first and each finer one only when
+    the coarser levels found no face. Near faces then cost a cheap coarse pass, and a
+    distant face alone in view is still found at the fine level. The pyramid is lossy:
+    a frame with both only reports the near one until it leaves.
+
+    With min_face_size (in frame pixels), the finest level is the scale at which a face
+    that small still reaches the detector's minimum (DETECTOR_MIN_FACE): 80 px faces
+    with HOG give 0.5. It replaces a single scale; levels of a list at or above it are
+    dropped.
+    """
+
+    def __init__(self, scale=0.5, min_face_size=None, detector="hog"):
+        levels = sorted(scale) if isinstance(scale, (list, tuple)) else [scale]
+        if min_face_size:
+            finest = scale_for_min_face(min_face_size, detector)
+            coarser = [level for level in levels if level < finest] if len(levels) > 1 else []
+            levels = coarser + [finest]
+        if not levels or any(not 0 < level <= 1 for level in levels):
+            raise ValueError(f"Detection scales must be in (0, 1], got {scale!r}")
+        self.levels = levels
+
+    def locate(self, frame, detect, timings):
+        """
+        Find the faces of a BGR frame with detect(rgb) -> (locations, keypoints).
+
+        Returns (locations, keypoints, passes) in frame coordinates, keypoints None when
+        the detector has none; the resize and detect seconds are added to timings.
+        """
+        locations, keypoints, passes = [], None, 0
+        for level in self.levels:
+            started = time.perf_counter()
+            small_frame = frame if level == 1 else cv2.resize(frame, (0, 0), fx=level, fy=level)
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            timings["resize"] = timings.get("resize", 0.0) + time.perf_counter() - started
+
+            started = time.perf_counter()
+            locations, keypoints = detect(rgb_small_frame)
+            timings["detect"] = timings.get("detect", 0.0) + time.perf_counter() - started
+            passes += 1
+            if locations:
+                break
+        if not locations:
+            return [], None, passes
+        # The resized size is rounded, so the true factors are taken from the shapes
+        scale_x = frame.shape[1] / small_frame.shape[1]
+        scale_y = frame.shape[0] / small_frame.shape[0]
+        locations = [to_frame(location, scale_x, scale_y, frame.shape) for location in locations]
+        if keypoints is not None:
+            keypoints = [[(x * scale_x, y * scale_y) for x, y in points] for points in keypoints]
+        return locations, keypoints, passes
@@ -0,0 +1,232 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+
+# Aligned face chips as dlib's encoder takes them (what face_recognition.face_encodings
+# extracts internally, one face at a time)
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+# Seconds a client encodes locally after the service could not be reached
+_RETRY_AFTER = 5.0
+# Seconds a client waits for its encodings before encoding the faces itself
+_REPLY_TIMEOUT = 2.0
+
+_COUNTERS = ("requests", "faces", "batches", "encode_seconds", "wait_seconds")
+
+
+def face_chips(rgb, locations):
+    """Return the aligned (N, CHIP_SIZE, CHIP_SIZE, 3) chips of the faces at (top, right, bottom, left) locations."""
+    import dlib
+    from face_recognition import api
+    if not locations:
+        return np.empty((0, CHIP_SIZE, CHIP_SIZE, 3), dtype=np.uint8)
+    shapes = dlib.full_object_detections()
+    for top, right, bottom, left in locations:
+        shapes.append(api.pose_predictor_5_point(rgb, dlib.rectangle(left, top, right, bottom)))
+    return np.stack(dlib.get_face_chips(rgb, shapes, size=CHIP_SIZE, padding=CHIP_PADDING))
+
+
+def encode_chips(chips):
+    """Encode a batch of chips with one call into dlib's network; returns (N, 128) float32."""
+    from face_recognition import api
+    if len(chips) == 0:
+        return np.empty((0, 128), dtype=np.float32)
+    descriptors = api.face_encoder.compute_face_descriptor(list(chips))
+    return np.asarray(descriptors, dtype=np.float32).reshape(-1, 128)
+
+
+def _accept(listener, accepted, wake):
+    while True:
+        try:
+            connection = listener.accept()
+        except mp.AuthenticationError:
+            continue
+        except OSError:
+            return
+        accepted.put(connection)
+        wake.send(None)
+
+
+def _serve(control, authkey, max_batch, max_wait, counters, encode):
+    # A Unix socket (a named pipe on Windows) in a fresh temporary directory
+    listener = Listener(authkey=authkey)
+    control.send(listener.address)
+    accepted = queue.Queue()
+    wake_receiver, wake_sender = mp.Pipe(duplex=False)
+    threading.Thread(target=_accept, args=(listener, accepted, wake_sender), daemon=True).start()
+
+    connections = []
+    pending = []  # (connection, chips, arrived)
+    try:
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(pending[0][2] + max_wait - time.perf_counter(), 0.0)
+            for ready in wait(connections + [control, wake_receiver], timeout):
+                if ready is control:
+                    # The owner closed the service (or died)
+                    return
+                if ready is wake_receiver:
+                    wake_receiver.recv()
+                    while not accepted.empty():
+                        connections.append(accepted.get_nowait())
+                    continue
+                try:
+                    chips = ready.recv()
+                except (EOFError, OSError):
+                    connections.remove(ready)
+                    continue
+                pending.append((ready, chips, time.perf_counter()))
+
+            faces = sum(len(chips) for _, chips, _ in pending)
+            if not pending or (faces < max_batch and time.perf_counter() - pending[0][2] < max_wait):
+                continue
+            # One batch for everything that arrived, whichever frame or camera it came from
+            started = time.perf_counter()
+            try:
+                encodings = encode(np.concatenate([chips for _, chips, _ in pending]))
+                error = None
+            except Exception as e:
+                encodings, error = None, repr(e)
+            finished = time.perf_counter()
+            with counters.get_lock():
+                counters[0] += len(pending)
+                counters[1] += faces
+                counters[2] += 1
+                counters[3] += finished - started
+                counters[4] += sum(started - arrived for _, _, arrived in pending)
+            offset = 0
+            for connection, chips, _ in pending:
+                reply = (encodings[offset:offset + len(chips)], None) if error is None else (None, error)
+                offset += len(chips)
+                try:
+                    connection.send(reply)
+                except OSError:
+                    pass
+            pending = []
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+
+class EncodingService:
+    """
+    Encodes face chips for many callers in micro-batches, in a process of its own.
+
+    Analysis workers, of any camera, send the aligned chips of a frame's faces and
+    wait for their encodings. The service collects requests until max_batch faces are
+    waiting or the oldest request has waited max_wait seconds, encodes them with one
+    call into dlib's network and sends each caller its own rows. A face therefore
+    waits at most max_wait (plus the batch itself) for the per-call overhead to be
+    shared with the faces of other frames.
+
+    Callers connect to endpoint (an (address, authkey) pair that can be handed to
+    other processes) through an EncodingClient.
+    """
+
+    def __init__(self, max_batch=32, max_wait=0.005, encode=encode_chips):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.encode = encode
+        # Spawned, not forked from a fork server: cameras.py forks its camera workers after
+        # starting the service, and a forked child cannot use its parent's fork server
+        self.context = mp.get_context("spawn")
+        self.authkey = os.urandom(16)
+        self.counters = self.context.Array("d", len(_COUNTERS))
+        self.endpoint = None
+        self.process = None
+        self._control = None
+
+    def start(self):
+        control, child_control = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_serve, name="encoding-service",
+            args=(child_control, self.authkey, self.max_batch, self.max_wait, self.counters, self.encode),
+            daemon=True)
+        self.process.start()
+        child_control.close()
+        self._control = control
+        self.endpoint = (control.recv(), self.authkey)
+        print(f"Started the encoding service (batches of up to {self.max_batch} faces, "
+              f"{self.max_wait * 1e3:.0f} ms deadline)")
+        return self
+
+    def reset(self):
+        with self.counters.get_lock():
+            self.counters[:] = [0.0] * len(_COUNTERS)
+
+    def stats(self):
+        with self.counters.get_lock():
+            values = dict(zip(_COUNTERS, self.counters[:]))
+        batches = max(values["batches"], 1)
+        requests = max(values["requests"], 1)
+        return {
+            "requests": int(values["requests"]),
+            "faces": int(values["faces"]),
+            "batches": int(values["batches"]),
+            "faces_per_batch": values["faces"] / batches,
+            "encode_ms_per_face": values["encode_seconds"] * 1e3 / max(values["faces"], 1),
+            "wait_ms": values["wait_seconds"] * 1e3 / requests,
+        }
+
+    def close(self):
+        if self.process is None:
+            return
+        self._control.close()
+        self.process.join(5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+
+class EncodingClient:
+    """
+    The caller's side of an EncodingService, used inside analysis workers.
+
+    face_encodings() takes the same arguments as face_recognition.face_encodings.
+    When the service cannot be reached, or has not answered within timeout seconds,
+    the faces are encoded locally (and the service is tried again after a few
+    seconds), so frames are never lost to it.
+    """
+
+    def __init__(self, endpoint, timeout=_REPLY_TIMEOUT):
+        self.address, self.authkey = endpoint
+        self.timeout = timeout
+        self.connection = None
+        self.local_until = 0.0
+
+    def encode_chips(self, chips):
+        if len(chips) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+        if time.monotonic() >= self.local_until:
+            try:
+                if self.connection is None:
+                    self.connection = Client(self.address, authkey=self.authkey)
+                self.connection.send(chips)
+                if not self.connection.poll(self.timeout):
+                    raise TimeoutError(f"no reply in {self.timeout:g}s")
+                encodings, error = self.connection.recv()
+            except (OSError, EOFError) as e:
+                print(f"Encoding service unavailable ({e}); encoding locally for {_RETRY_AFTER:.0f}s")
+                if self.connection is not None:
+                    # A late reply would be read as the answer to the next request
+                    self.connection.close()
+                self.connection = None
+                self.local_until = time.monotonic() + _RETRY_AFTER
+            else:
+                if error is not None:
+                    raise RuntimeError(f"Encoding service failed: {error}")
+                return encodings
+        return encode_chips(chips)
+
+    def face_encodings(self, rgb, locations):
+        return list(self.encode_chips(face_chips(rgb, locations)))
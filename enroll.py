@@ -0,0 +1,120 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import gallery
+
+
+def _encode_worker(image_path, model):
+    # Runs in a pool process; errors are returned so one bad image does not stop the run
+    try:
+        return gallery.encode_image(image_path, model=model), None
+    except Exception as e:
+        return None, str(e)
+
+
+def enroll(directory, workers=None, model='hog', checkpoint_every=100, checkpoint_seconds=30.0):
+    """
+    Encode every new or changed image in directory across a process pool.
+
+    Results are merged into the gallery store as they finish and checkpointed every
+    checkpoint_every images or checkpoint_seconds, so an interrupted run resumes
+    where it stopped: images already in the manifest are not encoded again.
+    """
+    store = gallery.FaceGallery.load(directory, mmap_mode=None)
+    pending, removed = store.scan()
+    results, pending = store.take_legacy(pending)
+    if results or removed or store.dirty:
+        store.update(results, removed)
+        store.save()
+        print(f"Imported {len(results)} legacy encoding(s), removed {len(removed)} image(s).")
+
+    total = len(pending)
+    if total == 0:
+        print(f"Gallery in {directory} is up to date ({len(store)} encodings).")
+        return store
+
+    workers = workers or os.cpu_count() or 1
+    print(f"Enrolling {total} image(s) with {workers} worker process(es)...")
+
+    done = 0
+    faces = 0
+    failed = 0
+    batch = []
+    started = time.perf_counter()
+    last_checkpoint = started
+
+    def checkpoint():
+        nonlocal batch, last_checkpoint
+        if batch:
+            store.update(batch)
+            store.save()
+            batch = []
+        last_checkpoint = time.perf_counter()
+
+    queue_iter = iter(pending)
+    in_flight = {}
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                # Keep the pool busy without submitting thousands of futures up front
+                while len(in_flight) < max_in_flight:
+                    item = next(queue_iter, None)
+                    if item is None:
+                        break
+                    future = executor.submit(_encode_worker, os.path.join(directory, item[0]), model)
+                    in_flight[future] = item
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    filename, entry = in_flight.pop(future)
+                    encoding, error = future.result()
+                    done += 1
+                    if error is not None:
+                        # Not recorded in the manifest, so the next run retries it
+                        failed += 1
+                        print(f"Error processing {filename}: {error}")
+                        continue
+                    if encoding is None:
+                        print(f"No faces found in {filename}. Skipping.")
+                    else:
+                        faces += 1
+                    batch.append((filename, entry, encoding))
+
+                now = time.perf_counter()
+                if len(batch) >= checkpoint_every or now - last_checkpoint >= checkpoint_seconds:
+                    checkpoint()
+                elapsed = now - started
+                print(f"\r[{done}/{total}] {done / elapsed:.1f} img/s, {faces} faces, {failed} errors",
+                      end="", flush=True)
+        except KeyboardInterrupt:
+            print("\nInterrupted, saving progress...")
+            for future in in_flight:
+                future.cancel()
+            checkpoint()
+            raise
+    checkpoint()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nEnrolled {faces} face(s) from {done} image(s) in {elapsed:.1f}s "
+          f"({done / elapsed:.1f} img/s); gallery has {len(store)} encodings.")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-enroll known faces into the gallery store.")
+    parser.add_argument("directory", nargs="?", default="known_faces")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--model", choices=("hog", "cnn"), default="hog")
+    parser.add_argument("--checkpoint-every", type=int, default=100,
+                        help="save the gallery after this many results")
+    args = parser.parse_args()
+    try:
+        enroll(args.directory, workers=args.workers, model=args.model, checkpoint_every=args.checkpoint_every)
+    except KeyboardInterrupt:
+        print("Enrollment interrupted; run it again to resume.")
@@ -0,0 +1,576 @@
+import inspect
+import json
+import os
+
+import numpy as np
+
+from matcher import pairwise_distances, squared_norms, top_k_smallest
+
+# Saved next to the gallery store (see gallery.py). Only the index structure and
+# the gallery rows it covers are stored; vectors are gathered from the
+# memory-mapped gallery matrix when the index is opened.
+GALLERY_INDEX = "gallery_index.npz"
+
+# Rebuild a tree/IVF structure once this fraction of it is pending or deleted
+REBUILD_FRACTION = 0.1
+# Bound the temporary distance matrices built while training/assigning IVF lists
+_CHUNK_ROWS = 16384
+# Quantized codes are widened to float32 this many rows at a time, staying in cache
+_SCAN_ROWS = 1024
+
+
+def _empty_result(m, k):
+    return np.full((m, k), -1, dtype=np.int64), np.full((m, k), np.inf, dtype=np.float32)
+
+
+def _merge_results(parts, k):
+    """Merge several (rows, distances) candidate sets per query into the k nearest."""
+    rows = np.concatenate([p[0] for p in parts], axis=1)
+    distances = np.concatenate([p[1] for p in parts], axis=1)
+    if rows.shape[1] < k:
+        pad_rows, pad_distances = _empty_result(rows.shape[0], k - rows.shape[1])
+        rows = np.concatenate([rows, pad_rows], axis=1)
+        distances = np.concatenate([distances, pad_distances], axis=1)
+    columns, distances = top_k_smallest(distances, k)
+    rows = np.take_along_axis(rows, columns, axis=1)
+    rows[~np.isfinite(distances)] = -1
+    return rows, distances
+
+
+class FaceIndex:
+    """
+    Base class for nearest-neighbour indexes over gallery rows.
+
+    Subclasses own a "main" structure built over self.vectors. Entries added after
+    the last build go to a small brute-force delta buffer and removals are
+    tombstoned, so enrolling or removing people never needs a full rebuild;
+    compact() folds both back into the main structure.
+    """
+
+    kind = None
+    # True when a search only reads a few rows of self.vectors, which can then stay
+    # in the memory-mapped gallery matrix instead of RAM
+    reads_vectors_on_demand = False
+
+    def __init__(self):
+        self.rows = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0, dtype=str)
+        self.vectors = np.empty((0, 128), dtype=np.float32)
+        self.alive = np.empty(0, dtype=bool)
+        self.delta_rows = np.empty(0, dtype=np.int64)
+        self.delta_keys = np.empty(0, dtype=str)
+        self.delta_vectors = np.empty((0, 128), dtype=np.float32)
+        self.generation = None
+        # Constructor parameters, defaults included (see index_params); None if unknown
+        self.params = None
+
+    def __len__(self):
+        return int(self.alive.sum()) + len(self.delta_rows)
+
+    def memory_bytes(self):
+        """Bytes of the arrays a search keeps in RAM (not counting a tree's own nodes)."""
+        return sum(value.nbytes for name, value in vars(self).items()
+                   if isinstance(value, np.ndarray) and not (name == "vectors" and self.reads_vectors_on_demand))
+
+    # -- structure hooks -------------------------------------------------
+
+    def _build_main(self):
+        raise NotImplementedError
+
+    def _search_main(self, queries, k):
+        """Return (positions, distances) into self.vectors, skipping dead entries."""
+        raise NotImplementedError
+
+    def _state(self):
+        return {}
+
+    def _load_state(self, state):
+        pass
+
+    # -- public API --------------------------------------------------------
+
+    def build(self, vectors, rows=None, keys=None):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, 128)
+        self.vectors = vectors
+        self.rows = np.arange(len(vectors), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.keys = np.asarray(keys if keys is not None else [""] * len(vectors), dtype=str)
+        self.alive = np.ones(len(vectors), dtype=bool)
+        self.delta_rows = np.empty(0, dtype=np.int64)
+        self.delta_keys = np.empty(0, dtype=str)
+        self.delta_vectors = np.empty((0, 128), dtype=np.float32)
+        self._build_main()
+        return self
+
+    def add(self, vectors, rows, keys=None):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+        keys = keys if keys is not None else [""] * len(vectors)
+        self.delta_vectors = np.concatenate([self.delta_vectors, vectors])
+        self.delta_rows = np.concatenate([self.delta_rows, np.asarray(rows, dtype=np.int64)])
+        self.delta_keys = np.concatenate([self.delta_keys, np.asarray(keys, dtype=str)])
+        self._maybe_compact()
+
+    def remove(self, rows):
+        rows = np.asarray(list(rows), dtype=np.int64)
+        self.alive &= ~np.isin(self.rows, rows)
+        keep = ~np.isin(self.delta_rows, rows)
+        self.delta_rows = self.delta_rows[keep]
+        self.delta_keys = self.delta_keys[keep]
+        self.delta_vectors = self.delta_vectors[keep]
+        self._maybe_compact()
+
+    def search(self, queries, k=1):
+        """Return (rows, distances), both (M, k); missing neighbours are -1 / inf."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+        parts = []
+        if self.alive.any():
+            positions, distances = self._search_main(queries, k)
+            rows = np.where(positions >= 0, self.rows[np.maximum(positions, 0)], -1)
+            parts.append((rows, distances))
+        if len(self.delta_rows):
+            columns, distances = top_k_smallest(pairwise_distances(queries, self.delta_vectors), k)
+            parts.append((self.delta_rows[columns], distances))
+        if not parts:
+            return _empty_result(len(queries), k)
+        return _merge_results(parts, k)
+
+    def compact(self):
+        keep = self.alive
+        self.build(
+            np.concatenate([self.vectors[keep], self.delta_vectors]),
+            np.concatenate([self.rows[keep], self.delta_rows]),
+            np.concatenate([self.keys[keep], self.delta_keys]),
+        )
+
+    def _maybe_compact(self):
+        stale = len(self.delta_rows) + int((~self.alive).sum())
+        if stale > REBUILD_FRACTION * max(len(self.rows), 1):
+            self.compact()
+
+    def sync(self, gallery):
+        """
+        Bring the index up to date with gallery incrementally.
+
+        Entries are matched by gallery.row_keys(), so rows that moved are renumbered,
+        rows that disappeared are removed and only new rows are inserted.
+        Returns True when anything changed.
+        """
+        keys = gallery.row_keys()
+        key_to_row = {key: row for row, key in enumerate(keys)}
+        changed = False
+
+        def renumber(entry_keys, entry_rows):
+            nonlocal changed
+            new_rows = np.array([key_to_row.get(key, -1) for key in entry_keys], dtype=np.int64)
+            if not np.array_equal(new_rows, entry_rows):
+                changed = True
+            return new_rows
+
+        self.rows = renumber(self.keys, self.rows)
+        self.alive &= self.rows >= 0
+        delta_rows = renumber(self.delta_keys, self.delta_rows)
+        keep = delta_rows >= 0
+        self.delta_rows, self.delta_keys, self.delta_vectors = delta_rows[keep], self.delta_keys[keep], self.delta_vectors[keep]
+
+        indexed = set(self.rows[self.alive].tolist()) | set(self.delta_rows.tolist())
+        new_rows = [row for row in range(len(keys)) if row not in indexed]
+        self.generation = gallery.generation
+        if new_rows:
+            self.add(np.asarray(gallery.encodings[new_rows]), new_rows, [keys[row] for row in new_rows])
+            return True
+        if changed:
+            self._maybe_compact()
+        return changed
+
+    def arrays(self):
+        """
+        The index as named arrays, without the vectors (those are gathered from the
+        gallery on load). Only valid for a compacted index: the delta buffer is not included.
+        """
+        arrays = dict(kind=self.kind, generation=self.generation if self.generation is not None else -1,
+                      rows=self.rows, keys=self.keys, **self._state())
+        if self.params is not None:
+            arrays["params"] = json.dumps(self.params, sort_keys=True)
+        return arrays
+
+    def save(self, path):
+        self.compact()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.arrays())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, gallery):
+        """
+        Load an index saved by save(); vectors are gathered from the gallery matrix.
+
+        If the gallery changed since the index was saved, entries are renumbered by key
+        and entries whose image is gone are tombstoned; call sync() to add new rows.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls.from_arrays({name: data[name] for name in data.files}, gallery)
+
+    @classmethod
+    def from_arrays(cls, arrays, gallery):
+        """Rebuild an index from arrays() output (see load())."""
+        index_cls = INDEX_TYPES[str(arrays["kind"])]
+        index = index_cls.__new__(index_cls)
+        FaceIndex.__init__(index)
+        index.rows = arrays["rows"]
+        index.keys = arrays["keys"]
+        index.generation = int(arrays["generation"])
+        index.params = json.loads(str(arrays["params"])) if "params" in arrays else None
+        state = {name: value for name, value in arrays.items()
+                 if name not in ("kind", "generation", "rows", "keys", "params")}
+        if index.generation != gallery.generation:
+            key_to_row = {key: row for row, key in enumerate(gallery.row_keys())}
+            index.rows = np.array([key_to_row.get(key, -1) for key in index.keys], dtype=np.int64)
+        index.alive = index.rows >= 0
+        if np.array_equal(index.rows, np.arange(len(gallery.encodings))):
+            # Every gallery row in order: use the (memory-mapped) gallery matrix instead of a copy
+            index.vectors = np.asarray(gallery.encodings, dtype=np.float32)
+        else:
+            index.vectors = np.ascontiguousarray(gallery.encodings[np.maximum(index.rows, 0)], dtype=np.float32)
+        index._load_state(state)
+        return index
+
+
+class BruteForceIndex(FaceIndex):
+    """Exact search: one batched distance pass over every entry."""
+
+    kind = "brute"
+
+    def _build_main(self):
+        self.sq_norms = squared_norms(self.vectors)
+
+    def _load_state(self, state):
+        self._build_main()
+
+    def _search_main(self, queries, k):
+        distances = pairwise_distances(queries, self.vectors, self.sq_norms)
+        distances[:, ~self.alive] = np.inf
+        positions, distances = top_k_smallest(distances, k)
+        positions[~np.isfinite(distances)] = -1
+        return positions, distances
+
+
+class TreeIndex(FaceIndex):
+    """Exact search with a ball tree (needs scikit-learn); good for mid-sized galleries."""
+
+    kind = "tree"
+
+    def __init__(self, leaf_size=40):
+        super().__init__()
+        self.leaf_size = leaf_size
+
+    def _build_main(self):
+        try:
+            from sklearn.neighbors import BallTree
+        except ImportError:
+            raise ImportError("The 'tree' index needs scikit-learn: pip install scikit-learn")
+        self.tree = BallTree(self.vectors, leaf_size=self.leaf_size) if len(self.vectors) else None
+
+    def _state(self):
+        return {"leaf_size": self.leaf_size}
+
+    def _load_state(self, state):
+        self.leaf_size = int(state.get("leaf_size", 40))
+        self._build_main()
+
+    def _search_main(self, queries, k):
+        # Ask for extra neighbours so tombstoned entries can be skipped
+        dead = int((~self.alive).sum())
+        k_query = min(k + dead, len(self.vectors))
+        distances, positions = self.tree.query(queries, k=k_query)
+        distances = distances.astype(np.float32)
+        distances[~self.alive[positions]] = np.inf
+        columns, distances = top_k_smallest(distances, k)
+        positions = np.take_along_axis(positions, columns, axis=1)
+        positions[~np.isfinite(distances)] = -1
+        if positions.shape[1] < k:
+            pad_positions, pad_distances = _empty_result(len(queries), k - positions.shape[1])
+            positions = np.concatenate([positions, pad_positions], axis=1)
+            distances = np.concatenate([distances, pad_distances], axis=1)
+        return positions, distances
+
+
+class IVFIndex(FaceIndex):
+    """
+    Approximate search with an inverted file: vectors are bucketed by their nearest
+    k-means centroid and a query only scans the nprobe closest buckets, so the cost
+    per face grows with sqrt(N) instead of N.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist=None, nprobe=8, train_iterations=8, seed=0):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = np.empty((0, 128), dtype=np.float32)
+        self.trained_size = 0
+
+    def _assign(self, vectors):
+        centroid_norms = squared_norms(self.centroids)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), _CHUNK_ROWS):
+            chunk = vectors[start:start + _CHUNK_ROWS]
+            assignment[start:start + len(chunk)] = np.argmin(
+                pairwise_distances(chunk, self.centroids, centroid_norms), axis=1)
+        return assignment
+
+    def _train(self):
+        n = len(self.vectors)
+        nlist = self.nlist or max(1, int(round(2 * np.sqrt(n))))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        sample = self.vectors[rng.choice(n, size=min(n, 64 * nlist), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignment = self._assign(sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, sample)
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+        self.trained_size = n
+
+    def _build_main(self):
+        if len(self.vectors) == 0:
+            self.list_offsets = np.zeros(1, dtype=np.int64)
+            return
+        # Retrain only when the gallery grew a lot since the centroids were fitted
+        if len(self.centroids) == 0 or len(self.vectors) > 4 * self.trained_size:
+            self._train()
+        self._sort_into_lists(self._assign(self.vectors))
+
+    def compact(self):
+        if len(self.centroids) == 0 or len(self.rows) + len(self.delta_rows) > 4 * self.trained_size:
+            super().compact()
+            return
+        # Keep the trained centroids and existing list assignments; only the delta is assigned
+        keep = self.alive
+        assignment = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+        assignment = np.concatenate([assignment[keep], self._assign(self.delta_vectors)])
+        self.vectors = np.concatenate([self.vectors[keep], self.delta_vectors])
+        self.rows = np.concatenate([self.rows[keep], self.delta_rows])
+        self.keys = np.concatenate([self.keys[keep], self.delta_keys])
+        self.alive = np.ones(len(self.rows), dtype=bool)
+        self.delta_rows = np.empty(0, dtype=np.int64)
+        self.delta_keys = np.empty(0, dtype=str)
+        self.delta_vectors = np.empty((0, 128), dtype=np.float32)
+        self._sort_into_lists(assignment)
+
+    def _sort_into_lists(self, assignment):
+        order = np.argsort(assignment, kind='stable')
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        self.rows = self.rows[order]
+        self.keys = self.keys[order]
+        self.alive = self.alive[order]
+        self.sq_norms = squared_norms(self.vectors)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))])
+
+    def _state(self):
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets,
+                "nprobe": self.nprobe, "trained_size": self.trained_size}
+
+    def _load_state(self, state):
+        # Used when the lists are retrained; older files did not record them
+        params = self.params or {}
+        self.nlist = params.get("nlist")
+        self.train_iterations = params.get("train_iterations", 8)
+        self.seed = params.get("seed", 0)
+        self.centroids = state["centroids"]
+        self.list_offsets = state["list_offsets"]
+        self.nprobe = int(state["nprobe"])
+        self.trained_size = int(state["trained_size"])
+        self.sq_norms = squared_norms(self.vectors)
+
+    def _search_main(self, queries, k):
+        positions_out, distances_out = _empty_result(len(queries), k)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe_lists, _ = top_k_smallest(pairwise_distances(queries, self.centroids), nprobe)
+        for q, lists in enumerate(probe_lists):
+            candidates = np.concatenate([
+                np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists])
+            candidates = candidates[self.alive[candidates]]
+            if len(candidates) == 0:
+                continue
+            distances = pairwise_distances(queries[q:q + 1], self.vectors[candidates], self.sq_norms[candidates])
+            columns, top = top_k_smallest(distances, k)
+            positions_out[q, :columns.shape[1]] = candidates[columns[0]]
+            distances_out[q, :columns.shape[1]] = top[0]
+        return positions_out, distances_out
+
+
+class QuantizedIndex(FaceIndex):
+    """
+    Approximate search in two passes over a compact copy of the gallery.
+
+    Every entry is scored against self.codes, a low-precision copy of the vectors,
+    and only the rerank closest candidates are scored again against the float32
+    vectors. Those rows are read on demand, so the vectors stay in the memory-mapped
+    gallery matrix and RAM holds just the codes. The returned distances are exact, but
+    a true neighbour that quantization pushes out of the shortlist is lost: rerank is
+    the recall knob, trading a larger float32 pass for fewer misses.
+    """
+
+    reads_vectors_on_demand = True
+
+    def __init__(self, rerank=32):
+        super().__init__()
+        self.rerank = rerank
+        self.codes = np.empty((0, 128), dtype=np.float32)
+        self.scale = np.ones(128, dtype=np.float32)
+        self.code_norms = np.empty(0, dtype=np.float32)
+
+    def _quantize(self, vectors):
+        """Return (codes, scale) such that codes * scale approximates vectors."""
+        raise NotImplementedError
+
+    def _widened_codes(self):
+        """Yield (start, float32 chunk of self.codes), reusing one buffer."""
+        buffer = np.empty((min(_SCAN_ROWS, len(self.codes)), 128), dtype=np.float32)
+        for start in range(0, len(self.codes), _SCAN_ROWS):
+            chunk = buffer[:min(_SCAN_ROWS, len(self.codes) - start)]
+            chunk[...] = self.codes[start:start + len(chunk)]
+            yield start, chunk
+
+    def _build_main(self):
+        self.codes, self.scale = self._quantize(self.vectors)
+        self._compute_code_norms()
+
+    def _compute_code_norms(self):
+        self.code_norms = np.empty(len(self.codes), dtype=np.float32)
+        for start, chunk in self._widened_codes():
+            chunk *= self.scale
+            self.code_norms[start:start + len(chunk)] = squared_norms(chunk)
+
+    def sync(self, gallery):
+        changed = super().sync(gallery)
+        if self.alive.all() and np.array_equal(self.rows, np.arange(len(gallery.encodings))):
+            # Share the gallery matrix instead of the copy compact() made
+            self.vectors = np.asarray(gallery.encodings, dtype=np.float32)
+        return changed
+
+    def _state(self):
+        return {"codes": self.codes, "scale": self.scale, "rerank": self.rerank}
+
+    def _load_state(self, state):
+        self.codes = state["codes"]
+        self.scale = state["scale"]
+        self.rerank = int(state["rerank"])
+        self._compute_code_norms()
+
+    def _search_main(self, queries, k):
+        # Approximate squared distances to every entry, from the codes
+        scaled = queries * self.scale
+        estimates = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start, chunk in self._widened_codes():
+            estimates[:, start:start + len(chunk)] = scaled @ chunk.T
+        estimates *= -2.0
+        estimates += squared_norms(queries)[:, None]
+        estimates += self.code_norms[None, :]
+        estimates[:, ~self.alive] = np.inf
+        candidates, candidate_estimates = top_k_smallest(estimates, max(self.rerank, k))
+
+        positions_out, distances_out = _empty_result(len(queries), k)
+        for q in range(len(queries)):
+            # Sorted, so the rows are read from the mapped file in order
+            positions = np.sort(candidates[q][np.isfinite(candidate_estimates[q])])
+            if len(positions) == 0:
+                continue
+            distances = pairwise_distances(queries[q:q + 1], self.vectors[positions])
+            columns, top = top_k_smallest(distances, k)
+            positions_out[q, :columns.shape[1]] = positions[columns[0]]
+            distances_out[q, :columns.shape[1]] = top[0]
+        return positions_out, distances_out
+
+
+class Int8Index(QuantizedIndex):
+    """QuantizedIndex with one signed byte per dimension (4x smaller than float32)."""
+
+    kind = "int8"
+
+    def _quantize(self, vectors):
+        # One symmetric scale per dimension, from the largest magnitude in it
+        scale = np.zeros(128, dtype=np.float32)
+        for start in range(0, len(vectors), _CHUNK_ROWS):
+            np.maximum(scale, np.abs(vectors[start:start + _CHUNK_ROWS]).max(axis=0), out=scale)
+        scale = np.where(scale > 0, scale / 127.0, 1.0).astype(np.float32)
+        codes = np.empty((len(vectors), 128), dtype=np.int8)
+        for start in range(0, len(vectors), _CHUNK_ROWS):
+            chunk = np.rint(vectors[start:start + _CHUNK_ROWS] / scale)
+            codes[start:start + len(chunk)] = np.clip(chunk, -127, 127)
+        return codes, scale
+
+
+class Float16Index(QuantizedIndex):
+    """
+    QuantizedIndex with half-precision codes (2x smaller than float32). Closer to the
+    exact distances than int8, but numpy widens float16 slowly, so scans take longer.
+    """
+
+    kind = "float16"
+
+    def _quantize(self, vectors):
+        return np.asarray(vectors, dtype=np.float16), np.ones(128, dtype=np.float32)
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (BruteForceIndex, TreeIndex, IVFIndex, Int8Index, Float16Index)}
+
+
+def _index_type(kind):
+    try:
+        return INDEX_TYPES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown index type {kind!r}; choose one of {sorted(INDEX_TYPES)}")
+
+
+def index_params(kind, **params):
+    """params with the defaults of the kind's constructor filled in, as saved with the index."""
+    bound = inspect.signature(_index_type(kind)).bind(**params)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+def create_index(kind="brute", **params):
+    index = _index_type(kind)(**params)
+    index.params = index_params(kind, **params)
+    return index
+
+
+def open_index(gallery, kind="brute", **params):
+    """
+    Load the index saved next to gallery, or build one.
+
+    A saved index of the same kind and params is brought up to date with sync(),
+    touching only rows that were enrolled or removed since it was written, and saved
+    again if it changed. One built with another kind or other params (or saved before
+    params were recorded) is rebuilt.
+    """
+    wanted = index_params(kind, **params)
+    path = os.path.join(gallery.directory, GALLERY_INDEX)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = FaceIndex.load(path, gallery)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print(f"Error loading {path}: {e}")
+    if index is not None and (index.kind != kind or index.params != wanted):
+        print(f"Rebuilding the {index.kind} index {index.params} as {kind} {wanted}")
+        index = None
+
+    if index is None:
+        index = create_index(kind, **params)
+        index.build(gallery.encodings, keys=gallery.row_keys())
+        index.generation = gallery.generation
+        index.save(path)
+        print(f"Built {kind} index over {len(index)} encodings")
+    elif index.generation != gallery.generation:
+        index.sync(gallery)
+        index.save(path)
+        print(f"Updated {kind} index ({len(index)} encodings)")
+    return index
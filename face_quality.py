@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+REASONS = ("size", "blur", "dark", "bright", "pose")
+
+
+def sharpness(grey):
+    """Variance of the Laplacian: low for blurred or out-of-focus crops."""
+    return float(cv2.Laplacian(grey, cv2.CV_32F).var())
+
+
+def yaw_ratio(keypoints):
+    """
+    How far the nose sits from the middle of the eyes, in inter-eye distances.
+
+    keypoints are MediaPipe's (x, y) pixels: right eye, left eye, nose tip, ...
+    About 0 for a frontal face, growing as the head turns into profile.
+    """
+    (right_eye_x, _), (left_eye_x, _), (nose_x, _) = keypoints[:3]
+    eye_distance = abs(left_eye_x - right_eye_x)
+    if eye_distance < 1:
+        return float("inf")
+    return abs(nose_x - (left_eye_x + right_eye_x) / 2) / eye_distance
+
+
+class QualityGate:
+    """
+    Cheap checks that decide whether a detected face is worth the 128-d encoding.
+
+    Faces that are too small, blurred, badly exposed or (with MediaPipe keypoints)
+    turned too far into profile would mostly come out "Unknown" or low-confidence, so
+    they are not encoded; the tracker keeps their previous identity and retries on a
+    later frame. Sizes are in pixels of the full-resolution frame the faces are encoded
+    from. Set a threshold to None to skip that check.
+    """
+
+    def __init__(self, min_size=40, min_sharpness=20.0, min_brightness=40.0, max_brightness=225.0,
+                 max_yaw=0.6):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_yaw = max_yaw
+        self.reset()
+
+    def reset(self):
+        self.checked = 0
+        self.rejected = dict.fromkeys(REASONS, 0)
+
+    def reject_reason(self, rgb_frame, location, keypoints=None):
+        """Return why the face at location should not be encoded, or None if it is good enough."""
+        top, right, bottom, left = location
+        if self.min_size and min(bottom - top, right - left) < self.min_size:
+            return "size"
+        if keypoints is not None and self.max_yaw is not None and len(keypoints) >= 3 \
+                and yaw_ratio(keypoints) > self.max_yaw:
+            return "pose"
+        height, width = rgb_frame.shape[:2]
+        crop = rgb_frame[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+        if crop.size == 0:
+            return "size"
+        # Measured on a fixed-size thumbnail so the cost and the thresholds do not depend on the face size
+        grey = cv2.cvtColor(cv2.resize(crop, (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        brightness = float(grey.mean())
+        if self.min_brightness is not None and brightness < self.min_brightness:
+            return "dark"
+        if self.max_brightness is not None and brightness > self.max_brightness:
+            return "bright"
+        if self.min_sharpness is not None and sharpness(grey) < self.min_sharpness:
+            return "blur"
+        return None
+
+    def encode_faces(self, rgb_frame, face_locations, keypoints, encode):
+        """
+        encode(rgb_frame, locations) for the faces that pass, in one call.
+
+        Returns (encodings, reasons): one entry per location, with encoding None and the
+        reject reason set for the faces that were not encoded.
+        """
+        keypoints = keypoints or [None] * len(face_locations)
+        reasons = [self.reject_reason(rgb_frame, location, points)
+                   for location, points in zip(face_locations, keypoints)]
+        passed = [i for i, reason in enumerate(reasons) if reason is None]
+        encodings = [None] * len(face_locations)
+        if passed:
+            for i, encoding in zip(passed, encode(rgb_frame, [face_locations[i] for i in passed])):
+                encodings[i] = np.asarray(encoding, dtype=np.float32)
+        return encodings, reasons
+
+    def count(self, reasons):
+        """Add one frame's reasons (from encode_faces, possibly run in another process) to the counters."""
+        self.checked += len(reasons)
+        for reason in reasons:
+            if reason:
+                self.rejected[reason] += 1
+
+    def stats(self):
+        return {
+            "faces_checked": self.checked,
+            "encodings_saved": sum(self.rejected.values()),
+            "rejected": dict(self.rejected),
+        }
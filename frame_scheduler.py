@@ -0,0 +1,145 @@
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+class FrameScheduler:
+    """
+    Decides which captured frames get analyzed (detection/encoding/matching).
+
+    Instead of a fixed "every n-th frame", the analysis rate is the lowest of:
+      - target_fps while the scene is active (motion or tracked faces), idle_fps otherwise
+      - the rate the measured per-frame CPU time allows within cpu_budget
+        (in cores, e.g. 0.5 = half of one core; by default one per worker)
+      - the rate the measured per-frame analysis latency allows, with workers
+        frames analyzed in parallel
+    but never below min_fps. Stages that run in this process are timed with stage();
+    the analysis workers' timings and CPU time come in through record_analysis().
+    """
+
+    def __init__(self, target_fps=10.0, idle_fps=2.0, min_fps=1.0, cpu_budget=None, workers=1,
+                 motion_threshold=3.0, smoothing=0.2, log_every=30.0):
+        self.target_fps = target_fps
+        self.idle_fps = idle_fps
+        self.min_fps = min_fps
+        self.workers = workers
+        self.cpu_budget = float(workers) if cpu_budget is None else cpu_budget
+        # Mean absolute grey-level change between thumbnails that counts as motion
+        self.motion_threshold = motion_threshold
+        self.smoothing = smoothing
+        self.log_every = log_every
+
+        self.analysis_seconds = 0.0  # EMA of wall time per analyzed frame, in this process
+        self.analysis_cpu_seconds = 0.0  # EMA of CPU time per analyzed frame, in this process
+        self.worker_seconds = 0.0  # EMA of a worker's wall time per frame
+        self.worker_cpu_seconds = 0.0  # EMA of a worker's CPU time per frame
+        self.stage_seconds = {}  # EMA per stage name
+        self.motion = 0.0
+        self.effective_fps = target_fps
+        self.frames_seen = 0
+        self.frames_analyzed = 0
+        self.skipped = {"rate": 0, "idle": 0, "cpu_budget": 0, "latency": 0}
+
+        self._pending_wall = 0.0
+        self._pending_cpu = 0.0
+        self._pending_frames = 0
+        self._last_analyzed = None
+        self._previous_thumb = None
+        self._last_log = time.perf_counter()
+
+    def _ema(self, current, sample):
+        if current == 0.0:
+            return sample
+        return (1 - self.smoothing) * current + self.smoothing * sample
+
+    @contextmanager
+    def stage(self, name):
+        """Time one stage of the analysis of the current frame."""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - wall
+            self._pending_wall += elapsed
+            self._pending_cpu += time.process_time() - cpu
+            self.stage_seconds[name] = self._ema(self.stage_seconds.get(name, 0.0), elapsed)
+            metrics.observe(name, elapsed)
+
+    def record_analysis(self, timings, cpu_seconds):
+        """Add a worker's analysis of one frame: its stage timings and CPU seconds."""
+        self.worker_seconds = self._ema(self.worker_seconds, sum(timings.values()))
+        self.worker_cpu_seconds = self._ema(self.worker_cpu_seconds, cpu_seconds)
+        for name, seconds in timings.items():
+            self.stage_seconds[name] = self._ema(self.stage_seconds.get(name, 0.0), seconds)
+
+    def _measure_motion(self, frame):
+        thumb = cv2.cvtColor(cv2.resize(frame, (64, 48), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self._previous_thumb is not None:
+            diff = cv2.absdiff(thumb, self._previous_thumb)
+            self.motion = self._ema(self.motion, float(np.mean(diff)))
+        self._previous_thumb = thumb
+
+    def should_process(self, frame, active_tracks=0, now=None):
+        now = time.perf_counter() if now is None else now
+        self.frames_seen += 1
+        self._measure_motion(frame)
+
+        # Fold the stages timed since the last decision into the per-frame cost
+        if self._pending_frames:
+            self.analysis_seconds = self._ema(self.analysis_seconds, self._pending_wall)
+            self.analysis_cpu_seconds = self._ema(self.analysis_cpu_seconds, self._pending_cpu)
+            self._pending_wall = self._pending_cpu = 0.0
+            self._pending_frames = 0
+
+        active = active_tracks > 0 or self.motion >= self.motion_threshold
+        limits = {"idle": self.target_fps if active else self.idle_fps}
+        cpu_seconds = self.analysis_cpu_seconds + self.worker_cpu_seconds
+        if cpu_seconds > 0:
+            limits["cpu_budget"] = self.cpu_budget / cpu_seconds
+        if self.analysis_seconds > 0:
+            limits["latency"] = 1.0 / self.analysis_seconds
+        if self.worker_seconds > 0:
+            # The workers analyze that many frames at once
+            limits["latency"] = min(limits.get("latency", float("inf")), self.workers / self.worker_seconds)
+        limiter = min(limits, key=limits.get)
+        self.effective_fps = max(limits[limiter], self.min_fps)
+
+        if self._last_analyzed is not None and now - self._last_analyzed < 1.0 / self.effective_fps:
+            # Charge the skip to whatever is holding the rate below the target
+            reason = limiter if limits[limiter] < self.target_fps else "rate"
+            self.skipped[reason] += 1
+            decision = False
+        else:
+            self._last_analyzed = now
+            self._pending_frames = 1
+            self.frames_analyzed += 1
+            decision = True
+
+        if self.log_every and now - self._last_log >= self.log_every:
+            self._last_log = now
+            print(self.summary())
+        return decision
+
+    def metrics(self):
+        return {
+            "frames_seen": self.frames_seen,
+            "frames_analyzed": self.frames_analyzed,
+            "frames_skipped": dict(self.skipped),
+            "effective_fps": self.effective_fps,
+            "analysis_ms": self.analysis_seconds * 1e3,
+            "analysis_cpu_ms": self.analysis_cpu_seconds * 1e3,
+            "worker_ms": self.worker_seconds * 1e3,
+            "worker_cpu_ms": self.worker_cpu_seconds * 1e3,
+            "motion": self.motion,
+            "stage_ms": {name: seconds * 1e3 for name, seconds in self.stage_seconds.items()},
+        }
+
+    def summary(self):
+        stages = ", ".join(f"{name} {seconds * 1e3:.1f}ms" for name, seconds in self.stage_seconds.items())
+        return (f"Analysis {self.effective_fps:.1f} fps ({self.frames_analyzed}/{self.frames_seen} frames, "
+                f"skipped {self.skipped}), motion {self.motion:.1f}, {stages}")
@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+
+import numpy as np
+
+# On-disk gallery store, kept next to the source images:
+#   gallery_encodings.npy  - contiguous float32 (N, 128) matrix, memory-mapped on load
+#   gallery_names.json     - one entry per matrix row (name, source image)
+#   gallery_manifest.json  - source image -> sha1/mtime/size and the row it produced
+# A search index built from the store (see face_index.py) is saved alongside it.
+GALLERY_ENCODINGS = "gallery_encodings.npy"
+GALLERY_NAMES = "gallery_names.json"
+GALLERY_MANIFEST = "gallery_manifest.json"
+MANIFEST_VERSION = 2
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+ENCODING_SIZE = 128
+
+# Several photos can belong to one person: known_faces/Joe.jpg, Joe2.jpg and Joe_3.jpg
+# are all "Joe", and so is every image in a known_faces/Joe/ sub-directory. The directory
+# name is taken as it is, so a name that ends in digits ("agent007") needs one.
+MAX_ENCODINGS_PER_IDENTITY = 8
+# A new encoding this close to one already stored for the same person adds nothing
+DUPLICATE_DISTANCE = 0.15
+
+_NUMBERED_STEM = re.compile(r"^(.*?)[ _-]?\d+$")
+
+
+def identity_name(filename):
+    """
+    Return the person a gallery image belongs to ("Joe/a.jpg" and "Joe2.jpg" -> "Joe").
+
+    Trailing digits of a file name are a sample number; "agent007/a.jpg" keeps them.
+    """
+    directory, basename = os.path.split(filename)
+    if directory:
+        return directory
+    stem = os.path.splitext(basename)[0]
+    numbered = _NUMBERED_STEM.match(stem)
+    if numbered and numbered.group(1):
+        return numbered.group(1)
+    return stem
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_image(image_path, model='hog'):
+    """Return the float32 encoding of the first face in image_path, or None."""
+    # Imported here so loading an up-to-date gallery never pays for dlib
+    import face_recognition
+
+    image = face_recognition.load_image_file(image_path)
+    face_locations = face_recognition.face_locations(image, model=model)
+    face_encodings = face_recognition.face_encodings(image, face_locations)
+    if not face_encodings:
+        return None
+    return np.asarray(face_encodings[0], dtype=np.float32)
+
+
+def _write_atomic(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, data):
+    _write_atomic(path, lambda f: f.write(json.dumps(data).encode("utf-8")))
+
+
+def _load_legacy_pickle(directory, filename):
+    # Migrate the old one-pickle-per-image cache instead of re-encoding
+    pkl_path = os.path.join(directory, os.path.splitext(filename)[0] + ".pkl")
+    try:
+        with open(pkl_path, 'rb') as pkl_file:
+            return np.asarray(pickle.load(pkl_file), dtype=np.float32)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+
+
+class FaceGallery:
+    def __init__(self, directory, max_per_identity=MAX_ENCODINGS_PER_IDENTITY,
+                 duplicate_distance=DUPLICATE_DISTANCE):
+        self.directory = directory
+        self.max_per_identity = max_per_identity
+        self.duplicate_distance = duplicate_distance
+        self.encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        # Per row: the identity it belongs to and the image it came from
+        self.names = []
+        self.sources = []
+        # filename -> {"sha1", "mtime", "size", "row"}; row is None when no face was
+        # found or, with "skipped" set, when the encoding was a near-duplicate or over the cap
+        self.files = {}
+        # Set when the manifest changed without touching the encodings
+        self.dirty = False
+        # Bumped on every save so derived files (e.g. the search index) can tell they are stale
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r', **options):
+        """Open the store in directory; a missing or inconsistent store loads as empty."""
+        gallery = cls(directory, **options)
+        try:
+            with open(gallery._path(GALLERY_MANIFEST), 'rb') as f:
+                manifest = json.load(f)
+            with open(gallery._path(GALLERY_NAMES), 'rb') as f:
+                rows = json.load(f)["rows"]
+            encodings = np.load(gallery._path(GALLERY_ENCODINGS), mmap_mode=mmap_mode)
+        except (OSError, ValueError, KeyError):
+            return gallery
+
+        if (manifest.get("version") not in (1, MANIFEST_VERSION)
+                or manifest.get("count") != len(rows)
+                or encodings.shape != (len(rows), ENCODING_SIZE)
+                or encodings.dtype != np.float32):
+            print(f"Gallery store in {directory} is inconsistent, rebuilding it.")
+            return gallery
+
+        gallery.encodings = encodings
+        gallery.names = [row["name"] for row in rows]
+        gallery.sources = [row["source"] for row in rows]
+        gallery.files = manifest["files"]
+        gallery.generation = manifest.get("generation", 0)
+        if manifest["version"] == 1:
+            # Version 1 named every image separately; regroup rows by person
+            gallery.names = [identity_name(source) for source in gallery.sources]
+            gallery.dirty = True
+        return gallery
+
+    def _image_entries(self):
+        # Images directly in the directory, plus one level of per-person sub-directories
+        with os.scandir(self.directory) as it:
+            entries = list(it)
+        for dir_entry in entries:
+            if dir_entry.is_dir():
+                with os.scandir(dir_entry.path) as sub_it:
+                    for sub_entry in sub_it:
+                        if sub_entry.name.lower().endswith(IMAGE_EXTENSIONS) and sub_entry.is_file():
+                            yield f"{dir_entry.name}/{sub_entry.name}", sub_entry
+            elif dir_entry.name.lower().endswith(IMAGE_EXTENSIONS) and dir_entry.is_file():
+                yield dir_entry.name, dir_entry
+
+    def scan(self):
+        """
+        Compare known_faces/ against the manifest.
+
+        Returns (pending, removed): pending is a list of (filename, entry) for images
+        that are new or whose content changed, removed lists manifest files that are gone.
+        Unchanged images only cost a stat(); images are hashed only when mtime/size moved.
+        """
+        pending = []
+        seen = set()
+        for filename, dir_entry in self._image_entries():
+            seen.add(filename)
+            st = dir_entry.stat()
+            known = self.files.get(filename)
+            if known and known["mtime"] == st.st_mtime_ns and known["size"] == st.st_size:
+                continue
+            sha1 = file_sha1(dir_entry.path)
+            if known and known["sha1"] == sha1:
+                # Touched but not modified: refresh the stat fields, keep the encoding
+                known["mtime"] = st.st_mtime_ns
+                known["size"] = st.st_size
+                self.dirty = True
+                continue
+            pending.append((filename, {"sha1": sha1, "mtime": st.st_mtime_ns, "size": st.st_size}))
+        removed = [filename for filename in self.files if filename not in seen]
+        return pending, removed
+
+    def update(self, results, removed=()):
+        """
+        Apply (filename, entry, encoding) results and drop removed files.
+
+        encoding may be None when the image has no face. A new encoding is not stored
+        when its person already has max_per_identity encodings or one closer than
+        duplicate_distance. The encoding matrix is rebuilt in memory; call save() to
+        persist it. Returns an int array mapping old row numbers to new ones (-1 for
+        rows that were dropped).
+        """
+        results = list(results)
+        dropped = set(removed)
+        dropped.update(filename for filename, _, _ in results)
+
+        old_to_new = np.full(len(self.names), -1, dtype=np.int64)
+        keep_rows = []
+        shrunk = set()
+        for row, source in enumerate(self.sources):
+            if source not in dropped:
+                old_to_new[row] = len(keep_rows)
+                keep_rows.append(row)
+            else:
+                shrunk.add(self.names[row])
+
+        names = [self.names[row] for row in keep_rows]
+        sources = [self.sources[row] for row in keep_rows]
+        kept_encodings = np.asarray(self.encodings[keep_rows], dtype=np.float32)
+        identity_rows = {}
+        for row, name in enumerate(names):
+            identity_rows.setdefault(name, []).append(row)
+
+        for filename in removed:
+            self.files.pop(filename, None)
+        for filename, entry in list(self.files.items()):
+            if entry["row"] is not None and filename not in dropped:
+                entry["row"] = int(old_to_new[entry["row"]])
+            elif entry.get("skipped") == "cap" and identity_name(filename) in shrunk:
+                # Room was freed for this person: forget the entry so the next scan retries it
+                del self.files[filename]
+
+        new_encodings = []
+        for filename, entry, encoding in results:
+            entry = {key: entry[key] for key in ("sha1", "mtime", "size")}
+            entry["row"] = None
+            if encoding is not None:
+                encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+                name = identity_name(filename)
+                rows = identity_rows.setdefault(name, [])
+                skipped = self._skip_reason(encoding, rows, kept_encodings, new_encodings)
+                if skipped:
+                    entry["skipped"] = skipped
+                else:
+                    entry["row"] = len(names)
+                    rows.append(len(names))
+                    names.append(name)
+                    sources.append(filename)
+                    new_encodings.append(encoding)
+            self.files[filename] = entry
+
+        parts = [kept_encodings]
+        if new_encodings:
+            parts.append(np.stack(new_encodings))
+        self.encodings = np.ascontiguousarray(np.concatenate(parts))
+        self.names = names
+        self.sources = sources
+        return old_to_new
+
+    def _skip_reason(self, encoding, rows, kept_encodings, new_encodings):
+        if self.max_per_identity and len(rows) >= self.max_per_identity:
+            return "cap"
+        if rows and self.duplicate_distance:
+            existing = np.stack([
+                kept_encodings[row] if row < len(kept_encodings) else new_encodings[row - len(kept_encodings)]
+                for row in rows
+            ])
+            if np.min(np.linalg.norm(existing - encoding, axis=1)) < self.duplicate_distance:
+                return "duplicate"
+        return None
+
+    def identities(self):
+        """Return {name: [rows]} for every person in the gallery."""
+        identity_rows = {}
+        for row, name in enumerate(self.names):
+            identity_rows.setdefault(name, []).append(row)
+        return identity_rows
+
+    def row_keys(self):
+        """Return a "source:sha1" key per row; a key only changes when the encoding does."""
+        return [f"{source}:{self.files[source]['sha1']}" for source in self.sources]
+
+    def save(self):
+        self.dirty = False
+        self.generation += 1
+        encodings = np.ascontiguousarray(self.encodings, dtype=np.float32)
+        _write_atomic(self._path(GALLERY_ENCODINGS), lambda f: np.save(f, encodings))
+        _write_json(self._path(GALLERY_NAMES), {
+            "rows": [{"name": name, "source": source} for name, source in zip(self.names, self.sources)],
+        })
+        # Manifest goes last: it is what marks the other two files as complete
+        _write_json(self._path(GALLERY_MANIFEST), {
+            "version": MANIFEST_VERSION,
+            "count": len(self.names),
+            "generation": self.generation,
+            "files": self.files,
+        })
+
+    def take_legacy(self, pending):
+        """Split pending into (results migrated from legacy .pkl files, images still to encode)."""
+        results = []
+        remaining = []
+        for filename, entry in pending:
+            encoding = None
+            if filename not in self.files:
+                encoding = _load_legacy_pickle(self.directory, filename)
+            if encoding is None:
+                remaining.append((filename, entry))
+            else:
+                results.append((filename, entry, encoding))
+        return results, remaining
+
+    def sync(self, encode=encode_image):
+        """Re-encode only new or changed images and persist the store if anything moved."""
+        pending, removed = self.scan()
+        results, pending = self.take_legacy(pending)
+        for filename, entry in pending:
+            image_path = self._path(filename)
+            try:
+                encoding = encode(image_path)
+            except Exception as e:
+                print(f"Error processing {image_path}: {e}")
+                continue
+            if encoding is None:
+                print(f"No faces found in {image_path}. Skipping.")
+            else:
+                print(f"Generated encoding for {image_path}")
+            results.append((filename, entry, encoding))
+
+        if results or removed:
+            self.update(results, removed)
+            self.save()
+            print(f"Gallery updated: {len(results)} image(s) encoded, {len(removed)} removed.")
+            return True
+        if self.dirty:
+            self.save()
+        return False
+
+
+def load_gallery(directory, sync=True, mmap_mode='r'):
+    """
+    Open the gallery store for directory, encoding new or changed images first.
+
+    The encodings are a read-only float32 memory map. With sync=False the directory
+    is not scanned at all, so startup cost does not depend on the number of images.
+    """
+    print("Loading encodings for faces...")
+    gallery = FaceGallery.load(directory, mmap_mode=mmap_mode)
+    if sync and gallery.sync():
+        gallery = FaceGallery.load(directory, mmap_mode=mmap_mode)
+    print(f"Loaded {len(gallery)} face encodings from {directory}")
+    return gallery
+
+
+def load_known_faces(directory, sync=True, mmap_mode='r'):
+    """Load the gallery store for directory as (encodings, names)."""
+    gallery = load_gallery(directory, sync=sync, mmap_mode=mmap_mode)
+    return gallery.encodings, gallery.names
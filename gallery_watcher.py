@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import face_index
+import gallery
+import warm_start
+from analysis_pool import worker_context
+from matcher import FaceMatcher
+
+
+class GalleryWatcher(threading.Thread):
+    """
+    Keeps a FaceMatcher up to date with known_faces/ from a background thread.
+
+    Every interval seconds the directory (and its per-person sub-directories) is checked
+    by mtime, which catches added, removed and renamed images for a few stat() calls; a
+    full scan, which also catches images edited in place, runs every full_scan_every
+    seconds or after request_reload(). Only new or changed images are encoded, in a
+    separate process so the video loop keeps the GIL, and the new gallery, index and
+    matcher are built off to the side. The video loop picks them up with snapshot(),
+    which just swaps references: frames never wait for a reload.
+
+    After every swap the gallery, index and settings are written to a warm-start
+    snapshot (warm_start.py) that the next load() reads in one go.
+    """
+
+    def __init__(self, directory, index_kind=None, interval=2.0, full_scan_every=60.0, **matcher_options):
+        super().__init__(name="GalleryWatcher", daemon=True)
+        self.directory = directory
+        self.index_kind = index_kind
+        self.interval = interval
+        self.full_scan_every = full_scan_every
+        self.matcher_options = matcher_options
+        self.matcher = None
+        self.store = None
+        self.index = None
+        self.generation = 0  # bumped on every swap
+        self.gallery_generation = None
+        self.reload_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._force = False
+        self._stopped = False
+        self._stamp = None
+        self._last_full_scan = 0.0
+        self._executor = None
+        self._store_stamp = None
+        self._snapshot_due = False
+
+    def _config(self):
+        return {"index_kind": self.index_kind, **self.matcher_options}
+
+    def load(self, sync=False):
+        """
+        Load the gallery in the calling thread (at startup); returns the matcher.
+
+        The warm-start snapshot is used when it is up to date, else the store is opened
+        without looking at the images. The scan for new or changed images then runs in
+        the background as soon as the thread starts; sync=True does it here instead.
+        """
+        self._stamp = self._directory_stamp()
+        self._last_full_scan = time.monotonic()
+        snapshot = None if sync else warm_start.load(self.directory, self._config())
+        if snapshot:
+            store, index = snapshot
+            self._store_stamp = warm_start.store_stamp(self.directory)
+            self._publish(store, index)
+            self._snapshot_due = False
+            print(f"Loaded {len(store)} face encodings from the warm-start snapshot")
+        else:
+            stamp = warm_start.store_stamp(self.directory)
+            store = gallery.load_gallery(self.directory, sync=sync)
+            if sync:
+                # The sync may have saved the store after the stamp was taken
+                stamp = warm_start.store_stamp(self.directory)
+            self._store_stamp = stamp
+            self._publish(store)
+        if not sync:
+            self.request_reload()
+        return self.matcher
+
+    def snapshot(self):
+        """The current (matcher, generation)."""
+        with self._lock:
+            return self.matcher, self.generation
+
+    def request_reload(self):
+        """Ask for a full scan now; returns immediately."""
+        self._force = True
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _directory_stamp(self):
+        stamps = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        stamps.append((entry.name, entry.stat().st_mtime_ns))
+            stamps.append(("", os.stat(self.directory).st_mtime_ns))
+        except OSError:
+            return None
+        return tuple(sorted(stamps))
+
+    def _encode(self, image_path):
+        if self._executor is None:
+            # Not a fork of this (threaded) process; shares the analysis workers' fork server
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=worker_context())
+        return self._executor.submit(gallery.encode_image, image_path).result()
+
+    def _build_matcher(self, store, index=None):
+        if index is None and self.index_kind:
+            index = face_index.open_index(store, self.index_kind)
+        return FaceMatcher(store.encodings, store.names, index=index, **self.matcher_options), index
+
+    def _publish(self, store, index=None):
+        matcher, index = self._build_matcher(store, index)
+        with self._lock:
+            self.matcher = matcher
+            self.store = store
+            self.index = index
+            self.generation += 1
+            self.gallery_generation = store.generation
+        self._snapshot_due = True
+
+    def _save_snapshot(self):
+        self._snapshot_due = False
+        try:
+            warm_start.save(self.store, self._store_stamp, self.index, self._config())
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error saving the warm-start snapshot: {e}")
+
+    def _reload(self):
+        started = time.perf_counter()
+        stamp = warm_start.store_stamp(self.directory)
+        store = gallery.FaceGallery.load(self.directory)
+        changed = store.sync(encode=self._encode)
+        if changed:
+            stamp = warm_start.store_stamp(self.directory)
+            store = gallery.FaceGallery.load(self.directory)
+        elif store.generation == self.gallery_generation:
+            return False
+        # Also reached when another process (e.g. enroll.py) updated the store
+        self._store_stamp = stamp
+        self._publish(store)
+        self.reload_seconds = time.perf_counter() - started
+        print(f"Known faces reloaded in the background: {len(store)} encodings ({self.reload_seconds:.2f}s)")
+        return True
+
+    def run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            stamp = self._directory_stamp()
+            full_scan = self._force or time.monotonic() - self._last_full_scan >= self.full_scan_every
+            if stamp == self._stamp and not full_scan:
+                continue
+            self._force = False
+            # Taken before the reload so images added meanwhile are not missed; the store's
+            # own writes then cost one more scan that finds nothing to do
+            self._stamp = stamp
+            try:
+                self._reload()
+            except Exception as e:
+                print(f"Error reloading known faces: {e}")
+            if self._snapshot_due:
+                self._save_snapshot()
+            if full_scan:
+                self._last_full_scan = time.monotonic()
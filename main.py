@@ -1,204 +1,156 @@
-import face_recognition
+# Imported first so the startup timings include the imports below
+from startup import StartupTimer
 import cv2
-import numpy as np
-import os
-import threading
-import queue
-import time
-import pickle
-import csv
 from datetime import datetime, timedelta
 import db_utils
-
-# Step 1: Encode the known faces with caching
-def load_known_faces(directory):
-    known_face_encodings = []
-    known_face_names = []
-    print("Loading encodings for faces...")
-
-    for filename in os.listdir(directory):
-        if filename.lower().endswith((".jpg", ".png")):
-            image_path = os.path.join(directory, filename)
-            name, _ = os.path.splitext(filename)
-            pkl_path = os.path.join(directory, f"{name}.pkl")
-
-            if os.path.exists(pkl_path):
-                # Load encoding from pickle file
-                try:
-                    with open(pkl_path, 'rb') as pkl_file:
-                        encoding = pickle.load(pkl_file)
-                        known_face_encodings.append(encoding)
-                        known_face_names.append(name)
-                        print(f"Loaded encoding from {pkl_path}")
-                except Exception as e:
-                    print(f"Error loading {pkl_path}: {e}")
-                    # If loading fails, proceed to generate encoding
-            else:
-                # Generate encoding and save to pickle
-                try:
-                    image = face_recognition.load_image_file(image_path)
-                    face_encodings = face_recognition.face_encodings(image)
-                    if face_encodings:
-                        encoding = face_encodings[0]
-                        known_face_encodings.append(encoding)
-                        known_face_names.append(name)
-                        print(f"Generated and saved encoding for {image_path}")
-
-                        # Save the encoding to a pickle file
-                        with open(pkl_path, 'wb') as pkl_file:
-                            pickle.dump(encoding, pkl_file)
-                    else:
-                        print(f"No faces found in {image_path}. Skipping.")
-                except Exception as e:
-                    print(f"Error processing {image_path}: {e}")
-
-    # Convert to NumPy array for faster computations
-    known_face_encodings = np.array(known_face_encodings)
-    return known_face_encodings, known_face_names
-
-# Thread class for video capture
-class VideoCaptureThread(threading.Thread):
-    def __init__(self, src=0, width=640, height=480, queue_size=2):
-        super().__init__()
-        self.capture = cv2.VideoCapture(src, cv2.CAP_DSHOW)
-        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.capture.set(cv2.CAP_PROP_FPS, 30)
-        self.queue = queue.Queue(maxsize=queue_size)
-        self.stopped = False
-
-    def run(self):
-        while not self.stopped:
-            if not self.queue.full():
-                ret, frame = self.capture.read()
-                if not ret:
-                    self.stop()
-                    break
-                self.queue.put(frame)
-            else:
-                time.sleep(0.015)  # Prevent busy waiting
-
-    def read(self):
-        return self.queue.get()
-
-    def more(self):
-        return not self.queue.empty()
-
-    def stop(self):
-        self.stopped = True
-        self.capture.release()
+import metrics
+from gallery_watcher import GalleryWatcher
+from tracker import FaceTracker
+from video_capture import VideoCaptureThread
+from frame_scheduler import FrameScheduler
+from analysis_pool import AnalysisPool
+from anonymize import Anonymizer
+from face_quality import QualityGate
+
+# Scale frames are detected at; faces are encoded from the full-resolution frame either way.
+# A list such as [0.25, 0.5] is a coarse-to-fine pyramid, which is lossy: the finer levels only
+# run when the coarser ones found nobody, so a far face next to a near one is missed
+DETECTION_SCALE = 0.5
+# Smallest face to find, in frame pixels; when set, it picks the finest detection scale
+MIN_FACE_SIZE = None
+
+# Processes running HOG detection and encoding; None uses all cores but one
+ANALYSIS_WORKERS = None
+
+# How unknown faces are hidden: "pixelate", "blur" or "fill"
+ANONYMIZE_MODE = "pixelate"
 
 # Main function to use webcam
 if __name__ == "__main__":
-    # Load known faces
-    known_faces_dir = "known_faces"
-    known_face_encodings, known_face_names = load_known_faces(known_faces_dir)
-
-    # Initialize video capture thread
-    print("Initializing Camera...")
-    video_capture = VideoCaptureThread(src=0, width=720, height=720, queue_size=2)
-    video_capture.start()
-    print("Started Video Thread...")
-
-    process_every_n_frames = 2
+    startup_timer = StartupTimer()
+    startup_timer.mark("imports")
+
+    # The camera comes up first, so frames are shown while the rest loads
+    with startup_timer.phase("camera"):
+        print("Initializing Camera...")
+        video_capture = VideoCaptureThread(src=0, width=720, height=720)
+        video_capture.start()
+        print("Started Video Thread...")
+
+    # Tiny, blurred, badly lit or profile faces are not encoded; their tracks retry on later frames
+    # The workers load their models in the background once the first frame is submitted
+    analysis = AnalysisPool(workers=ANALYSIS_WORKERS, detector="hog", scale=DETECTION_SCALE,
+                            min_face_size=MIN_FACE_SIZE, quality=QualityGate())
+    # Analyze frames at up to 15 fps, less when the scene is idle or analysis falls behind
+    scheduler = FrameScheduler(target_fps=15.0, workers=analysis.workers)
     frame_count = 0
 
+    # Load known faces from the warm-start snapshot; changes to known_faces/ are picked
+    # up in the background and swapped in between frames
+    known_faces_dir = "known_faces"
+    with startup_timer.phase("gallery"):
+        watcher = GalleryWatcher(known_faces_dir)
+        matcher = watcher.load()
+        matcher_generation = watcher.generation
+        watcher.start()
+
     # Initialize variables for multi-threading
     face_locations = []
-    face_encodings = []
     face_names = []
+    tracker = FaceTracker()
+    anonymizer = Anonymizer(ANONYMIZE_MODE)
     last_logged_time = {}
     log_interval = timedelta(seconds=60)  # 1 minuto
    
 
-    camera_id = "entrada"  # Altere para "saida" no script da câmera de saída
-    tipo_evento = "entrada"  # Altere para "saida" no script da câmera de saída
-    db_utils.connect_and_init()
+    # Para várias câmeras (ex. entrada e saída) use cameras.py com um cameras.json
+    camera_id = "entrada"
+    tipo_evento = "entrada"
+    # Tables are checked in the background; events wait in the writer's queue meanwhile
+    db_utils.connect_and_init(background=True)
+
+    # Per-stage histograms and counters on http://127.0.0.1:9108/metrics (FACE_METRICS=0 turns them off)
+    metrics.configure(camera=camera_id)
+    metrics.register("capture", video_capture.stats)
+    metrics.register("scheduler", scheduler.metrics)
+    metrics.register("analysis", analysis.stats)
+    metrics.register("anonymizer", anonymizer.stats)
+    metrics.register("db_writer", db_utils.writer_stats)
+    metrics.register("startup", startup_timer.stats)
 
     while True:
         if video_capture.more():
             frame = video_capture.read()
             frame_count += 1
 
-            # Only process every n-th frame to save time
-            if frame_count % process_every_n_frames == 0:
-                # Resize frame to 1/2 size for faster processing
-                small_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-
-                # Convert the image from BGR (OpenCV) to RGB (face_recognition)
-                rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-
-                # Detect all faces and their encodings in the current frame
-                face_locations = face_recognition.face_locations(rgb_small_frame, model='hog')
-                face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-
-                face_names = []
-                for face_encoding in face_encodings:
-                    # Compare the detected face with known faces
-                    distances = np.linalg.norm(known_face_encodings - face_encoding, axis=1)
-                    best_match_index = np.argmin(distances)
-
-                    name = "Unknown"
-                    confidence = 1.0  # Default confidence for unknown faces
-
-                    if distances[best_match_index] <= 0.6:  # 0.6 is a common threshold
-                        name = known_face_names[best_match_index]
-                        confidence = (1 - distances[best_match_index]) * 100  # Convert to percentage
-
-                    face_names.append((name, confidence))
-
-            # Display the results
-            for (top, right, bottom, left), (name, confidence) in zip(face_locations, face_names):
-                # Scale back up face locations since the frame we detected in was scaled to 1/2 size
-                top *= 2
-                right *= 2
-                bottom *= 2
-                left *= 2
-
-                # Draw a box around the face
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-
-                # Draw the label with the name and confidence score
-                label = f"{name} ({confidence:.0f}%)"
-                if confidence > 75:
-                    cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
-                    # cv2.putText(frame, "High Confidence", (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
-                else:
-                    cv2.putText(frame, "Unknown", (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
-                    # cv2.putText(frame, "Low Confidence", (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
-                
-
-                if name == "Unknown" or confidence <= 75:
-                        # Extract the region of interest (the face) from the frame
-                        face_region = frame[top:bottom, left:right]
-                        # Apply a Gaussian blur to the face region
-                        blurred_face = cv2.GaussianBlur(face_region, (99, 99), 30)
-                        # Replace the original face region with the blurred version
-                        frame[top:bottom, left:right] = blurred_face
-
-                if name != "Unknown" and confidence > 75:
-                    now = datetime.now()
-                    last_time = last_logged_time.get(name)
-                    if not last_time or (now - last_time) > log_interval:
-                        db_utils.insert_evento(name, confidence, tipo_evento, camera_id)
-                        last_logged_time[name] = now
-                
-                    
+            # Switch to a reloaded gallery; tracks are matched again against it
+            if watcher.generation != matcher_generation:
+                matcher, matcher_generation = watcher.snapshot()
+                tracker.invalidate()
+
+            # Hand the frames the scheduler picks to the analysis workers
+            if scheduler.should_process(frame, active_tracks=len(tracker.tracks)):
+                with scheduler.stage("submit"):
+                    analysis.submit(frame, frame_count, hints=tracker.encoding_hints(frame_count))
+
+            # Detections and encodings come back in frame order; only new or
+            # uncertain tracks are matched, the rest keep their identity
+            for result in analysis.results():
+                scheduler.record_analysis(result.timings, result.cpu_seconds)
+                with scheduler.stage("identify"):
+                    face_locations = result.face_locations
+                    face_names = tracker.identify(face_locations, result.frame_index, result.encodings_for, matcher)
+                startup_timer.mark("first_analysis")
+                if any(name != "Unknown" for name, _ in face_names):
+                    startup_timer.mark("first_recognition")
+
+            with metrics.stage("render"):
+                # Hide unknown and uncertain faces, all in one pass, before the boxes and labels are drawn
+                anonymizer.apply(frame, [box for box, (name, confidence) in zip(face_locations, face_names)
+                                         if name == "Unknown" or confidence <= 75])
+
+                # Display the results
+                for (top, right, bottom, left), (name, confidence) in zip(face_locations, face_names):
+                    # Draw a box around the face
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+
+                    # Draw the label with the name and confidence score
+                    label = f"{name} ({confidence:.0f}%)"
+                    if confidence > 75:
+                        cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
+                        # cv2.putText(frame, "High Confidence", (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
+                    else:
+                        cv2.putText(frame, "Unknown", (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
+                        # cv2.putText(frame, "Low Confidence", (left, bottom + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2)
+
+                    if name != "Unknown" and confidence > 75:
+                        now = datetime.now()
+                        last_time = last_logged_time.get(name)
+                        if not last_time or (now - last_time) > log_interval:
+                            db_utils.insert_evento(name, confidence, tipo_evento, camera_id)
+                            last_logged_time[name] = now
 
             # Display the resulting frame
             cv2.imshow("Video", frame)
+            startup_timer.mark("first_frame")
 
             # Break the loop on 'q' key press or reload faces on 'r' key press
             key = cv2.waitKey(1) & 0xFF
             if key == ord("q"):
                 break
             elif key == ord("r"):
+                # Rescan now instead of waiting for the next periodic check; does not block
                 print("Recarregando faces conhecidas...")
-                known_face_encodings, known_face_names = load_known_faces(known_faces_dir)
-                print("Faces conhecidas recarregadas!")
+                watcher.request_reload()
+        elif video_capture.stopped:
+            # The camera is gone (unplugged, end of a file): more() would return at once from now on
+            print("Camera stopped delivering frames")
+            break
 
     # Stop the video capture thread and close windows
     video_capture.stop()
     video_capture.join()
+    watcher.stop()
+    analysis.close()
     cv2.destroyAllWindows()
     db_utils.close_connection()
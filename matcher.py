@@ -0,0 +1,180 @@
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.6  # 0.6 is a common threshold for dlib encodings
+
+
+def squared_norms(vectors):
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+
+def pairwise_distances(queries, vectors, sq_norms=None):
+    """Return the (M, N) float32 Euclidean distances via ||a||^2 + ||b||^2 - 2ab."""
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, 128)
+    if sq_norms is None:
+        sq_norms = squared_norms(vectors)
+    sq = queries @ vectors.T
+    sq *= -2.0
+    sq += squared_norms(queries)[:, None]
+    sq += sq_norms[None, :]
+    # Rounding can push exact matches slightly below zero
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def top_k_smallest(distances, k):
+    """Return (columns, values) of the k smallest entries per row, sorted ascending."""
+    m, n = distances.shape
+    k = min(k, n)
+    if k == 0:
+        return np.empty((m, 0), dtype=np.int64), np.empty((m, 0), dtype=np.float32)
+    if k < n:
+        columns = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(n), (m, n)).copy()
+    values = np.take_along_axis(distances, columns, axis=1)
+    order = np.argsort(values, axis=1)
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+class FaceMatcher:
+    """
+    Scores a batch of face encodings against the whole gallery in one float32 pass.
+
+    Distances use ||a||^2 + ||b||^2 - 2ab with the gallery norms computed once, so a
+    frame with M faces costs a single (M, 128) x (128, N) product instead of M
+    (N, 128) temporaries. When an index from face_index.py is given, candidates come
+    from index.search() instead of a full scan.
+
+    Rows sharing a name are one person. With aggregate="best" a person scores the
+    distance of their closest stored encoding; with aggregate="centroid" only one
+    mean encoding per person is kept and scanned, so cost follows people, not photos.
+    """
+
+    def __init__(self, encodings, names, threshold=DEFAULT_THRESHOLD, index=None, aggregate="best"):
+        if aggregate not in ("best", "centroid"):
+            raise ValueError(f"Unknown aggregate {aggregate!r}; use 'best' or 'centroid'")
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, 128)
+        self.names = list(names)
+        self.threshold = threshold
+        self.aggregate = aggregate
+        # Centroids are few enough that an index would not help
+        self.index = index if aggregate == "best" else None
+
+        # self.labels[i] is person i; self.row_labels maps gallery rows to people
+        if self.names:
+            self.labels, self.row_labels = np.unique(np.asarray(self.names, dtype=object), return_inverse=True)
+            self.labels = list(self.labels)
+        else:
+            self.labels, self.row_labels = [], np.empty(0, dtype=np.int64)
+        order = np.argsort(self.row_labels, kind='stable')
+        counts = np.bincount(self.row_labels, minlength=len(self.labels))
+        self.max_rows_per_label = int(counts.max()) if len(counts) else 0
+        self._starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+        if aggregate == "centroid":
+            sums = np.add.reduceat(encodings[order], self._starts, axis=0) if len(order) else encodings
+            self.encodings = np.ascontiguousarray(sums / np.maximum(counts, 1)[:, None], dtype=np.float32)
+        elif self.index is None:
+            # Group rows by person so the per-person minimum is a single reduceat;
+            # rows that already come grouped (a shared snapshot) are used in place
+            grouped = not np.any(order[1:] < order[:-1])
+            self.encodings = encodings[order] if self.max_rows_per_label > 1 and not grouped else encodings
+            if self.max_rows_per_label <= 1:
+                self._starts = None
+                self._column_labels = self.row_labels
+        else:
+            self.encodings = encodings
+        self.sq_norms = squared_norms(self.encodings) if self.index is None else None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distances(self, face_encodings):
+        """Return the (M, P) float32 distance from every face to every person."""
+        if self.sq_norms is None:
+            self.sq_norms = squared_norms(self.encodings)
+        distances = pairwise_distances(face_encodings, self.encodings, self.sq_norms)
+        if self.aggregate == "centroid":
+            return distances
+        if self._starts is None:
+            # One encoding per person: columns only need reordering into label order
+            person_distances = np.empty_like(distances)
+            person_distances[:, self._column_labels] = distances
+            return person_distances
+        return np.minimum.reduceat(distances, self._starts, axis=1)
+
+    def top_k(self, face_encodings, k=1):
+        """
+        Return (person indices, distances), both (M, k) and sorted by distance.
+
+        Indices refer to self.labels and are padded with -1 / inf when fewer than k
+        people were found for a face.
+        """
+        if self.index is None:
+            indices, distances = top_k_smallest(self.distances(face_encodings), k)
+            if indices.shape[1] < k:
+                pad = k - indices.shape[1]
+                indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+                distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            return indices, distances
+
+        # Fetch enough rows that k distinct people are guaranteed among them
+        rows, row_distances = self.index.search(face_encodings, k * max(self.max_rows_per_label, 1))
+        indices = np.full((len(rows), k), -1, dtype=np.int64)
+        distances = np.full((len(rows), k), np.inf, dtype=np.float32)
+        for q in range(len(rows)):
+            seen = 0
+            for row, distance in zip(rows[q], row_distances[q]):
+                if row < 0:
+                    break
+                label = self.row_labels[row]
+                if label in indices[q, :seen]:
+                    continue
+                indices[q, seen] = label
+                distances[q, seen] = distance
+                seen += 1
+                if seen == k:
+                    break
+        return indices, distances
+
+    def match(self, face_encodings, k=1):
+        """
+        Return, for every face, a list of up to k (name, distance, confidence) candidates.
+
+        Candidates beyond the threshold are still returned so callers can inspect them;
+        use best_matches() for the thresholded (name, confidence) used by the scripts.
+        """
+        indices, distances = self.top_k(face_encodings, k)
+        return [
+            [(self.labels[i], float(d), (1 - float(d)) * 100) for i, d in zip(row_i, row_d) if i >= 0]
+            for row_i, row_d in zip(indices, distances)
+        ]
+
+    def best_matches(self, face_encodings, unknown_confidence=1.0):
+        """Return one (name, confidence) per face; faces over the threshold are "Unknown"."""
+        face_names = []
+        if len(face_encodings) == 0:
+            return face_names
+        if len(self.labels) == 0:
+            return [("Unknown", unknown_confidence) for _ in range(len(face_encodings))]
+        indices, distances = self.top_k(face_encodings, 1)
+        for index, distance in zip(indices[:, 0], distances[:, 0]):
+            if index >= 0 and distance <= self.threshold:
+                face_names.append((self.labels[index], (1 - float(distance)) * 100))
+            else:
+                face_names.append(("Unknown", unknown_confidence))
+        return face_names
+
+    def best_matches_batch(self, frames_encodings, unknown_confidence=1.0):
+        """Match a micro-batch of frames at once; returns one best_matches() list per frame."""
+        counts = [len(encodings) for encodings in frames_encodings]
+        non_empty = [np.asarray(e, dtype=np.float32).reshape(-1, 128) for e in frames_encodings if len(e)]
+        if not non_empty:
+            return [[] for _ in counts]
+        flat = self.best_matches(np.concatenate(non_empty), unknown_confidence)
+        per_frame = []
+        start = 0
+        for count in counts:
+            per_frame.append(flat[start:start + count])
+            start += count
+        return per_frame
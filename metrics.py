@@ -0,0 +1,283 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "face_"
+
+# Latency buckets in seconds, from 0.1 ms to 10 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075,
+           0.1, 0.15, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_PORT = 9108
+
+# Off switch: with FACE_METRICS=0 every call below returns at once
+ENABLED = os.getenv("FACE_METRICS", "1") != "0"
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_collectors = {}
+_labels = {}
+_server = None
+_dumper = None
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: observe() is one bisect and two additions."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+def _histogram(name, stage):
+    key = (name, stage)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+
+def stage(name):
+    """Context manager timing one hot-path stage into the stage_seconds histogram."""
+    if not ENABLED:
+        return _NULL
+    return _Timer(_histogram("stage_seconds", name))
+
+
+def observe(stage_name, seconds, name="stage_seconds"):
+    """Record a duration measured elsewhere (e.g. in an analysis worker)."""
+    if not ENABLED or seconds is None:
+        return
+    _histogram(name, stage_name).observe(seconds)
+
+
+def inc(name, amount=1, **labels):
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register(name, collect):
+    """
+    Export the numbers returned by collect() as gauges named <name>_<key>.
+
+    collect() is only called when metrics are read, so components keep their own
+    counters (VideoCaptureThread.stats(), FrameScheduler.metrics(), ...) and pay
+    nothing per frame. Nested dicts become one labelled series per entry.
+    """
+    if ENABLED:
+        _collectors[name] = collect
+
+
+def configure(enabled=None, port=None, json_path=None, json_every=None, **labels):
+    """
+    Turn metrics on or off and start the exporters.
+
+    Defaults come from the environment: FACE_METRICS=0 disables everything,
+    FACE_METRICS_PORT (9108 by default, 0 for none) serves /metrics (Prometheus text)
+    and /metrics.json on localhost, FACE_METRICS_JSON names a file rewritten every
+    FACE_METRICS_JSON_EVERY seconds. labels (e.g. camera="entrada") go on every series.
+    """
+    global ENABLED
+    if enabled is not None:
+        ENABLED = enabled
+    if not ENABLED:
+        return
+    _labels.update(labels)
+    if port is None:
+        port = int(os.getenv("FACE_METRICS_PORT", DEFAULT_PORT))
+    if json_path is None:
+        json_path = os.getenv("FACE_METRICS_JSON") or None
+    if json_every is None:
+        json_every = float(os.getenv("FACE_METRICS_JSON_EVERY", "30"))
+    if port:
+        serve(port)
+    if json_path:
+        dump_every(json_path, json_every)
+
+
+def _format_labels(labels):
+    labels = {**_labels, **labels}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def _flatten(prefix, values, labels, out):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_value, (int, float)):
+                    out.append((f"{prefix}_{key}", {**labels, "key": sub_key}, sub_value))
+        elif isinstance(value, bool):
+            out.append((f"{prefix}_{key}", labels, int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((f"{prefix}_{key}", labels, value))
+
+
+def _gauges():
+    out = []
+    for name, collect in list(_collectors.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"Metrics collector {name} failed: {e}")
+            continue
+        if values:
+            _flatten(PREFIX + name, values, {}, out)
+    return out
+
+
+def prometheus_text():
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+    for name in sorted({name for (name, _), _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (hist_name, stage_name), histogram in histograms:
+            if hist_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels({'stage': stage_name, 'le': bound})} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels({'stage': stage_name, 'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels({'stage': stage_name})} {histogram.sum}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels({'stage': stage_name})} {histogram.count}")
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for (counter_name, labels), value in counters:
+            if counter_name == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(dict(labels))} {value}")
+    for name, labels, value in _gauges():
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """All metrics as a JSON-friendly dict, with p50/p95/p99 estimated from the buckets."""
+    with _lock:
+        histograms = list(_histograms.items())
+        counters = list(_counters.items())
+    return {
+        "time": time.time(),
+        "labels": dict(_labels),
+        "stages": {
+            f"{name}:{stage_name}": {
+                "count": histogram.count,
+                "mean_ms": histogram.sum / histogram.count * 1e3 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.5) * 1e3,
+                "p95_ms": histogram.quantile(0.95) * 1e3,
+                "p99_ms": histogram.quantile(0.99) * 1e3,
+            }
+            for (name, stage_name), histogram in histograms
+        },
+        "counters": {name + _format_labels(dict(labels)): value for (name, labels), value in counters},
+        "gauges": {name + _format_labels(labels): value for name, labels, value in _gauges()},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = prometheus_text().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot(), indent=2).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=DEFAULT_PORT, host="127.0.0.1"):
+    """Serve /metrics and /metrics.json from a daemon thread."""
+    global _server
+    if _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name="MetricsServer", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return _server
+
+
+def dump_every(path, seconds=30.0):
+    """Rewrite path with snapshot() every seconds, from a daemon thread."""
+    global _dumper
+    if _dumper is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(seconds)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot(), f, indent=2)
+            os.replace(tmp_path, path)
+
+    _dumper = threading.Thread(target=run, name="MetricsDump", daemon=True)
+    _dumper.start()
+
+
+def shutdown():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
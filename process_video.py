@@ -0,0 +1,372 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import cv2
+
+import gallery
+from analysis_pool import AnalysisPool
+from anonymize import MODES, Anonymizer
+from face_quality import QualityGate
+from matcher import FaceMatcher
+from tracker import FaceTracker
+from video_capture import open_capture
+
+DETECTION_FIELDS = ["source", "frame", "seconds", "timestamp", "name", "confidence", "top", "right", "bottom", "left"]
+EVENT_FIELDS = ["source", "frame", "seconds", "timestamp", "nome", "confianca", "tipo_evento", "camera_id"]
+
+
+class ImageSequence:
+    """A directory of images read like a video: one image per frame at a fixed fps."""
+
+    def __init__(self, directory, fps=1.0):
+        self.paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(gallery.IMAGE_EXTENSIONS))
+        self.fps = fps
+        self.position = -1
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.paths)
+        return 0.0
+
+    def grab(self):
+        self.position += 1
+        return self.position < len(self.paths)
+
+    def retrieve(self):
+        frame = cv2.imread(self.paths[self.position])
+        return frame is not None, frame
+
+    def release(self):
+        self.paths = []
+
+
+class RecordWriter:
+    """Appends records to a .jsonl or .csv file, picked by the extension of path."""
+
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.csv = None
+        if path.lower().endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, fieldnames=fields)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv:
+            self.csv.writerow(record)
+        else:
+            self.file.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class AnonymizedOutput:
+    """
+    Writes a copy of a source with the faces anonymized, so footage can leave the machine.
+
+    Each frame is anonymized with the faces of the last analyzed frame at or before it, so
+    frames are held back until that frame's analysis comes in; every frame is therefore
+    decoded, not only the analyzed ones. Boxes arrive in frame coordinates. Without
+    anonymize_all only unknown or uncertain faces are hidden, as in the live preview.
+    """
+
+    def __init__(self, path, fps, anonymizer, min_confidence, anonymize_all=False):
+        self.path = path
+        self.fps = fps
+        self.anonymizer = anonymizer
+        self.min_confidence = min_confidence
+        self.anonymize_all = anonymize_all
+        self.writer = None
+        self.size = None
+        self.frames = deque()  # (frame_index, frame) waiting for their boxes
+        self.boxes = []
+
+    def add(self, frame_index, frame):
+        self.frames.append((frame_index, frame))
+
+    def update(self, frame_index, face_locations, face_names):
+        """The analysis of frame_index is in: write the frames before it, then use its faces."""
+        self._write_until(frame_index)
+        self.boxes = [
+            location for location, (name, confidence) in zip(face_locations, face_names)
+            if self.anonymize_all or name == "Unknown" or confidence <= self.min_confidence]
+
+    def _write_until(self, frame_index=None):
+        while self.frames and (frame_index is None or self.frames[0][0] < frame_index):
+            _, frame = self.frames.popleft()
+            if self.writer is None:
+                self.size = (frame.shape[1], frame.shape[0])
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, self.size)
+            self.anonymizer.apply(frame, self.boxes)
+            if (frame.shape[1], frame.shape[0]) != self.size:
+                # Image directories may mix sizes; a video cannot
+                frame = cv2.resize(frame, self.size)
+            self.writer.write(frame)
+
+    def close(self):
+        self._write_until()
+        if self.writer is not None:
+            self.writer.release()
+
+
+def open_source(path, image_fps):
+    if os.path.isdir(path):
+        return ImageSequence(path, fps=image_fps)
+    return open_capture(path)
+
+
+class OfflineProcessor:
+    """
+    Runs recorded footage through detection, encoding and matching as fast as the
+    machine allows: no display, no frame pacing.
+
+    Frames that are not analyzed (sample_fps of video time are) are only grab()bed, so
+    they are never converted to images. Analysis runs on an AnalysisPool and the decoder
+    waits for a free slot instead of dropping frames, so every sampled frame is analyzed.
+    """
+
+    def __init__(self, matcher, sample_fps=5.0, workers=None, detector="hog", scale=0.5,
+                 min_face_size=None, min_confidence=75.0, log_interval=60.0, tipo_evento="entrada",
+                 camera_id="offline", start_time=None, detections=None, events=None, use_db=False,
+                 quality=None, anonymized_dir=None, anonymizer=None, anonymize_all=False):
+        self.matcher = matcher
+        self.sample_fps = sample_fps
+        self.scale = scale
+        self.min_face_size = min_face_size
+        self.min_confidence = min_confidence
+        self.log_interval = log_interval
+        self.tipo_evento = tipo_evento
+        self.camera_id = camera_id
+        self.start_time = start_time
+        self.detections = detections
+        self.events = events
+        self.use_db = use_db
+        self.workers = workers
+        self.detector = detector
+        self.quality = quality
+        self.anonymized_dir = anonymized_dir
+        self.anonymizer = anonymizer or Anonymizer()
+        self.anonymize_all = anonymize_all
+        self.analysis = None
+
+        self.frames_decoded = 0
+        self.frames_analyzed = 0
+        self.faces = 0
+        self.events_logged = 0
+        self.video_seconds = 0.0
+
+    def _pool(self, frame, context):
+        # Slots are sized by the first frame; a larger image restarts the pool with bigger ones
+        if self.analysis is not None and self.analysis.memory is not None \
+                and frame.nbytes > self.analysis.slot_bytes:
+            self._finish(context)
+            self.analysis.close()
+            self.analysis = None
+        if self.analysis is None:
+            self.analysis = AnalysisPool(workers=self.workers, detector=self.detector, scale=self.scale,
+                                         min_face_size=self.min_face_size, quality=self.quality)
+        return self.analysis
+
+    def _timestamp(self, seconds):
+        return self.start_time + timedelta(seconds=seconds) if self.start_time else None
+
+    def _output(self, path, fps):
+        if not self.anonymized_dir:
+            return None
+        os.makedirs(self.anonymized_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0] + ".mp4"
+        return AnonymizedOutput(os.path.join(self.anonymized_dir, name), fps, self.anonymizer,
+                                self.min_confidence, self.anonymize_all)
+
+    def _handle(self, result, context):
+        source, fps, tracker, last_logged, output = context
+        face_names = (tracker or FaceTracker()).identify(
+            result.face_locations, result.frame_index, result.encodings_for, self.matcher)
+        if output:
+            output.update(result.frame_index, result.face_locations, face_names)
+        seconds = result.frame_index / fps
+        timestamp = self._timestamp(seconds)
+        self.frames_analyzed += 1
+        self.faces += len(face_names)
+        for (top, right, bottom, left), (name, confidence) in zip(result.face_locations, face_names):
+            if self.detections:
+                self.detections.write({
+                    "source": source, "frame": result.frame_index, "seconds": round(seconds, 3),
+                    "timestamp": timestamp, "name": name, "confidence": round(confidence, 1),
+                    "top": top, "right": right, "bottom": bottom, "left": left})
+            if name == "Unknown" or confidence <= self.min_confidence:
+                continue
+            last = last_logged.get(name)
+            if last is not None and seconds - last <= self.log_interval:
+                continue
+            last_logged[name] = seconds
+            self.events_logged += 1
+            if self.events:
+                self.events.write({
+                    "source": source, "frame": result.frame_index, "seconds": round(seconds, 3),
+                    "timestamp": timestamp, "nome": name, "confianca": round(confidence, 1),
+                    "tipo_evento": self.tipo_evento, "camera_id": self.camera_id})
+            if self.use_db:
+                import db_utils
+                db_utils.insert_evento(name, confidence, self.tipo_evento, self.camera_id,
+                                       data_hora=timestamp or datetime.now())
+
+    def _finish(self, context):
+        if self.analysis is not None:
+            for result in self.analysis.drain(timeout=600.0):
+                self._handle(result, context)
+
+    def process(self, path, image_fps=1.0, progress_every=5.0):
+        capture = open_source(path, image_fps)
+        if not capture.isOpened():
+            raise IOError(f"Could not open {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        step = fps / self.sample_fps if self.sample_fps else 1.0
+        output = self._output(path, fps)
+        # The images of a directory are unrelated photos: each one gets a tracker of its own,
+        # so a face in a similar place never inherits the previous image's identity
+        tracker = None if isinstance(capture, ImageSequence) else FaceTracker()
+        context = (path, fps, tracker, {}, output)
+        started = time.perf_counter()
+        last_progress = started
+        frame_index = -1
+        next_sample = 0.0
+        try:
+            while capture.grab():
+                frame_index += 1
+                self.frames_decoded += 1
+                if frame_index < next_sample and not output:
+                    # Skipped frames are demuxed/decoded by grab() but never retrieved
+                    continue
+                ret, frame = capture.retrieve()
+                if not ret:
+                    continue
+                if output:
+                    output.add(frame_index, frame)
+                    if frame_index < next_sample:
+                        continue
+                next_sample += step
+                analysis = self._pool(frame, context)
+                hints = tracker.encoding_hints(frame_index) if tracker else None
+                while not analysis.submit(frame, frame_index, hints=hints):
+                    for result in analysis.results(timeout=0.05):
+                        self._handle(result, context)
+                for result in analysis.results():
+                    self._handle(result, context)
+
+                now = time.perf_counter()
+                if progress_every and now - last_progress >= progress_every:
+                    last_progress = now
+                    elapsed = now - started
+                    video_seconds = frame_index / fps
+                    print(f"\r{path}: {video_seconds:.0f}s of video in {elapsed:.0f}s "
+                          f"({frame_index / elapsed:.0f} fps, {video_seconds / elapsed:.1f}x real time)",
+                          end="", flush=True)
+            self._finish(context)
+        finally:
+            capture.release()
+            if output:
+                output.close()
+        elapsed = time.perf_counter() - started
+        video_seconds = (frame_index + 1) / fps
+        self.video_seconds += video_seconds
+        print(f"\r{path}: {frame_index + 1} frames ({video_seconds:.0f}s of video) in {elapsed:.1f}s, "
+              f"{(frame_index + 1) / max(elapsed, 1e-9):.0f} fps, {video_seconds / max(elapsed, 1e-9):.1f}x real time")
+        if output:
+            print(f"Anonymized copy written to {output.path}")
+
+    def close(self):
+        if self.analysis is not None:
+            self.analysis.close()
+            self.analysis = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Recognize faces in recorded videos or image directories, without a display.")
+    parser.add_argument("sources", nargs="+", help="video files and/or directories of images")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--fps", type=float, default=5.0,
+                        help="frames analyzed per second of video (0 = every frame)")
+    parser.add_argument("--image-fps", type=float, default=1.0,
+                        help="frame rate assumed for image directories")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="analysis processes (default: all cores but one)")
+    parser.add_argument("--detector", choices=("hog", "cnn", "mediapipe"), default="hog")
+    parser.add_argument("--scale", type=float, nargs="+", default=[0.5],
+                        help="frame scale for detection; several are a coarse-to-fine pyramid (lossy: "
+                             "finer scales only run on frames where the coarser ones found no face)")
+    parser.add_argument("--min-face-size", type=int,
+                        help="smallest face to find, in frame pixels (picks the finest detection scale)")
+    parser.add_argument("--detections", help="write every detected face to this .jsonl or .csv file")
+    parser.add_argument("--events", help="write entrada/saida events to this .jsonl or .csv file")
+    parser.add_argument("--db", action="store_true", help="also record the events in the database")
+    parser.add_argument("--tipo-evento", choices=("entrada", "saida"), default="entrada")
+    parser.add_argument("--camera-id", default="offline")
+    parser.add_argument("--start", type=datetime.fromisoformat,
+                        help="wall-clock time of the first frame (ISO 8601), for event timestamps")
+    parser.add_argument("--no-quality-gate", action="store_true",
+                        help="encode every detected face, even tiny, blurred or profile ones")
+    parser.add_argument("--anonymized-dir",
+                        help="also write a copy of each source with faces anonymized to this directory")
+    parser.add_argument("--anonymize", choices=MODES, default="pixelate", help="how faces are hidden")
+    parser.add_argument("--anonymize-all", action="store_true",
+                        help="hide every face in the copies, not only unknown or uncertain ones")
+    parser.add_argument("--log-interval", type=float, default=60.0,
+                        help="seconds of video between two events for the same person")
+    args = parser.parse_args(argv)
+
+    known_face_encodings, known_face_names = gallery.load_known_faces(args.known_faces)
+    detections = RecordWriter(args.detections, DETECTION_FIELDS) if args.detections else None
+    events = RecordWriter(args.events, EVENT_FIELDS) if args.events else None
+    processor = OfflineProcessor(
+        FaceMatcher(known_face_encodings, known_face_names), sample_fps=args.fps, workers=args.workers,
+        detector=args.detector, scale=args.scale, min_face_size=args.min_face_size,
+        log_interval=args.log_interval, tipo_evento=args.tipo_evento, camera_id=args.camera_id,
+        start_time=args.start, detections=detections, events=events,
+        use_db=args.db, quality=None if args.no_quality_gate else QualityGate(),
+        anonymized_dir=args.anonymized_dir, anonymizer=Anonymizer(args.anonymize), anonymize_all=args.anonymize_all)
+    started = time.perf_counter()
+    try:
+        for source in args.sources:
+            processor.process(source, image_fps=args.image_fps)
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+    finally:
+        processor.close()
+        for writer in (detections, events):
+            if writer:
+                writer.close()
+        if args.db:
+            import db_utils
+            db_utils.close_connection()
+    elapsed = time.perf_counter() - started
+    print(f"Decoded {processor.frames_decoded} frames, analyzed {processor.frames_analyzed} "
+          f"({processor.faces} faces, {processor.events_logged} events) in {elapsed:.1f}s: "
+          f"{processor.frames_decoded / max(elapsed, 1e-9):.0f} fps, "
+          f"{processor.video_seconds / max(elapsed, 1e-9):.1f}x real time")
+    if args.anonymized_dir:
+        anonymizer = processor.anonymizer.stats()
+        print(f"Anonymized {anonymizer['faces']} faces in {anonymizer['frames']} frames "
+              f"({anonymizer['mode']}, {anonymizer['ms_per_frame']:.2f} ms per frame)")
+    if processor.quality is not None:
+        quality = processor.quality.stats()
+        print(f"Quality gate: {quality['encodings_saved']} of {quality['faces_checked']} encodings saved "
+              f"{quality['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
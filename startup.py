@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Taken when the first script module imports this one, before the heavy imports
+PROCESS_STARTED = time.perf_counter()
+
+
+class StartupTimer:
+    """
+    Times the startup of a camera loop, from process start to the first recognized face.
+
+    phase() times one step of the setup (gallery, camera, ...); mark() records, once,
+    how long after process start a milestone was reached: first_frame (the display is
+    up), first_analysis (the workers have loaded their models) and first_recognition
+    (a known face). Everything is printed as it happens and exported through
+    stats() and the startup_seconds histogram.
+    """
+
+    def __init__(self, label="", started=None):
+        self.prefix = f"[{label}] " if label else ""
+        # A forked camera worker inherits PROCESS_STARTED from its supervisor, so it passes its own
+        self.started = PROCESS_STARTED if started is None else started
+        self.phases = {}
+        self.marks = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.phases[name] = seconds
+            metrics.observe(name, seconds, name="startup_seconds")
+            print(f"{self.prefix}Startup: {name} took {seconds:.2f}s")
+
+    def mark(self, name):
+        """Record the first time name happens; later calls are free."""
+        if name in self.marks:
+            return
+        seconds = self.elapsed()
+        self.marks[name] = seconds
+        metrics.observe(name, seconds, name="startup_seconds")
+        print(f"{self.prefix}Startup: {name} {seconds:.2f}s after start")
+
+    def stats(self):
+        return {"phase_seconds": dict(self.phases), "seconds_to": dict(self.marks)}
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from anonymize import Anonymizer, clip_box
+
+
+def test_clip_box_pads_and_clips_to_the_frame():
+    shape = (100, 200, 3)
+    assert clip_box((10, 60, 50, 20), shape) == (10, 60, 50, 20)
+    assert clip_box((10, 60, 50, 20), shape, padding=0.25) == (0, 70, 60, 10)
+    assert clip_box((-20, 250, 120, 150), shape) == (0, 200, 100, 150)
+    assert clip_box((-40, 50, -10, 10), shape) is None
+    assert clip_box((10, 260, 50, 210), shape) is None
+
+
+@pytest.mark.parametrize("mode", ["pixelate", "blur", "fill"])
+def test_apply_only_changes_the_part_of_the_box_inside_the_frame(mode):
+    frame = np.random.default_rng(0).integers(0, 256, size=(100, 200, 3), dtype=np.uint8)
+    original = frame.copy()
+    anonymizer = Anonymizer(mode, padding=0.0, color=(0, 0, 255))
+
+    assert anonymizer.apply(frame, [(-30, 230, 40, 150), (200, 50, 260, 0)]) == 1
+    assert not np.array_equal(frame[0:40, 150:200], original[0:40, 150:200])
+    frame[0:40, 150:200] = original[0:40, 150:200]
+    np.testing.assert_array_equal(frame, original)
+    if mode == "fill":
+        assert anonymizer.stats()["faces"] == 1
+    with pytest.raises(ValueError):
+        Anonymizer("smudge")
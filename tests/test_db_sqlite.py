@@ -0,0 +1,157 @@
+import random
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_sqlite
+import db_utils
+
+T0 = datetime(2024, 5, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """db_utils on a fresh SQLite file, as with DB_BACKEND=sqlite."""
+    db_sqlite.fechar()
+    monkeypatch.setattr(db_utils, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(db_utils, "_initialized", False)
+    monkeypatch.setattr(db_sqlite, "SQLITE_PATH", str(tmp_path / "eventos.db"))
+    db_utils.connect_and_init()
+    yield tmp_path
+    db_sqlite.fechar()
+
+
+def _evento(nome, tipo_evento, minutos, camera_id="cam1"):
+    return (nome, tipo_evento, T0 + timedelta(minutes=minutos), 90.0, camera_id)
+
+
+def _gravar(eventos):
+    # What EventWriter does with a batch
+    with db_utils.cursor(commit=True) as cur:
+        cur.executemany(db_utils.INSERT_EVENTO_SQL, eventos)
+        db_utils.atualizar_sessoes(cur, eventos)
+
+
+def _sessoes(cur_factory=db_utils.cursor):
+    with cur_factory() as cur:
+        cur.execute("SELECT nome, hora_entrada, hora_saida, tempo_minutos FROM sessoes_permanencia "
+                    "ORDER BY nome, hora_entrada")
+        return cur.fetchall()
+
+
+EVENTOS = [
+    _evento("Joe", "entrada", 0),
+    _evento("Joe", "saida", 30, "cam2"),
+    _evento("Joe", "entrada", 60),
+    _evento("Joe", "saida", 75, "cam2"),
+    _evento("Joe", "entrada", 120),
+    _evento("Steve", "entrada", 10),
+    _evento("Steve", "saida", 100, "cam2"),
+]
+
+
+def test_sessions_pair_each_entrada_with_the_next_saida(sqlite_db):
+    _gravar(EVENTOS)
+
+    assert db_utils.calcular_tempos_permanencia() == [
+        ("Joe", T0, T0 + timedelta(minutes=30), 30),
+        ("Joe", T0 + timedelta(minutes=60), T0 + timedelta(minutes=75), 15),
+        ("Steve", T0 + timedelta(minutes=10), T0 + timedelta(minutes=100), 90),
+    ]
+    assert db_utils.calcular_tempos_permanencia(nome="Steve") == [
+        ("Steve", T0 + timedelta(minutes=10), T0 + timedelta(minutes=100), 90)]
+    assert list(db_utils.iterar_tempos_permanencia(tamanho_pagina=1)) == db_utils.calcular_tempos_permanencia()
+
+
+def test_sessions_do_not_depend_on_arrival_order(sqlite_db):
+    _gravar(EVENTOS)
+    esperado = _sessoes()
+
+    for semente in range(5):
+        with db_utils.cursor(commit=True) as cur:
+            cur.execute("DELETE FROM eventos")
+            cur.execute("DELETE FROM sessoes_permanencia")
+        eventos = EVENTOS[:]
+        random.Random(semente).shuffle(eventos)
+        for inicio in range(0, len(eventos), 2):
+            _gravar(eventos[inicio:inicio + 2])
+        assert _sessoes() == esperado
+
+    db_utils.reconstruir_sessoes()
+    assert _sessoes() == esperado
+
+
+def test_reports(sqlite_db):
+    _gravar(EVENTOS + [_evento("Ann", "entrada", 70)])
+
+    assert list(db_utils.contagem_por_camera()) == [
+        ("cam1", "entrada", 5), ("cam2", "saida", 3)]
+    assert list(db_utils.contagem_por_hora()) == [
+        (T0, "cam1", "entrada", 2), (T0, "cam2", "saida", 1),
+        (T0 + timedelta(hours=1), "cam1", "entrada", 2), (T0 + timedelta(hours=1), "cam2", "saida", 2),
+        (T0 + timedelta(hours=2), "cam1", "entrada", 1),
+    ]
+    # Each window is aggregated on its own: 9:00-9:30 and 9:30-10:00 are two rows
+    assert list(db_utils.contagem_por_hora(camera_id="cam2", janela=timedelta(minutes=30))) == [
+        (T0, "cam2", "saida", 1), (T0 + timedelta(hours=1), "cam2", "saida", 1),
+        (T0 + timedelta(hours=1), "cam2", "saida", 1)]
+    assert list(db_utils.ocupacao_atual(tamanho_pagina=1)) == [
+        ("Ann", T0 + timedelta(minutes=70)), ("Joe", T0 + timedelta(minutes=120))]
+    assert list(db_utils.primeira_ultima_aparicao(fim=T0 + timedelta(minutes=100))) == [
+        ("Ann", T0 + timedelta(minutes=70), T0 + timedelta(minutes=70), 1),
+        ("Joe", T0, T0 + timedelta(minutes=75), 4),
+        ("Steve", T0 + timedelta(minutes=10), T0 + timedelta(minutes=10), 1),
+    ]
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    """The spool on one SQLite file and, standing in for MySQL, the same schema on another."""
+    db_sqlite.fechar()
+    monkeypatch.setattr(db_utils, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(db_sqlite, "SQLITE_PATH", str(tmp_path / "mysql.db"))
+    db_sqlite.inicializar()
+    db_sqlite.fechar()
+    monkeypatch.setattr(db_sqlite, "SQLITE_PATH", str(tmp_path / "spool.db"))
+
+    @contextmanager
+    def cursor(commit=False):
+        conn = sqlite3.connect(str(tmp_path / "mysql.db"), detect_types=sqlite3.PARSE_DECLTYPES)
+        cur = db_sqlite._Cursor(conn.cursor())
+        try:
+            yield cur
+            if commit:
+                conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+    monkeypatch.setattr(db_utils, "cursor", cursor)
+    yield cursor
+    db_sqlite.fechar()
+
+
+def test_spool_forwarding_skips_uids_already_forwarded(spool):
+    db_sqlite.enfileirar(EVENTOS[:4])
+    db_sqlite.enfileirar(EVENTOS[4:])
+    encaminhador = db_utils.Encaminhador(batch_size=4)
+
+    assert encaminhador.encaminhar_lote() == 4
+    assert encaminhador.encaminhar_lote() == 3
+    assert encaminhador.encaminhar_lote() == 0
+    assert encaminhador.forwarded == 7 and encaminhador.pending == 0
+    esperado = _sessoes(spool)
+    assert len(esperado) == 4
+
+    # A crash between the MySQL commit and marking the batch: everything is sent again
+    conn = db_sqlite.conectar()
+    with conn:
+        conn.execute("UPDATE eventos SET encaminhado = 0")
+    while encaminhador.encaminhar_lote():
+        pass
+    assert encaminhador.forwarded == 7 and encaminhador.duplicates == 7
+    with spool() as cur:
+        cur.execute("SELECT COUNT(*), COUNT(DISTINCT uid) FROM eventos")
+        assert cur.fetchone() == (7, 7)
+    assert _sessoes(spool) == esperado
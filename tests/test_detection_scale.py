@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from detection_scale import DetectionScales, scale_for_min_face, to_frame
+
+
+def test_to_frame_rounds_outwards_and_clips():
+    shape = (480, 640, 3)
+    assert to_frame((10, 40, 30, 20), 2.0, 2.0, shape) == (20, 80, 60, 40)
+    assert to_frame((10.4, 40.2, 30.2, 20.6), 2.0, 2.0, shape) == (20, 81, 61, 41)
+    assert to_frame((-5, 400, 300, -1), 2.0, 2.0, shape) == (0, 640, 480, 0)
+    assert to_frame((10, 40, 30, 20), 3.0, 1.5, shape) == (15, 120, 45, 60)
+
+
+def test_locate_maps_detections_back_to_frame_coordinates():
+    frame = np.zeros((481, 641, 3), dtype=np.uint8)
+    seen = []
+
+    def detect(rgb):
+        seen.append(rgb.shape)
+        return [(10, 40, 30, 20)], [[(20.0, 10.0)]]
+
+    timings = {}
+    locations, keypoints, passes = DetectionScales(0.5).locate(frame, detect, timings)
+    # The resized size is rounded, so the factors come from the shapes, not from 0.5
+    (height, width, _), = seen
+    sx, sy = 641 / width, 481 / height
+    assert locations == [to_frame((10, 40, 30, 20), sx, sy, frame.shape)]
+    assert locations[0][1] > 80
+    assert keypoints[0][0] == pytest.approx((20 * sx, 10 * sy))
+    assert passes == 1 and set(timings) == {"resize", "detect"}
+
+
+def test_pyramid_runs_finer_levels_only_when_coarser_ones_find_nothing():
+    frame = np.zeros((400, 400, 3), dtype=np.uint8)
+    widths = []
+
+    def detect(rgb):
+        widths.append(rgb.shape[1])
+        return ([(10, 20, 20, 10)] if rgb.shape[1] == 400 else []), None
+
+    locations, keypoints, passes = DetectionScales([1.0, 0.25, 0.5]).locate(frame, detect, {})
+    assert widths == [100, 200, 400]
+    assert locations == [(10, 20, 20, 10)] and keypoints is None and passes == 3
+
+    locations, _, passes = DetectionScales(0.25).locate(frame, lambda rgb: ([], None), {})
+    assert locations == [] and passes == 1
+
+
+def test_min_face_size_sets_the_finest_level():
+    assert scale_for_min_face(80, "hog") == 0.5
+    assert scale_for_min_face(20, "hog") == 1.0
+    assert DetectionScales(min_face_size=80).levels == [0.5]
+    assert DetectionScales([0.25, 0.5, 1.0], min_face_size=100, detector="hog").levels == [0.25, 0.4]
+    with pytest.raises(ValueError):
+        DetectionScales(1.5)
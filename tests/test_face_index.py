@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from face_index import GALLERY_INDEX, open_index
+from gallery import FaceGallery
+
+
+def _encoding(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+def _enroll(gallery, seeds, removed=()):
+    gallery.update([(f"person{seed}/a.jpg", {"sha1": str(seed), "mtime": 0, "size": 0}, _encoding(seed))
+                    for seed in seeds], removed)
+    gallery.save()
+
+
+def _nearest(index, gallery, seed):
+    rows, _ = index.search([_encoding(seed)], k=1)
+    return gallery.sources[rows[0, 0]]
+
+
+def test_open_index_syncs_enrolled_and_removed_rows(tmp_path, capsys):
+    gallery = FaceGallery(str(tmp_path))
+    _enroll(gallery, range(4))
+    index = open_index(gallery, "brute")
+    assert os.path.exists(tmp_path / GALLERY_INDEX)
+    assert "Built brute index over 4 encodings" in capsys.readouterr().out
+
+    _enroll(gallery, [4], removed=["person1/a.jpg"])
+    index = open_index(gallery, "brute")
+    assert "Updated brute index (4 encodings)" in capsys.readouterr().out
+    assert index.generation == gallery.generation
+    assert _nearest(index, gallery, 4) == "person4/a.jpg"
+    assert _nearest(index, gallery, 3) == "person3/a.jpg"
+    assert "person1/a.jpg" not in {gallery.sources[row] for row in index.search([_encoding(1)], k=4)[0][0]}
+
+    # Up to date: loaded as saved, nothing rebuilt
+    open_index(gallery, "brute")
+    assert capsys.readouterr().out == ""
+
+
+def test_sync_renumbers_rows_without_rebuilding(tmp_path):
+    gallery = FaceGallery(str(tmp_path))
+    _enroll(gallery, range(3))
+    index = open_index(gallery, "brute")
+
+    _enroll(gallery, [], removed=["person0/a.jpg"])
+    assert index.sync(gallery)
+    assert len(index) == 2
+    assert _nearest(index, gallery, 2) == "person2/a.jpg"
+    assert not index.sync(gallery)
+
+
+def test_open_index_rebuilds_when_kind_or_params_change(tmp_path, capsys):
+    gallery = FaceGallery(str(tmp_path))
+    _enroll(gallery, range(6))
+    open_index(gallery, "brute")
+    capsys.readouterr()
+
+    index = open_index(gallery, "ivf", nlist=2)
+    assert "Rebuilding the brute index" in capsys.readouterr().out
+    assert index.kind == "ivf" and index.params["nlist"] == 2
+
+    index = open_index(gallery, "ivf", nlist=3)
+    assert "Rebuilding the ivf index" in capsys.readouterr().out
+    assert index.params["nlist"] == 3
+    assert _nearest(index, gallery, 5) == "person5/a.jpg"
+
+    open_index(gallery, "ivf", nlist=3)
+    assert capsys.readouterr().out == ""
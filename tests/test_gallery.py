@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+from gallery import FaceGallery, identity_name
+
+
+def _encoding(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+def _entry(sha1):
+    return {"sha1": sha1, "mtime": 0, "size": 0}
+
+
+def _write_images(directory, encodings):
+    # The encoder below maps a file's content back to its encoding, so no face detector is needed
+    for filename in encodings:
+        path = os.path.join(directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(filename)
+
+
+def test_identity_name_groups_numbered_images_and_directories():
+    assert identity_name("Joe.jpg") == "Joe"
+    assert identity_name("Joe2.jpg") == "Joe"
+    assert identity_name("Joe_3.png") == "Joe"
+    assert identity_name("agent007/1.jpg") == "agent007"
+    assert identity_name("007.jpg") == "007"
+
+
+def test_update_caps_each_identity_and_frees_room_on_removal(tmp_path):
+    gallery = FaceGallery(str(tmp_path), max_per_identity=2)
+    gallery.update([(f"Joe{i}.jpg", _entry(str(i)), _encoding(i)) for i in range(3)])
+
+    assert gallery.names == ["Joe", "Joe"]
+    assert gallery.files["Joe2.jpg"] == dict(_entry("2"), row=None, skipped="cap")
+
+    old_to_new = gallery.update([], removed=["Joe0.jpg"])
+    assert list(old_to_new) == [-1, 0]
+    assert gallery.sources == ["Joe1.jpg"]
+    assert gallery.files["Joe1.jpg"]["row"] == 0
+    # The capped image is forgotten, so the next scan encodes it again
+    assert "Joe2.jpg" not in gallery.files
+
+
+def test_update_skips_near_duplicates_of_the_same_person(tmp_path):
+    gallery = FaceGallery(str(tmp_path), duplicate_distance=0.15)
+    joe = _encoding(0)
+    gallery.update([("Joe.jpg", _entry("a"), joe),
+                    ("Joe2.jpg", _entry("b"), joe + 0.001),
+                    ("Steve.jpg", _entry("c"), joe + 0.001)])
+
+    assert gallery.names == ["Joe", "Steve"]
+    assert gallery.files["Joe2.jpg"]["skipped"] == "duplicate"
+    assert gallery.row_keys() == ["Joe.jpg:a", "Steve.jpg:c"]
+
+
+def test_sync_only_encodes_new_or_changed_images(tmp_path):
+    encodings = {"Joe.jpg": _encoding(0), "Joe2.jpg": _encoding(1), "agent007/1.jpg": _encoding(2)}
+    _write_images(str(tmp_path), encodings)
+    encoded = []
+
+    def encode(path):
+        filename = os.path.relpath(path, str(tmp_path)).replace(os.sep, "/")
+        encoded.append(filename)
+        return encodings[filename]
+
+    gallery = FaceGallery(str(tmp_path))
+    assert gallery.sync(encode=encode)
+    assert sorted(encoded) == sorted(encodings)
+    assert sorted(gallery.names) == ["Joe", "Joe", "agent007"]
+
+    loaded = FaceGallery.load(str(tmp_path))
+    assert loaded.generation == 1
+    assert not loaded.sync(encode=encode)
+    assert len(encoded) == 3
+
+    os.remove(tmp_path / "Joe2.jpg")
+    encodings["Steve.jpg"] = _encoding(3)
+    _write_images(str(tmp_path), {"Steve.jpg": None})
+    assert loaded.sync(encode=encode)
+    assert encoded[3:] == ["Steve.jpg"]
+    reloaded = FaceGallery.load(str(tmp_path))
+    assert sorted(reloaded.names) == ["Joe", "Steve", "agent007"]
+    np.testing.assert_array_equal(reloaded.encodings[reloaded.sources.index("Steve.jpg")], encodings["Steve.jpg"])
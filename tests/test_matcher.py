@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from face_index import create_index
+from matcher import FaceMatcher
+
+
+def _vectors(count, seed=0):
+    # Random points far apart compared to the 0.6 threshold
+    return np.random.default_rng(seed).normal(size=(count, 128)).astype(np.float32)
+
+
+def test_best_scores_each_person_by_their_closest_encoding():
+    encodings = _vectors(3)
+    matcher = FaceMatcher(encodings, ["Joe", "Steve", "Joe"])
+
+    query = encodings[2] + 0.01
+    assert matcher.best_matches([query])[0][0] == "Joe"
+    distances = matcher.distances([query])[0]
+    assert distances[matcher.labels.index("Joe")] == pytest.approx(np.linalg.norm(query - encodings[2]), abs=1e-3)
+    assert matcher.best_matches([encodings[1]])[0][0] == "Steve"
+
+
+def test_faces_beyond_the_threshold_are_unknown():
+    encodings = _vectors(2)
+    matcher = FaceMatcher(encodings, ["Joe", "Steve"])
+
+    assert matcher.best_matches([_vectors(1, seed=1)[0]], unknown_confidence=5.0) == [("Unknown", 5.0)]
+    assert FaceMatcher(np.empty((0, 128)), []).best_matches(encodings) == [("Unknown", 1.0)] * 2
+
+
+def test_centroid_keeps_one_mean_encoding_per_person():
+    encodings = _vectors(3)
+    matcher = FaceMatcher(encodings, ["Joe", "Steve", "Joe"], aggregate="centroid")
+
+    assert matcher.encodings.shape == (2, 128)
+    centroid = (encodings[0] + encodings[2]) / 2
+    np.testing.assert_allclose(matcher.encodings[matcher.labels.index("Joe")], centroid, rtol=1e-5)
+    assert matcher.best_matches([centroid])[0][0] == "Joe"
+    with pytest.raises(ValueError):
+        FaceMatcher(encodings, ["Joe", "Steve", "Joe"], aggregate="median")
+
+
+def test_top_k_is_sorted_and_padded():
+    encodings = _vectors(3)
+    matcher = FaceMatcher(encodings, ["Ann", "Bob", "Cid"])
+    query = 0.6 * encodings[1] + 0.4 * encodings[2]
+
+    indices, distances = matcher.top_k([query], k=5)
+    assert [matcher.labels[i] for i in indices[0, :3]] == ["Bob", "Cid", "Ann"]
+    assert np.all(np.diff(distances[0, :3]) >= 0)
+    assert list(indices[0, 3:]) == [-1, -1]
+    assert np.all(np.isinf(distances[0, 3:]))
+    assert [name for name, _, _ in matcher.match([query], k=5)[0]] == ["Bob", "Cid", "Ann"]
+
+
+def test_index_returns_distinct_people():
+    encodings = _vectors(4)
+    names = ["Ann", "Ann", "Bob", "Cid"]
+    index = create_index("brute").build(encodings)
+    scan = FaceMatcher(encodings, names)
+    indexed = FaceMatcher(encodings, names, index=index)
+    query = 0.5 * encodings[0] + 0.3 * encodings[1] + 0.2 * encodings[2]
+
+    expected_indices, expected_distances = scan.top_k([query], k=3)
+    indices, distances = indexed.top_k([query], k=3)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-4)
@@ -0,0 +1,40 @@
+import json
+import os
+import shutil
+
+import pytest
+
+face_recognition = pytest.importorskip("face_recognition")
+
+from matcher import FaceMatcher
+from process_video import DETECTION_FIELDS, OfflineProcessor, RecordWriter
+
+KNOWN_FACES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "known_faces")
+
+
+def _encoding(name):
+    image = face_recognition.load_image_file(os.path.join(KNOWN_FACES, name))
+    return face_recognition.face_encodings(image)[0]
+
+
+def test_image_directory_matches_every_image_on_its_own(tmp_path):
+    # Two different people in one directory: no image may inherit the previous one's identity
+    images = tmp_path / "images"
+    images.mkdir()
+    shutil.copy(os.path.join(KNOWN_FACES, "Joe.jpg"), images / "a_joe.jpg")
+    shutil.copy(os.path.join(KNOWN_FACES, "Steve.jpg"), images / "b_steve.jpg")
+    shutil.copy(os.path.join(KNOWN_FACES, "Steve.jpg"), images / "c_steve.jpg")
+    matcher = FaceMatcher([_encoding("Joe.jpg"), _encoding("Steve.jpg")], ["Joe", "Steve"])
+
+    detections_path = str(tmp_path / "detections.jsonl")
+    detections = RecordWriter(detections_path, DETECTION_FIELDS)
+    processor = OfflineProcessor(matcher, sample_fps=0, workers=1, detections=detections)
+    try:
+        processor.process(str(images), progress_every=0)
+    finally:
+        processor.close()
+        detections.close()
+
+    with open(detections_path, encoding="utf-8") as f:
+        names = {record["frame"]: record["name"] for record in map(json.loads, f)}
+    assert names == {0: "Joe", 1: "Steve", 2: "Steve"}
@@ -0,0 +1,101 @@
+import numpy as np
+
+from matcher import FaceMatcher
+from tracker import FaceTracker
+
+
+def _encoding(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+class _Encoder:
+    """encode_faces() stand-in: the face at a box's left edge below 200 is Joe, others Steve."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, locations):
+        self.calls.append(list(locations))
+        return [_encoding(0) if left < 200 else _encoding(1) for _, _, _, left in locations]
+
+
+def test_update_keeps_ids_of_moving_boxes():
+    tracker = FaceTracker()
+    first = tracker.update([(100, 200, 200, 100), (100, 500, 200, 400)], 0)
+    # Slight shift: matched by IoU
+    second = tracker.update([(104, 505, 204, 405), (102, 203, 202, 103)], 1)
+    assert [track.track_id for track in second] == [first[1].track_id, first[0].track_id]
+
+    # A small box that moved past any overlap is still matched by its center
+    tracker = FaceTracker()
+    small = tracker.update([(0, 20, 20, 0)], 0)[0]
+    assert tracker.update([(0, 28, 20, 8)], 1)[0] is small
+    assert tracker.update([(0, 300, 20, 280)], 2)[0] is not small
+
+
+def test_tracks_expire_after_max_missed_rounds():
+    tracker = FaceTracker(max_missed=2)
+    track = tracker.update([(100, 200, 200, 100)], 0)[0]
+    for frame_index in range(1, 3):
+        tracker.update([], frame_index)
+    assert tracker.update([(100, 200, 200, 100)], 3)[0] is track
+    for frame_index in range(4, 7):
+        tracker.update([], frame_index)
+    assert tracker.tracks == []
+
+
+def test_identify_encodes_new_tracks_and_reverifies_periodically():
+    tracker = FaceTracker(reverify_every=10)
+    matcher = FaceMatcher([_encoding(0), _encoding(1)], ["Joe", "Steve"])
+    encode = _Encoder()
+    faces = [(100, 200, 200, 100), (100, 500, 200, 400)]
+
+    assert [name for name, _ in tracker.identify(faces, 0, encode, matcher)] == ["Joe", "Steve"]
+    for frame_index in range(1, 10):
+        assert [name for name, _ in tracker.identify(faces, frame_index, encode, matcher)] == ["Joe", "Steve"]
+    assert len(encode.calls) == 1
+
+    tracker.identify(faces, 10, encode, matcher)
+    assert len(encode.calls) == 2 and len(encode.calls[1]) == 2
+
+    # Only the newcomer is encoded
+    tracker.identify(faces + [(300, 800, 400, 700)], 11, encode, matcher)
+    assert encode.calls[2] == [(300, 800, 400, 700)]
+
+    tracker.invalidate()
+    tracker.identify(faces, 12, encode, matcher)
+    assert len(encode.calls[3]) == 2
+
+
+def test_uncertain_and_rejected_faces_are_retried_sooner():
+    tracker = FaceTracker(reverify_every=30, retry_uncertain_every=3)
+    matcher = FaceMatcher([_encoding(0)], ["Joe"])
+    encode = _Encoder()
+    face = [(100, 500, 200, 400)]
+
+    assert tracker.identify(face, 0, encode, matcher, unknown_confidence=2.0) == [("Unknown", 2.0)]
+    tracker.identify(face, 2, encode, matcher)
+    tracker.identify(face, 3, encode, matcher)
+    assert len(encode.calls) == 2
+
+    # A face the quality gate rejected stays unknown and is tried again on the next frame
+    tracker = FaceTracker()
+    rejected = tracker.identify(face, 0, lambda locations: [None], matcher)
+    assert rejected == [("Unknown", 1.0)]
+    tracker.identify(face, 1, encode, matcher)
+    assert len(encode.calls) == 3
+
+
+def test_encoding_hints_select_the_faces_identify_will_encode():
+    tracker = FaceTracker(reverify_every=10)
+    matcher = FaceMatcher([_encoding(0), _encoding(1)], ["Joe", "Steve"])
+    encode = _Encoder()
+    tracker.identify([(100, 200, 200, 100)], 0, encode, matcher)
+    tracker.identify([(100, 200, 200, 100), (100, 500, 200, 400)], 5, encode, matcher)
+
+    faces = [(101, 201, 201, 101), (101, 501, 201, 401), (300, 800, 400, 700)]
+    # The first track is known, the second was verified at 5, the third face is new
+    assert tracker.encoding_hints(6).select(faces) == [2]
+    # At 10 the first track is due for re-verification
+    assert tracker.encoding_hints(10).select(faces) == [0, 2]
+    assert tracker.encoding_hints(10).select([]) == []
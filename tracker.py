@@ -0,0 +1,224 @@
+import itertools
+
+import numpy as np
+
+import metrics
+
+
+def box_iou(boxes_a, boxes_b):
+    """IoU between two arrays of (top, right, bottom, left) boxes, shape (A, B)."""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+
+def _centers(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.stack([(boxes[:, 1] + boxes[:, 3]) / 2, (boxes[:, 0] + boxes[:, 2]) / 2], axis=1)
+
+
+class Track:
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        # Box edge velocity in pixels per frame
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.last_seen = frame_index
+        self.misses = 0
+        self.hits = 1
+        # Identity, filled in by FaceTracker.assign()
+        self.name = None
+        self.confidence = 0.0
+        self.encoding = None
+        self.last_verified = None
+
+    def predicted_box(self, frame_index):
+        return self.box + self.velocity * (frame_index - self.last_seen)
+
+    def location(self):
+        top, right, bottom, left = (int(round(v)) for v in self.box)
+        return top, right, bottom, left
+
+
+class FaceTracker:
+    """
+    Multi-face tracker: IoU association with a constant-velocity motion model and a
+    centroid-distance fallback for small, fast-moving boxes.
+
+    Tracks keep their id through up to max_missed detection rounds without a match,
+    and cache their identity and encoding, so the 128-d encoding only has to run for
+    new tracks, uncertain tracks (every retry_uncertain_every frames) and a periodic
+    re-verification every reverify_every frames.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_center_shift=0.5, max_missed=5,
+                 reverify_every=30, retry_uncertain_every=6, min_confidence=75.0, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        # Fallback match when centers moved less than this fraction of the box size
+        self.max_center_shift = max_center_shift
+        self.max_missed = max_missed
+        self.reverify_every = reverify_every
+        self.retry_uncertain_every = retry_uncertain_every
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, face_locations, frame_index):
+        """Associate this frame's boxes with tracks; returns one Track per box, in order."""
+        boxes = [np.asarray(box, dtype=np.float32) for box in face_locations]
+        matches = self._associate(boxes, frame_index)
+
+        assigned = [None] * len(boxes)
+        matched_tracks = set()
+        for track_index, box_index in matches:
+            track = self.tracks[track_index]
+            elapsed = max(frame_index - track.last_seen, 1)
+            step = (boxes[box_index] - track.box) / elapsed
+            track.velocity = self.smoothing * track.velocity + (1 - self.smoothing) * step
+            track.box = boxes[box_index]
+            track.last_seen = frame_index
+            track.misses = 0
+            track.hits += 1
+            assigned[box_index] = track
+            matched_tracks.add(track_index)
+
+        survivors = []
+        for track_index, track in enumerate(self.tracks):
+            if track_index not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_missed:
+                    continue
+            survivors.append(track)
+        for box_index, box in enumerate(boxes):
+            if assigned[box_index] is None:
+                track = Track(next(self._ids), box, frame_index)
+                assigned[box_index] = track
+                survivors.append(track)
+        self.tracks = survivors
+        return assigned
+
+    def _associate(self, boxes, frame_index):
+        if not boxes or not self.tracks:
+            return []
+        predicted = np.stack([track.predicted_box(frame_index) for track in self.tracks])
+        detections = np.stack(boxes)
+        iou = box_iou(predicted, detections)
+
+        matches = []
+        used_tracks = set()
+        used_boxes = set()
+        # Greedy: highest IoU pairs first
+        for flat in np.argsort(-iou, axis=None):
+            t, b = np.unravel_index(flat, iou.shape)
+            if iou[t, b] < self.iou_threshold:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            matches.append((int(t), int(b)))
+            used_tracks.add(t)
+            used_boxes.add(b)
+
+        # Centroid fallback for pairs that moved too far to overlap
+        free_tracks = [t for t in range(len(self.tracks)) if t not in used_tracks]
+        free_boxes = [b for b in range(len(boxes)) if b not in used_boxes]
+        if free_tracks and free_boxes:
+            shift = np.linalg.norm(
+                _centers(predicted[free_tracks])[:, None, :] - _centers(detections[free_boxes])[None, :, :], axis=2)
+            sizes = detections[free_boxes, 2] - detections[free_boxes, 0]
+            shift = shift / np.maximum(sizes, 1)[None, :]
+            for flat in np.argsort(shift, axis=None):
+                i, j = np.unravel_index(flat, shift.shape)
+                if shift[i, j] > self.max_center_shift:
+                    break
+                t, b = free_tracks[i], free_boxes[j]
+                if t in used_tracks or b in used_boxes:
+                    continue
+                matches.append((t, b))
+                used_tracks.add(t)
+                used_boxes.add(b)
+        return matches
+
+    def needs_encoding(self, track, frame_index):
+        if track.last_verified is None:
+            return True
+        since = frame_index - track.last_verified
+        uncertain = track.name == "Unknown" or track.confidence <= self.min_confidence
+        if uncertain:
+            return since >= self.retry_uncertain_every
+        return since >= self.reverify_every
+
+    def encoding_hints(self, frame_index):
+        """What the analysis workers need to skip the encodings identify() will not ask for."""
+        return EncodingHints([track.predicted_box(frame_index) for track in self.tracks],
+                             [self.needs_encoding(track, frame_index) for track in self.tracks],
+                             self.iou_threshold, self.max_center_shift)
+
+    def invalidate(self):
+        """Re-match every track on its next detection, e.g. after the gallery changed."""
+        for track in self.tracks:
+            track.last_verified = None
+
+    def assign(self, track, name, confidence, encoding, frame_index):
+        track.name = name
+        track.confidence = confidence
+        track.encoding = encoding
+        track.last_verified = frame_index
+
+    def identify(self, face_locations, frame_index, encode_faces, matcher, unknown_confidence=1.0):
+        """
+        Track this frame's faces and return one (name, confidence) per location.
+
+        encode_faces(locations) is only called for the tracks that need an encoding,
+        all in one call, and those encodings are matched in one matcher pass. It may
+        return None for a face (one the quality gate rejected): that track keeps its
+        identity, or stays unknown, and is retried on its next detection.
+        """
+        tracks = self.update(face_locations, frame_index)
+        to_encode = [i for i, track in enumerate(tracks) if self.needs_encoding(track, frame_index)]
+        if to_encode:
+            encodings = encode_faces([face_locations[i] for i in to_encode])
+            kept = [(i, encoding) for i, encoding in zip(to_encode, encodings) if encoding is not None]
+            to_encode = [i for i, _ in kept]
+            encodings = [encoding for _, encoding in kept]
+        if to_encode:
+            with metrics.stage("match"):
+                matches = matcher.best_matches(encodings, unknown_confidence=unknown_confidence)
+            for i, encoding, (name, confidence) in zip(to_encode, encodings, matches):
+                self.assign(tracks[i], name, confidence, encoding, frame_index)
+        # A face the encoder could not handle stays unknown until its next retry
+        return [(track.name or "Unknown", track.confidence if track.name else unknown_confidence)
+                for track in tracks]
+
+
+class EncodingHints:
+    """
+    The tracks' boxes predicted for a frame and whether each needs an encoding there.
+
+    Sent with the frame to an analysis worker, which runs the tracker's association on
+    its detections and only encodes the faces select() keeps. The hints are taken when
+    the frame is submitted, before the frames still in flight update the tracks; the
+    error goes to the safe side (an extra encoding) except after invalidate(), when a
+    skipped face comes back as None and is encoded on its next detection.
+    """
+
+    def __init__(self, boxes, needs, iou_threshold, max_center_shift):
+        self.boxes = boxes
+        self.needs = needs
+        self.iou_threshold = iou_threshold
+        self.max_center_shift = max_center_shift
+
+    def select(self, face_locations):
+        """Indices of the faces that match no track or a track that needs an encoding."""
+        tracker = FaceTracker(iou_threshold=self.iou_threshold, max_center_shift=self.max_center_shift)
+        tracker.tracks = [Track(i, box, 0) for i, box in enumerate(self.boxes)]
+        matched = {b: t for t, b in tracker._associate([np.asarray(box, dtype=np.float32) for box in face_locations], 0)}
+        return [i for i in range(len(face_locations)) if i not in matched or self.needs[matched[i]]]
@@ -0,0 +1,155 @@
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+import metrics
+
+
+def open_capture(src):
+    """
+    cv2.VideoCapture for a camera index, video file or stream URL.
+
+    DirectShow is only requested for cameras on Windows; everywhere else (and for
+    files) OpenCV picks the backend, so the same code runs on Linux servers.
+    """
+    if isinstance(src, int) and sys.platform == "win32":
+        return cv2.VideoCapture(src, cv2.CAP_DSHOW)
+    return cv2.VideoCapture(src)
+
+
+# Thread class for video capture
+class VideoCaptureThread(threading.Thread):
+    """
+    Reads frames from a camera on a background thread.
+
+    mode="latest" (default) decodes into a small ring of preallocated buffers and
+    always hands out the newest frame: frames the consumer did not get to in time
+    are dropped (and counted) instead of queueing up, and more() blocks on a
+    condition until a new frame arrives instead of being polled. A frame returned
+    by read() stays valid until the next read().
+
+    mode="queue" keeps the original behaviour: a FIFO of up to queue_size frames.
+    """
+
+    def __init__(self, src=0, width=640, height=480, queue_size=2, mode="latest", buffers=3):
+        super().__init__()
+        self.capture = open_capture(src)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.capture.set(cv2.CAP_PROP_FPS, 30)
+        self.mode = mode
+        self.stopped = False
+
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # Ring of frame buffers: one being written, one published, one held by the reader
+        self.buffers = [None] * max(buffers, 3)
+        self._condition = threading.Condition()
+        self._latest = None  # slot of the newest complete frame
+        self._reading = None  # slot currently held by the consumer
+        self._seq = 0  # sequence number of the newest frame
+        self._read_seq = 0  # sequence number of the last frame handed out
+        self._timestamps = [0.0] * len(self.buffers)
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        # perf_counter() when the frame last returned by read() was captured
+        self.frame_timestamp = None
+
+    def run(self):
+        try:
+            if self.mode == "queue":
+                self._run_queue()
+            else:
+                self._run_latest()
+        finally:
+            # Released here, not in stop(): the capture must not go away under a read()
+            self.capture.release()
+
+    def _run_queue(self):
+        while not self.stopped:
+            if not self.queue.full():
+                ret, frame = self.capture.read()
+                if not ret:
+                    self.stop()
+                    break
+                self.frames_captured += 1
+                self.queue.put((frame, time.perf_counter()))
+            else:
+                time.sleep(0.015)  # Prevent busy waiting
+
+    def _run_latest(self):
+        while not self.stopped:
+            with self._condition:
+                slot = next(i for i in range(len(self.buffers)) if i not in (self._latest, self._reading))
+            buffer = self.buffers[slot]
+            # Decode straight into the preallocated buffer when its shape still fits
+            ret, frame = self.capture.read(buffer) if buffer is not None else self.capture.read()
+            if not ret:
+                self.stop()
+                break
+            if frame is not buffer:
+                # First frame or a resolution change: (re)allocate the slot
+                self.buffers[slot] = frame
+            captured_at = time.perf_counter()
+            with self._condition:
+                if self._seq > self._read_seq:
+                    # The previous frame was never read
+                    self.frames_dropped += 1
+                self._timestamps[slot] = captured_at
+                self._latest = slot
+                self._seq += 1
+                self.frames_captured += 1
+                self._condition.notify_all()
+
+    def more(self, timeout=0.1):
+        """True when a frame is ready for read(); in latest mode waits up to timeout for one."""
+        if self.mode == "queue":
+            return not self.queue.empty()
+        with self._condition:
+            return self._condition.wait_for(lambda: self._seq > self._read_seq or self.stopped, timeout) \
+                and self._seq > self._read_seq
+
+    def read(self, timeout=None):
+        """Return the next frame, or None if none arrived within timeout or the capture stopped."""
+        if self.mode == "queue":
+            try:
+                frame, self.frame_timestamp = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            metrics.observe("capture", time.perf_counter() - self.frame_timestamp, name="frame_age_seconds")
+            return frame
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > self._read_seq or self.stopped, timeout):
+                return None
+            if self._seq == self._read_seq:
+                return None
+            self._reading = self._latest
+            self._read_seq = self._seq
+            self.frame_timestamp = self._timestamps[self._reading]
+            metrics.observe("capture", time.perf_counter() - self.frame_timestamp, name="frame_age_seconds")
+            return self.buffers[self._reading]
+
+    def frame_age(self):
+        """Seconds since the frame last returned by read() was captured."""
+        if self.frame_timestamp is None:
+            return None
+        return time.perf_counter() - self.frame_timestamp
+
+    def stats(self):
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "queue_depth": self.queue.qsize() if self.mode == "queue" else int(self._seq > self._read_seq),
+        }
+
+    def stop(self):
+        self.stopped = True
+        with self._condition:
+            self._condition.notify_all()
+        if not self.is_alive():
+            # Never started or already done: run() will not release it
+            self.capture.release()
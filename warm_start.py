@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+import gallery
+from face_index import FaceIndex
+
+# Everything a camera loop needs to start matching, in one file next to the gallery store:
+# the encodings and names, the search index and the settings they were built with
+WARM_START = "warm_start.npz"
+VERSION = 1
+
+
+def store_stamp(directory):
+    """
+    Identify the saved version of the store in directory, or None if there is none.
+
+    The manifest is rewritten last on every save, so its stat is enough. Take it before
+    loading the store that goes into a snapshot: a save in between then only makes the
+    snapshot look stale.
+    """
+    try:
+        st = os.stat(os.path.join(directory, gallery.GALLERY_MANIFEST))
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def save(store, stamp, index=None, config=None):
+    """
+    Write the rows of store (a gallery.FaceGallery), index and config to WARM_START.
+
+    stamp is store_stamp() from before store was loaded. The index is left out when it
+    has pending entries (it is then opened from the store on load). The encodings are
+    left out for an index that reads them on demand (face_index.QuantizedIndex): load()
+    then maps the store's own matrix. Returns False when the store has never been saved.
+    """
+    if stamp is None:
+        return False
+    arrays = {
+        "version": VERSION,
+        "stamp": np.asarray(stamp, dtype=np.int64),
+        "generation": store.generation,
+        "config": json.dumps(config or {}, sort_keys=True),
+        "names": np.asarray(store.names, dtype=str),
+        "sources": np.asarray(store.sources, dtype=str),
+        "sha1s": np.asarray([store.files[source]["sha1"] for source in store.sources], dtype=str),
+    }
+    if index is None or not index.reads_vectors_on_demand:
+        arrays["encodings"] = np.asarray(store.encodings, dtype=np.float32).reshape(-1, gallery.ENCODING_SIZE)
+    if index is not None and not len(index.delta_rows):
+        arrays.update({"index_" + name: value for name, value in index.arrays().items()})
+    path = os.path.join(store.directory, WARM_START)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return True
+
+
+def load(directory, config=None):
+    """
+    Return (store, index) from the snapshot in directory, reading it in one go.
+
+    Returns None when there is no snapshot, when the store was saved again since it
+    was written (one stat of the manifest tells) or when it was built with another
+    config. index is None when the snapshot has none. The store only carries what
+    matching needs; it is not meant to be synced or saved.
+    """
+    stamp = store_stamp(directory)
+    if stamp is None:
+        return None
+    try:
+        with open(os.path.join(directory, WARM_START), 'rb') as f:
+            data = f.read()
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+    if (int(arrays.get("version", -1)) != VERSION
+            or arrays["stamp"].tolist() != stamp
+            or str(arrays["config"]) != json.dumps(config or {}, sort_keys=True)):
+        return None
+
+    store = gallery.FaceGallery(directory)
+    if "encodings" in arrays:
+        store.encodings = arrays["encodings"]
+    else:
+        # The stamp matched, so the saved matrix holds exactly these rows
+        try:
+            store.encodings = np.load(os.path.join(directory, gallery.GALLERY_ENCODINGS), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if len(store.encodings) != len(arrays["names"]):
+            return None
+    store.names = arrays["names"].tolist()
+    store.sources = arrays["sources"].tolist()
+    store.files = {source: {"sha1": sha1, "row": row}
+                   for row, (source, sha1) in enumerate(zip(store.sources, arrays["sha1s"].tolist()))}
+    store.generation = int(arrays["generation"])
+    index = None
+    index_arrays = {name[len("index_"):]: value for name, value in arrays.items() if name.startswith("index_")}
+    if index_arrays:
+        index = FaceIndex.from_arrays(index_arrays, store)
+    return store, index